@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+'''
+Cache-hit latency while cache misses are running.
+
+Simulates the /getanime handler mix: a handful of cache misses, each of
+which runs a service subprocess for a few seconds, while cache hits keep
+arriving. Every hit is timed from arrival to completion. The benchmark runs
+twice, once with the old blocking subprocess.check_call and once with
+jobRunner.run_command, and prints p50/p99/max hit latency for both.
+
+usage: python benchmarks/cache_hit_latency.py [--misses N] [--miss-seconds S]
+                                              [--hits N] [--hit-interval S]
+'''
+import argparse
+import asyncio
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(PROJECT_ROOT / 'bot'))
+
+from jobRunner import run_command  # noqa: E402
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+async def blocking_miss(cmd):
+    subprocess.check_call(cmd)
+
+
+async def async_miss(cmd):
+    await run_command(cmd)
+
+
+async def cache_hit(latencies, arrived):
+    # stands in for the cached send_video round trip
+    await asyncio.sleep(0.001)
+    latencies.append(time.perf_counter() - arrived)
+
+
+async def run_scenario(miss_handler, args):
+    cmd = [sys.executable, '-c', f'import time; time.sleep({args.miss_seconds})']
+    latencies = []
+    tasks = []
+    for i in range(args.hits):
+        if i < args.misses:
+            tasks.append(asyncio.create_task(miss_handler(cmd)))
+        tasks.append(asyncio.create_task(cache_hit(latencies, time.perf_counter())))
+        await asyncio.sleep(args.hit_interval)
+    await asyncio.gather(*tasks)
+    return latencies
+
+
+def report(name, latencies):
+    print(
+        f'{name:<22} hits={len(latencies):<5} '
+        f'p50={percentile(latencies, 50) * 1000:9.2f}ms '
+        f'p99={percentile(latencies, 99) * 1000:9.2f}ms '
+        f'max={max(latencies) * 1000:9.2f}ms '
+        f'mean={statistics.mean(latencies) * 1000:9.2f}ms'
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--misses', type=int, default=4)
+    parser.add_argument('--miss-seconds', type=float, default=1.0)
+    parser.add_argument('--hits', type=int, default=200)
+    parser.add_argument('--hit-interval', type=float, default=0.01)
+    args = parser.parse_args()
+
+    report('subprocess.check_call', asyncio.run(run_scenario(blocking_miss, args)))
+    report('jobRunner.run_command', asyncio.run(run_scenario(async_miss, args)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+'''
+End-to-end load benchmark of the bot with local stand-ins.
+
+Drives the real getanime and check_document handlers with fake Telegram
+updates. Everything outside the bot process is simulated:
+
+    Telegram   replies and send_video take --telegram-ms each
+    Mongo      tests.fakes.InMemoryCollection, --mongo-ms per call
+    animdl     writes a synthetic --episode-mb .ts at --download-mbps
+    ffmpeg     turns it into episode.mp4 (and result.json) in --remux-ms
+    uploader   takes --upload-mbps, then the agent's video reaches
+               check_document --handoff-ms later
+
+--users chats each send --requests /getanime commands one after another.
+A --hit-ratio share of them asks for an episode seeded into Mongo. The rest
+ask for episodes from a pool of --miss-episodes that starts out empty, so
+concurrent misses can share a fetch and later requests for a fetched
+episode become hits. Latency is measured from the command to the chat
+receiving the video. A request counts as a hit or a miss depending on
+whether its episode was in Mongo when it was sent. The script reports
+p50/p99/max for hits and misses and the overall throughput.
+
+Needs the bot's requirements (python-telegram-bot, pymongo) installed; no
+Telegram or Mongo server is contacted.
+
+usage: python benchmarks/end_to_end.py [--users N] [--requests N] [--hit-ratio R]
+'''
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(PROJECT_ROOT / 'bot'))
+sys.path.append(str(PROJECT_ROOT))
+
+from tests.fakes import InMemoryCollection  # noqa: E402
+
+AGENT_USER_ID = 4242
+HIT_SERIES = 'cached_show'
+MISS_SERIES = 'new_show'
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def make_project_root(tmp, args):
+    """Temporary project root with the botConfig.json the bot reads at import"""
+    config_dir = Path(tmp) / 'bot' / 'config'
+    config_dir.mkdir(parents=True)
+    config = {
+        'bot_token': 'BENCHMARK',
+        'agent_user_id': AGENT_USER_ID,
+        'max_pending_jobs': args.max_pending,
+        'chat_quota': 0,
+        'prefetch_interval': 0,
+    }
+    with open(config_dir / 'botConfig.json', 'w') as f:
+        json.dump(config, f)
+    return Path(tmp)
+
+
+class SlowCollection:
+    """An InMemoryCollection whose every call takes delay seconds (in the executor thread)"""
+
+    def __init__(self, collection, delay):
+        self._collection = collection
+        self._delay = delay
+
+    def __getattr__(self, name):
+        attribute = getattr(self._collection, name)
+        if not callable(attribute):
+            return attribute
+
+        def call(*args, **kwargs):
+            time.sleep(self._delay)
+            return attribute(*args, **kwargs)
+        return call
+
+
+class Deliveries:
+    """Futures resolved when a chat receives the video of an object_id"""
+
+    def __init__(self):
+        self._waiting = {}
+
+    def expect(self, chat_id, object_id):
+        future = asyncio.get_running_loop().create_future()
+        self._waiting[(chat_id, object_id)] = future
+        return future
+
+    def delivered(self, chat_id, file_id):
+        object_id = file_id.split(':', 1)[1]
+        future = self._waiting.pop((chat_id, object_id), None)
+        if future and not future.done():
+            future.set_result(time.perf_counter())
+
+
+class FakeBot:
+    def __init__(self, deliveries, delay):
+        self.deliveries = deliveries
+        self.delay = delay
+        self.calls = 0
+
+    async def send_video(self, chat_id, video, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        self.deliveries.delivered(chat_id, video)
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+
+
+class FakeMessage:
+    def __init__(self, bot, text=None, from_user_id=None, caption=None, file_id=None):
+        self.bot = bot
+        self.text = text
+        self.caption = caption
+        self.from_user = type('User', (), {'id': from_user_id})()
+        self.video = type('Video', (), {'file_id': file_id})() if file_id else None
+        self.replies = []
+
+    async def reply_text(self, text, **kwargs):
+        self.bot.calls += 1
+        self.replies.append(text)
+        await asyncio.sleep(self.bot.delay)
+
+
+class FakeUpdate:
+    def __init__(self, message, chat_id):
+        self.message = message
+        self.effective_chat = type('Chat', (), {'id': chat_id})()
+
+
+class FakeApplication:
+    def create_task(self, coroutine):
+        return asyncio.ensure_future(coroutine)
+
+
+class FakeContext:
+    def __init__(self, bot):
+        self.bot = bot
+        self.application = FakeApplication()
+
+
+class FakeServices:
+    """run_command stand-in playing animdl, ffmpeg and the uploader"""
+
+    def __init__(self, bot_module, context, args):
+        self.bot_module = bot_module
+        self.context = context
+        self.args = args
+        self.episode_bytes = int(args.episode_mb * 1024 ** 2)
+        self.tasks = set()
+        self.downloads = 0
+
+    async def run_command(self, cmd, cwd=None):
+        cmd = [str(part) for part in cmd]
+        if '--skip-remux' in cmd:
+            await self.animdl(Path(cmd[5]), int(cmd[4]))
+        elif '--remux-only' in cmd:
+            await self.ffmpeg(Path(cmd[-1]))
+        elif cmd[1].endswith(os.path.join('uploaderService', 'main.py')):
+            await self.uploader(cmd[2], cmd[4])
+        else:
+            raise RuntimeError(f'unexpected command {cmd}')
+
+    async def animdl(self, download_dir, episode_id):
+        self.downloads += 1
+        await asyncio.sleep(self.args.episode_mb / self.args.download_mbps)
+        ts_dir = download_dir / 'Show'
+        ts_dir.mkdir(parents=True, exist_ok=True)
+        with open(ts_dir / f'E{episode_id:02d}.ts', 'wb') as f:
+            f.truncate(self.episode_bytes)
+
+    async def ffmpeg(self, download_dir):
+        await asyncio.sleep(self.args.remux_ms / 1000)
+        [ts_file] = download_dir.glob('*/*.ts')
+        os.replace(ts_file, download_dir / 'episode.mp4')
+        with open(download_dir / 'result.json', 'w') as f:
+            json.dump({'path': 'episode.mp4', 'size': self.episode_bytes, 'duration': 1420.0,
+                       'container': 'mov,mp4,m4a,3gp,3g2,mj2', 'video': 'h264', 'audio': 'aac'}, f)
+
+    async def uploader(self, filepath, object_id):
+        await asyncio.sleep(self.args.episode_mb / self.args.upload_mbps)
+        task = asyncio.ensure_future(self.agent_video(object_id))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def agent_video(self, object_id):
+        """The uploaded video reaching the bot as a message from the agent account"""
+        await asyncio.sleep(self.args.handoff_ms / 1000)
+        message = FakeMessage(self.context.bot, from_user_id=AGENT_USER_ID,
+                              caption=f'job:{object_id}', file_id=f'FILE:{object_id}')
+        await self.bot_module.check_document(FakeUpdate(message, AGENT_USER_ID), self.context)
+
+
+def seed_hits(collection, count):
+    for episode_id in range(1, count + 1):
+        object_id = f'{HIT_SERIES}-s1-e{episode_id}'
+        collection.insert_one({
+            'series_key': HIT_SERIES, 'series_name': 'Cached Show', 'season_id': 1,
+            'episode_id': episode_id, 'file_id': f'FILE:{object_id}', 'times_queried': 0,
+        })
+
+
+def stored(collection, series_key, episode_id):
+    return any(
+        document['series_key'] == series_key and document['episode_id'] == episode_id
+        for document in list(collection.documents)
+    )
+
+
+async def user(bot_module, context, deliveries, anime, chat_id, rng, args, results):
+    for _ in range(args.requests):
+        if rng.random() < args.hit_ratio:
+            series, name = HIT_SERIES, 'Cached Show'
+            episode_id = rng.randint(1, args.hit_episodes)
+        else:
+            series, name = MISS_SERIES, 'New Show'
+            episode_id = rng.randint(1, args.miss_episodes)
+        kind = 'hit' if stored(anime, series, episode_id) else 'miss'
+        object_id = f'{series}-s1-e{episode_id}'
+        delivered = deliveries.expect(chat_id, object_id)
+        message = FakeMessage(context.bot, text=f'/getanime {name}, 1, {episode_id}')
+
+        started = time.perf_counter()
+        await bot_module.getanime(FakeUpdate(message, chat_id), context)
+        try:
+            finished = await asyncio.wait_for(delivered, args.timeout)
+        except asyncio.TimeoutError:
+            results['failed'] += 1
+            continue
+        results[kind].append(finished - started)
+
+
+def report(name, latencies):
+    if not latencies:
+        print(f'{name:<6} requests=0')
+        return
+    print(
+        f'{name:<6} requests={len(latencies):<5} '
+        f'p50={percentile(latencies, 50) * 1000:9.1f}ms '
+        f'p99={percentile(latencies, 99) * 1000:9.1f}ms '
+        f'max={max(latencies) * 1000:9.1f}ms '
+        f'mean={statistics.mean(latencies) * 1000:9.1f}ms'
+    )
+
+
+async def run(args, project_root):
+    import database
+    import botUtils
+    import bot as bot_module
+
+    logging.getLogger().setLevel(logging.WARNING)
+    botUtils.PROJECT_ROOT = project_root
+    anime = InMemoryCollection()
+    seed_hits(anime, args.hit_episodes)
+    database.col = SlowCollection(anime, args.mongo_ms / 1000)
+    database.jobs_col = SlowCollection(InMemoryCollection(), args.mongo_ms / 1000)
+
+    deliveries = Deliveries()
+    context = FakeContext(FakeBot(deliveries, args.telegram_ms / 1000))
+    services = FakeServices(bot_module, context, args)
+    bot_module.run_command = services.run_command
+    bot_module.pipeline.start()
+
+    results = {'hit': [], 'miss': [], 'failed': 0}
+    rng = random.Random(args.seed)
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        user(bot_module, context, deliveries, anime, 1000 + index, random.Random(rng.random()),
+             args, results)
+        for index in range(args.users)
+    ))
+    elapsed = time.perf_counter() - started
+    await bot_module.pipeline.stop()
+    await database.flushQueryIncrementsAsync()
+
+    done = len(results['hit']) + len(results['miss'])
+    print(f'users={args.users} requests/user={args.requests} hit_ratio={args.hit_ratio}')
+    report('hit', results['hit'])
+    report('miss', results['miss'])
+    print(f'throughput={done / elapsed:.1f} req/s over {elapsed:.1f}s, '
+          f'failed={results["failed"]}, downloads={services.downloads}, '
+          f'telegram calls={context.bot.calls}, mongo ops={len(anime.operations)}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--requests', type=int, default=10)
+    parser.add_argument('--hit-ratio', type=float, default=0.8)
+    parser.add_argument('--hit-episodes', type=int, default=200)
+    parser.add_argument('--miss-episodes', type=int, default=100)
+    parser.add_argument('--telegram-ms', type=float, default=30)
+    parser.add_argument('--mongo-ms', type=float, default=2)
+    parser.add_argument('--episode-mb', type=float, default=1)
+    parser.add_argument('--download-mbps', type=float, default=20)
+    parser.add_argument('--remux-ms', type=float, default=50)
+    parser.add_argument('--upload-mbps', type=float, default=10)
+    parser.add_argument('--handoff-ms', type=float, default=100)
+    parser.add_argument('--max-pending', type=int, default=256)
+    parser.add_argument('--timeout', type=float, default=120)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix='meido-bench-')
+    try:
+        project_root = make_project_root(tmp, args)
+        # read by bot.py at import time
+        os.environ['MEIDO_PROJECT_ROOT'] = str(project_root)
+        asyncio.run(run(args, project_root))
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+'''
+Finding a finished episode file among many cached episodes.
+
+Builds a synthetic downloads/ tree of --episodes episode directories (each
+with an episode.mp4 and the downloader's result.json) and times looking up
+random episodes, present and missing, two ways: the os.walk scan
+getalltsfiles used to fall back to, and read_download_result /
+getalltsfiles on the episode's deterministic path. Prints p50/p99/mean
+lookup time and how often the scan returned another episode's file.
+
+usage: python benchmarks/episode_lookup.py [--episodes N] [--lookups N]
+'''
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(PROJECT_ROOT / 'bot'))
+
+import botUtils  # noqa: E402
+from botUtils import get_download_path, getalltsfiles, read_download_result  # noqa: E402
+
+EPISODES_PER_SEASON = 24
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def legacy_scan(root):
+    """The removed fallback: the first .mp4 anywhere under the project"""
+    for walk_root, _, files in os.walk(root):
+        for file in files:
+            if file.split(".")[-1].lower() == 'mp4':
+                return os.path.normpath(os.path.join(walk_root, file))
+    return None
+
+
+def episode_keys(count):
+    for index in range(count):
+        yield (f'series_{index // EPISODES_PER_SEASON:04d}', 1, index % EPISODES_PER_SEASON + 1)
+
+
+def build_tree(count):
+    for key in episode_keys(count):
+        download_dir, mp4_file = get_download_path(*key)
+        download_dir.mkdir(parents=True)
+        mp4_file.write_bytes(b'\0' * 64)
+        with open(download_dir / 'result.json', 'w') as f:
+            json.dump({'path': 'episode.mp4', 'size': 64, 'duration': 1420.0,
+                       'container': 'mov,mp4,m4a,3gp,3g2,mj2', 'video': 'h264', 'audio': 'aac'}, f)
+
+
+def time_lookups(name, keys, lookup):
+    latencies = []
+    wrong = 0
+    for key in keys:
+        expected = str(get_download_path(*key)[1]) if key[2] <= EPISODES_PER_SEASON else None
+        started = time.perf_counter()
+        found = lookup(key)
+        latencies.append(time.perf_counter() - started)
+        wrong += found != expected
+    print(
+        f'{name:<34} lookups={len(latencies):<5} '
+        f'p50={percentile(latencies, 50) * 1000:9.3f}ms '
+        f'p99={percentile(latencies, 99) * 1000:9.3f}ms '
+        f'mean={statistics.mean(latencies) * 1000:9.3f}ms '
+        f'wrong={wrong}'
+    )
+
+
+def by_result(key):
+    result = read_download_result(get_download_path(*key)[0])
+    return result['path'] if result else getalltsfiles(*key)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--episodes', type=int, default=10000)
+    parser.add_argument('--lookups', type=int, default=200)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        botUtils.PROJECT_ROOT = Path(tmp)
+        started = time.perf_counter()
+        build_tree(args.episodes)
+        print(f'built {args.episodes} episode directories in {time.perf_counter() - started:.1f}s')
+
+        rng = random.Random(0)
+        present = rng.sample(list(episode_keys(args.episodes)), min(args.lookups, args.episodes))
+        # not downloaded yet: an episode number past the end of every season
+        missing = [(key[0], key[1], EPISODES_PER_SEASON + 1) for key in present]
+
+        time_lookups('os.walk scan (present)', present, lambda key: legacy_scan(tmp))
+        time_lookups('os.walk scan (missing)', missing, lambda key: legacy_scan(tmp))
+        time_lookups('result.json (present)', present, by_result)
+        time_lookups('result.json (missing)', missing, by_result)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,191 @@
+'''
+Disk cache of downloaded episodes.
+
+Every episode directory under downloads/ (downloads/<series_key>/SxxEyy/)
+is tracked here instead of being deleted after its upload, so a re-upload
+(say after Telegram dropped a file_id) or a retry after a failed upload
+starts from the file on disk. A directory counts with everything in it: the
+episode.mp4, the downloader's own files and whatever a failed or interrupted
+download left behind (segments, a partial .ts). The cache keeps to a size
+budget and to a minimum of free disk space by deleting the least recently
+used directories. Episodes of jobs still in progress are pinned and never
+evicted. scan() indexes whatever a previous run left on disk.
+
+Paths passed in are files of the episode (its episode.mp4); the cache works
+on their directory.
+'''
+import logging
+import shutil
+from collections import OrderedDict
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+GB = 1024 ** 3
+DEFAULT_MAX_BYTES = 20 * GB
+DEFAULT_MIN_FREE_BYTES = 2 * GB
+
+
+def directory_usage(directory):
+    """(bytes, newest mtime) of the files under directory, None if it is gone"""
+    directory = Path(directory)
+    if not directory.is_dir():
+        return None
+    size = 0
+    mtime = 0.0
+    for path in directory.rglob('*'):
+        try:
+            stat = path.stat()
+        except OSError:
+            continue
+        if path.is_file():
+            size += stat.st_size
+            mtime = max(mtime, stat.st_mtime)
+    return size, mtime
+
+
+class ArtifactCache:
+    def __init__(self, root, max_bytes=DEFAULT_MAX_BYTES, min_free_bytes=DEFAULT_MIN_FREE_BYTES,
+                 disk_usage=shutil.disk_usage):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.min_free_bytes = min_free_bytes
+        self.disk_usage = disk_usage
+        # episode directory -> size in bytes, least recently used first
+        self._entries = OrderedDict()
+        self._pins = {}
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.evicted_bytes = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, path):
+        return Path(path).parent in self._entries
+
+    def scan(self):
+        """Index the episode directories already on disk, oldest first; returns how many"""
+        found = []
+        if self.root.is_dir():
+            # dot directories are batch downloads still being split up
+            for directory in self.root.glob('*/*'):
+                if directory.name.startswith('.'):
+                    continue
+                usage = directory_usage(directory)
+                if usage and usage[0]:
+                    found.append((usage[1], directory, usage[0]))
+        for _, directory, size in sorted(found):
+            self._track(directory, size)
+        self.evict()
+        logger.info(f'Artifact cache: indexed {len(found)} episodes, {self.bytes / GB:.2f} GB')
+        return len(found)
+
+    def _track(self, directory, size):
+        self.bytes += size - self._entries.get(directory, 0)
+        self._entries[directory] = size
+        self._entries.move_to_end(directory)
+
+    def _refresh(self, directory):
+        """Track directory at its current size, or forget it once nothing is left"""
+        usage = directory_usage(directory)
+        if not usage or not usage[0]:
+            self._forget(directory)
+            return False
+        self._track(directory, usage[0])
+        return True
+
+    def add(self, path):
+        """
+        Track the episode of path (or refresh its size), finished or not,
+        and make room for it
+        """
+        if self._refresh(Path(path).parent):
+            self.evict()
+
+    def get(self, path):
+        """path if the file is cached and still on disk (marking it used), else None"""
+        path = Path(path)
+        if path.parent in self._entries and path.is_file():
+            self._entries.move_to_end(path.parent)
+            self.hits += 1
+            return path
+        if path.parent in self._entries:
+            # leftovers of a download still count
+            self._refresh(path.parent)
+        self.misses += 1
+        return None
+
+    def discard(self, path):
+        """Forget the episode of path without deleting it"""
+        self._forget(Path(path).parent)
+
+    def _forget(self, directory):
+        size = self._entries.pop(directory, None)
+        if size is not None:
+            self.bytes -= size
+
+    def pin(self, path):
+        """Keep the episode of path from being evicted until unpin (pins nest)"""
+        directory = Path(path).parent
+        self._pins[directory] = self._pins.get(directory, 0) + 1
+
+    def unpin(self, path):
+        directory = Path(path).parent
+        count = self._pins.get(directory, 0) - 1
+        if count > 0:
+            self._pins[directory] = count
+        else:
+            self._pins.pop(directory, None)
+
+    def _free_bytes(self):
+        try:
+            return self.disk_usage(self.root).free
+        except OSError:
+            # no downloads/ yet: nothing to free either
+            return None
+
+    def _over_budget(self):
+        if self.bytes > self.max_bytes:
+            return True
+        free = self._free_bytes()
+        return free is not None and free < self.min_free_bytes
+
+    def evict(self):
+        """Delete least recently used, unpinned episode directories while over budget"""
+        for directory in list(self._entries):
+            if not self._over_budget():
+                break
+            if directory in self._pins:
+                continue
+            size = self._entries[directory]
+            self._forget(directory)
+            try:
+                shutil.rmtree(directory)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.warning(f'Could not evict {directory}: {e}')
+                continue
+            try:
+                # the series directory, once nothing else is left in it
+                directory.parent.rmdir()
+            except OSError:
+                pass
+            self.evictions += 1
+            self.evicted_bytes += size
+            logger.info(f'Evicted {directory} ({size / 1024 ** 2:.0f} MB)')
+
+    def stats(self):
+        return {
+            'episodes': len(self._entries),
+            'bytes': self.bytes,
+            'max_bytes': self.max_bytes,
+            'pinned': len(self._pins),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'evicted_bytes': self.evicted_bytes,
+        }
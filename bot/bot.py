@@ -1,19 +1,41 @@
 #!/usr/bin/env python3
 
+import asyncio
 import logging
 import json
 import sys
 import os
+import time
 from pathlib import Path
-from datetime import datetime
+from datetime import datetime, timedelta
 from telegram import Update
 from telegram.ext import (
-    Application, CommandHandler, MessageHandler, ContextTypes, filters
+    Application, BaseRateLimiter, CommandHandler, MessageHandler, ContextTypes, filters
 )
 from botUtils import (
-    showhelp, parse_search_query, getalltsfiles, normalize_series_name, get_download_path
+    showhelp, parse_search_query, getalltsfiles, normalize_series_name, get_download_path,
+    format_episode_range, format_eta, read_download_result, EPISODE_FILENAME, DOWNLOAD_DONE_NAME,
+    MAX_EPISODE_RANGE
 )
-from database import getData, postData, updateData
+from database import (
+    getDataAsync, getDataAndCountAsync, getEpisodesAsync, saveEpisodeAsync, queueQueryIncrement, flushQueryIncrementsAsync,
+    init_database, close_database, getPopularEpisodesAsync,
+    saveJobAsync, addJobChatAsync, updateJobStateAsync, getUnfinishedJobsAsync, getJobAsync,
+    setLatencyObserver,
+    JOB_DOWNLOADING, JOB_REMUXING, JOB_UPLOADING, JOB_DELIVERED, JOB_FAILED
+)
+from jobRunner import run_command
+from inflight import InflightRegistry
+from uploaderClient import upload_via_daemon, UploadError
+from pipeline import (
+    Pipeline, EpisodeJob, AdmissionError, QuotaExceeded,
+    DEFAULT_MAX_PENDING, DEFAULT_CHAT_QUOTA
+)
+from episodeCache import EpisodeCache, DEFAULT_MAXSIZE, DEFAULT_TTL
+from artifactCache import ArtifactCache, GB
+from prefetcher import Prefetcher, DEFAULT_BUDGET, DEFAULT_WINDOW_HOURS
+from rateLimiter import RateLimiter, DEFAULT_GLOBAL_RATE, DEFAULT_CHAT_RATE, DEFAULT_CHAT_BURST
+from metrics import Registry, MetricsServer
 import subprocess
 
 BOT_VERSION = 0.1
@@ -49,6 +71,103 @@ API_TOKEN = configdata.get("bot_token")
 if not API_TOKEN:
     raise Exception('bot_token not found in config file!')
 
+# chat_id used for fetches nobody asked for yet (pre-fetching)
+PREFETCH_CHAT_ID = 0
+
+# the uploader captions each video with the job it belongs to
+JOB_CAPTION_PREFIX = 'job:'
+
+# fire-and-forget tasks, referenced here so they are not garbage collected
+background_tasks = set()
+
+# episodes currently being downloaded/uploaded, keyed by object_id
+inflight = InflightRegistry()
+
+prefetcher = Prefetcher(
+    budget=configdata.get('prefetch_budget', DEFAULT_BUDGET),
+    window_hours=configdata.get('prefetch_window_hours', DEFAULT_WINDOW_HOURS)
+)
+
+# hot (series_key, season_id, episode_id) -> file_id lookups
+episode_cache = EpisodeCache(
+    maxsize=configdata.get('episode_cache_size', DEFAULT_MAXSIZE),
+    ttl=configdata.get('episode_cache_ttl', DEFAULT_TTL)
+)
+
+# finished episode files kept under downloads/ for re-uploads
+artifact_cache = ArtifactCache(
+    PROJECT_ROOT / 'downloads',
+    max_bytes=configdata.get('artifact_cache_gb', 20) * GB,
+    min_free_bytes=configdata.get('min_free_disk_gb', 2) * GB
+)
+
+# shapes every outgoing Bot API call (see TelegramRateLimiter)
+rate_limiter = RateLimiter(
+    global_rate=configdata.get('telegram_global_rate', DEFAULT_GLOBAL_RATE),
+    chat_rate=configdata.get('telegram_chat_rate', DEFAULT_CHAT_RATE),
+    chat_burst=configdata.get('telegram_chat_burst', DEFAULT_CHAT_BURST)
+)
+
+# served on /metrics when metrics_port is set; the lambdas read the module
+# globals at scrape time
+metrics = Registry()
+episode_lookups = metrics.counter(
+    'meido_episode_lookups_total', 'Episode lookups by where they were answered', ('result',)
+)
+mongo_seconds = metrics.histogram(
+    'meido_mongo_seconds', 'Latency of awaitable Mongo calls', ('operation',)
+)
+stage_seconds = metrics.histogram(
+    'meido_stage_seconds', 'Time spent in each pipeline stage', ('stage',)
+)
+stage_failures = metrics.counter(
+    'meido_stage_failures_total', 'Pipeline stages that raised', ('stage',)
+)
+upload_bytes = metrics.counter('meido_upload_bytes_total', 'Bytes of episodes uploaded')
+upload_mbps = metrics.histogram(
+    'meido_upload_mbps', 'Upload throughput in MB/s', buckets=(0.5, 1, 2, 5, 10, 20, 50, 100)
+)
+request_seconds = metrics.histogram(
+    'meido_request_seconds', 'Time from /getanime to the video being sent', ('path',)
+)
+metrics.gauge('meido_pipeline_pending', 'Admitted jobs not finished yet',
+              func=lambda: pipeline.pending())
+metrics.gauge('meido_pipeline_queue_depth', 'Jobs waiting in front of each stage', ('stage',),
+              func=lambda: {(stage,): depth for stage, depth in pipeline.depth().items()})
+metrics.gauge('meido_inflight_fetches', 'Episodes being fetched', func=lambda: len(inflight))
+metrics.stats_gauge('meido_episode_cache', 'Episode cache counters', lambda: episode_cache.stats())
+metrics.stats_gauge('meido_artifact_cache', 'Artifact cache counters', lambda: artifact_cache.stats())
+metrics.stats_gauge('meido_rate_limiter', 'Telegram rate limiter counters', lambda: rate_limiter.stats())
+setLatencyObserver(lambda operation, seconds: mongo_seconds.observe(seconds, operation=operation))
+
+metrics_server = MetricsServer(
+    metrics,
+    host=configdata.get('metrics_host', '127.0.0.1'),
+    port=configdata.get('metrics_port', 0)
+)
+
+
+class TelegramRateLimiter(BaseRateLimiter):
+    '''
+    python-telegram-bot hook that sends every request addressed to a chat
+    (send_video, reply_text, send_message, ...) through rate_limiter
+    '''
+    def __init__(self, limiter):
+        self.limiter = limiter
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        chat_id = data.get('chat_id')
+        if chat_id is None:
+            # getUpdates, getMe, getFile... are not messages
+            return await callback(*args, **kwargs)
+        return await self.limiter.run(chat_id, callback, *args, **kwargs)
+
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     message = (
@@ -64,12 +183,91 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(text)
 
 
+async def lookup_episode(series_key, season_id, episode_id, count=False):
+    """
+    Find an episode document, answering from the in-process cache when
+    possible. Cached answers only carry the key fields and file_id.
+    With count the lookup also counts as a user query: write-behind for a
+    cached answer, in the same find_one_and_update for a Mongo one.
+    """
+    cache_key = (series_key, season_id, episode_id)
+    # Use series_key for database queries
+    search_in_mongodb = {
+        "series_key": series_key,
+        "season_id": season_id,
+        "episode_id": episode_id
+    }
+    file_id = episode_cache.get(cache_key)
+    if file_id:
+        episode_lookups.inc(result='memory')
+        anime_name = dict(search_in_mongodb, file_id=file_id)
+        if count:
+            count_query(anime_name)
+        return anime_name
+
+    logger.info('search_in_mongodb:"%s"', search_in_mongodb)
+    if count:
+        anime_name = await getDataAndCountAsync(search_in_mongodb)
+    else:
+        anime_name = await getDataAsync(search_in_mongodb)
+    if anime_name:
+        episode_cache.put(cache_key, anime_name.get("file_id"))
+    episode_lookups.inc(result='mongo' if anime_name else 'miss')
+    return anime_name
+
+
+async def lookup_episodes(series_key, season_id, episode_ids):
+    """
+    lookup_episode(..., count=True) for several episodes of a season, with
+    the ones not in the in-process cache found by a single Mongo query.
+    Returns {episode_id: document} for the episodes found.
+    """
+    found = {}
+    uncached = []
+    for episode_id in episode_ids:
+        file_id = episode_cache.get((series_key, season_id, episode_id))
+        if file_id:
+            episode_lookups.inc(result='memory')
+            found[episode_id] = {"series_key": series_key, "season_id": season_id,
+                                 "episode_id": episode_id, "file_id": file_id}
+        else:
+            uncached.append(episode_id)
+
+    if uncached:
+        for anime_name in await getEpisodesAsync(series_key, season_id, uncached):
+            episode_id = anime_name["episode_id"]
+            episode_cache.put((series_key, season_id, episode_id), anime_name.get("file_id"))
+            found[episode_id] = anime_name
+        for episode_id in uncached:
+            episode_lookups.inc(result='mongo' if episode_id in found else 'miss')
+
+    for anime_name in found.values():
+        count_query(anime_name)
+    return found
+
+
+def count_query(anime_name):
+    """
+    Bump times_queried write-behind; the counts are flushed in bulk by
+    flush_query_counts, or right away in the background once enough piled up.
+    """
+    if queueQueryIncrement(anime_name):
+        task = asyncio.ensure_future(flushQueryIncrementsAsync())
+        background_tasks.add(task)
+        task.add_done_callback(background_tasks.discard)
+
+
+async def flush_query_counts(context: ContextTypes.DEFAULT_TYPE):
+    await flushQueryIncrementsAsync()
+
+
 async def getanime(update: Update, context: ContextTypes.DEFAULT_TYPE):
     '''
     Fetches the anime file on the mongo db and then if not found,
     downloads the anime using animdl
     '''
     logger.info('download function is called!')
+    received = time.monotonic()
 
     chat_id = update.effective_chat.id
     rawUserInput = update.message.text
@@ -83,27 +281,23 @@ async def getanime(update: Update, context: ContextTypes.DEFAULT_TYPE):
         series_key = normalize_series_name(series_name)
         season_id = userdata.get('season_id')
         episode_id = userdata.get('episode_id')
+        episode_end = userdata.get('episode_end', episode_id)
 
-        reply_msg = (
-            f"Checking Internal Db\n"
-            f"Anime: {series_name}\n"
-            f"Season: {season_id}\n"
-            f"Episode: {episode_id}"
-        )
-        await update.message.reply_text(reply_msg)
-        logger.info('search_in_mongodb:"%s"', userdata)
-
-        # Use series_key for database queries
-        search_in_mongodb = {
-            "series_key": series_key,
-            "season_id": season_id,
-            "episode_id": episode_id
-        }
-        anime_name = getData(search_in_mongodb)
+        if episode_end > episode_id:
+            if userdata.get('requested_end', episode_end) > episode_end:
+                await update.message.reply_text(
+                    f"Only {MAX_EPISODE_RANGE} episodes can be fetched at once, "
+                    f"getting episodes {episode_id}-{episode_end}"
+                )
+            await getanime_range(update, context, series_name, series_key,
+                                 season_id, episode_id, episode_end)
+            return
+
+        # a hit is answered with the video alone, no status message first
+        anime_name = await lookup_episode(series_key, season_id, episode_id, count=True)
         if anime_name:
             logger.info('Got data from mongoDB')
             logger.info(anime_name)
-            updateData(anime_name)
             try:
                 if anime_name.get("file_id"):
                     await context.bot.send_video(
@@ -113,6 +307,7 @@ async def getanime(update: Update, context: ContextTypes.DEFAULT_TYPE):
                         read_timeout=120,
                         write_timeout=120
                     )
+                    request_seconds.observe(time.monotonic() - received, path='hit')
                     return  # Exit early since we found and sent the video
                 else:
                     msg = "Anime found in database but file_id is missing"
@@ -120,67 +315,436 @@ async def getanime(update: Update, context: ContextTypes.DEFAULT_TYPE):
             except Exception as e:
                 logger.error(f"Error sending video: {e}")
                 logger.info("Cache miss - file_id failed, falling back to re-download")
+                episode_cache.invalidate((series_key, season_id, episode_id))
                 await update.message.reply_text("Error sending cached video. Re-downloading...")
                 # Fall through to download logic
+        else:
+            reply_msg = (
+                f"Not in Internal Db yet\n"
+                f"Anime: {series_name}\n"
+                f"Season: {season_id}\n"
+                f"Episode: {episode_id}"
+            )
+            await update.message.reply_text(reply_msg)
 
         # Only download and upload if anime not found in database or cache failed
+        # Create object_id with season: series_key-s{season_id}-e{episode_id}
+        object_id = f"{series_key}-s{season_id}-e{episode_id}"
+        if not inflight.join(object_id, chat_id):
+            await addJobChatAsync(object_id, chat_id)
+            await update.message.reply_text(
+                f"{series_name} - S{season_id}E{episode_id} is already being fetched, "
+                "you will get it as soon as it is ready!"
+            )
+            return
+
         logger.info('Anime not found in database, downloading...')
         
         # Get deterministic download path
         download_dir, expected_mp4 = get_download_path(series_key, season_id, episode_id)
+
+        job = EpisodeJob(
+            series_name, series_key, season_id, episode_id, chat_id, download_dir,
+            notify=update.message.reply_text
+        )
+        try:
+            position, eta = pipeline.admit(job)
+        except AdmissionError as e:
+            logger.info(f"Not admitting {object_id}: {e}")
+            await update.message.reply_text(admission_reply(e))
+            await notify_failed_waiters(context, object_id, chat_id)
+            return
+        inflight.attach_job(object_id, job)
+        # chats may have joined while this request was awaiting
+        await saveJobAsync(job_document(job), inflight.chat_ids(object_id))
+        await update.message.reply_text(f"You are #{position} in queue, ETA {format_eta(eta)}")
+
         download_dir.mkdir(parents=True, exist_ok=True)
+        # a file kept from an earlier upload only needs uploading again
+        start_stage = 'remux' if artifact_cache.get(expected_mp4) else 'download'
+        try:
+            await submit_pinned(job, start_stage)
+        except FileNotFoundError as e:
+            logger.error(f"Downloaded file missing: {e}")
+            await update.message.reply_text("Error: Could not find downloaded file")
+            await notify_failed_waiters(context, object_id, chat_id, error=e)
+        except (subprocess.CalledProcessError, UploadError) as e:
+            logger.error(f"Error in subprocess call: {e}")
+            await update.message.reply_text("Error during download/upload process. Please retry.")
+            await notify_failed_waiters(context, object_id, chat_id, error=e)
+        except Exception as e:
+            logger.error(f"Unexpected error: {e}")
+            await update.message.reply_text("An unexpected error occurred. Please retry.")
+            await notify_failed_waiters(context, object_id, chat_id, error=e)
+
+    else:
+        await update.message.reply_text("Please refer to /help")
+
+
+async def getanime_range(update, context, series_name, series_key, season_id,
+                         first_episode, last_episode):
+    '''
+    Handles /getanime for an episode range: cached episodes are sent straight
+    away, the missing ones are downloaded in a single animdl run and then
+    uploaded one by one through the pipeline. Episodes still on disk skip the
+    download, and in stream mode every episode is streamed on its own.
+    '''
+    chat_id = update.effective_chat.id
+    reply_msg = (
+        f"Checking Internal Db\n"
+        f"Anime: {series_name}\n"
+        f"Season: {season_id}\n"
+        f"Episodes: {first_episode}-{last_episode}"
+    )
+    await update.message.reply_text(reply_msg)
+
+    found = await lookup_episodes(series_key, season_id, range(first_episode, last_episode + 1))
+    missing = []
+    for episode_id in range(first_episode, last_episode + 1):
+        anime_name = found.get(episode_id)
+        if anime_name and anime_name.get("file_id"):
+            try:
+                await context.bot.send_video(
+                    chat_id=chat_id,
+                    video=anime_name.get("file_id"),
+                    supports_streaming=True,
+                    read_timeout=120,
+                    write_timeout=120
+                )
+                continue
+            except Exception as e:
+                logger.error(f"Error sending cached episode {episode_id}: {e}")
+                episode_cache.invalidate((series_key, season_id, episode_id))
+        missing.append(episode_id)
+
+    if not missing:
+        return
+
+    # episodes somebody else is already fetching are delivered by their fetch
+    leaders = []
+    for episode_id in missing:
+        object_id = f"{series_key}-s{season_id}-e{episode_id}"
+        if inflight.join(object_id, chat_id):
+            leaders.append(episode_id)
+        else:
+            await addJobChatAsync(object_id, chat_id)
+    if not leaders:
+        await update.message.reply_text(
+            f"Episodes {format_episode_range(missing)} are already being fetched, "
+            "you will get them as soon as they are ready!"
+        )
+        return
+
+    jobs = [
+        EpisodeJob(series_name, series_key, season_id, episode_id, chat_id,
+                   get_download_path(series_key, season_id, episode_id)[0])
+        for episode_id in leaders
+    ]
+    try:
+        position, eta = pipeline.admit(*jobs)
+    except AdmissionError as e:
+        logger.info(f"Not admitting {series_key} S{season_id} range: {e}")
+        await update.message.reply_text(admission_reply(e))
+        for job in jobs:
+            await notify_failed_waiters(context, job.object_id, chat_id)
+        return
 
-        # Use absolute path for downloader service
+    for job in jobs:
+        inflight.attach_job(job.object_id, job)
+        await saveJobAsync(job_document(job), inflight.chat_ids(job.object_id))
+
+    await update.message.reply_text(
+        f"Fetching {series_name} - S{season_id} episodes {format_episode_range(leaders)}\n"
+        f"You are #{position} in queue, ETA {format_eta(eta)}"
+    )
+
+    # a file kept from an earlier upload only needs uploading again, and a
+    # streamed episode is fetched by its own download stage; the remux stage
+    # only checks the file is there
+    stream_mode = configdata.get('download_mode') == 'stream'
+    start_stages = {}
+    batch = []
+    for job in jobs:
+        if artifact_cache.get(get_download_path(series_key, season_id, job.episode_id)[1]):
+            start_stages[job.object_id] = 'remux'
+        elif stream_mode:
+            start_stages[job.object_id] = 'download'
+        else:
+            start_stages[job.object_id] = 'remux'
+            batch.append(job)
+
+    if batch:
+        episode_range = format_episode_range(job.episode_id for job in batch)
+        series_dir = batch[0].download_dir.parent
+        series_dir.mkdir(parents=True, exist_ok=True)
         downloader_script = PROJECT_ROOT / 'downloaderService' / 'main.py'
         cmd = [
             sys.executable,
             str(downloader_script),
             series_name,
             str(season_id),
-            str(episode_id),
-            str(download_dir)
+            episode_range,
+            str(series_dir),
+            '--batch'
         ]
-        
         try:
-            subprocess.check_call(cmd, cwd=str(PROJECT_ROOT))
-            reply_msg = f"{series_name} - S{season_id}E{episode_id} is done downloading!"
-            await update.message.reply_text(reply_msg)
+            # counts against the download stage's workers like any other download
+            await pipeline.run_batch('download', batch, lambda: run_command(cmd, cwd=str(PROJECT_ROOT)))
+        except Exception as e:
+            logger.error(f"Batch download failed: {e}")
+            await update.message.reply_text(
+                f"Could not download episodes {episode_range}. Please retry."
+            )
+            for job in batch:
+                pipeline.release(job)
+                await notify_failed_waiters(context, job.object_id, chat_id, error=e)
+            jobs = [job for job in jobs if job not in batch]
+        else:
+            await update.message.reply_text(
+                f"{series_name} - S{season_id} episodes {episode_range} are done downloading!"
+            )
+
+    for job in jobs:
+        job.download_dir.mkdir(parents=True, exist_ok=True)
+    results = await asyncio.gather(
+        *(submit_pinned(job, start_stages[job.object_id]) for job in jobs),
+        return_exceptions=True
+    )
+
+    failed = []
+    for job, result in zip(jobs, results):
+        if isinstance(result, BaseException):
+            logger.error(f"Fetching {job.object_id} failed: {result}")
+            failed.append(job.episode_id)
+            await notify_failed_waiters(context, job.object_id, chat_id, error=result)
+    if failed:
+        await update.message.reply_text(
+            f"Could not fetch episodes {format_episode_range(failed)}. Please retry."
+        )
+
+
+async def download_stage(job):
+    """Download the episode; the .ts is left for the remux stage"""
+    # Use absolute path for downloader service
+    downloader_script = PROJECT_ROOT / 'downloaderService' / 'main.py'
+    cmd = [
+        sys.executable,
+        str(downloader_script),
+        job.series_name,
+        str(job.season_id),
+        str(job.episode_id),
+        str(job.download_dir),
+        '--skip-remux'
+    ]
+    if configdata.get('download_mode') == 'stream':
+        cmd.append('--stream')
+    await run_command(cmd, cwd=str(PROJECT_ROOT))
+
+    if job.notify:
+        await job.notify(f"{job.series_name} - S{job.season_id}E{job.episode_id} is done downloading!")
+
+
+async def remux_stage(job):
+    """Convert the downloaded .ts to the episode mp4 (a no-op for streamed downloads)"""
+    # Use deterministic path instead of scanning
+    if not getalltsfiles(job.series_key, job.season_id, job.episode_id):
+        downloader_script = PROJECT_ROOT / 'downloaderService' / 'main.py'
+        cmd = [sys.executable, str(downloader_script), '--remux-only', str(job.download_dir)]
+        await run_command(cmd, cwd=str(PROJECT_ROOT))
+
+    # the downloader says where the episode is; files remuxed before it wrote
+    # result.json are at the deterministic path
+    result = read_download_result(job.download_dir)
+    filepath = result['path'] if result else getalltsfiles(job.series_key, job.season_id, job.episode_id)
+    if not filepath or not os.path.exists(filepath):
+        raise FileNotFoundError(f'No episode file for {job.object_id}')
+    job.filepath = filepath
+    job.media = result
+
+
+async def upload_stage(job):
+    # the file stays on disk, managed by artifact_cache, so a retry or a
+    # re-upload after a stale file_id skips the download
+    artifact_cache.add(job.filepath)
+    started = time.monotonic()
+    try:
+        await upload_episode(job.filepath, job.chat_id, job.object_id)
+    except (subprocess.CalledProcessError, UploadError) as upload_error:
+        logger.error(f"Upload failed: {upload_error}")
+        raise
+    size = os.path.getsize(job.filepath)
+    upload_bytes.inc(size)
+    upload_mbps.observe(size / 1024 ** 2 / max(time.monotonic() - started, 1e-6))
+
+
+def timed_stage(stage, handler):
+    """handler, with its run time recorded in stage_seconds"""
+    async def timed(job):
+        try:
+            with stage_seconds.time(stage=stage):
+                await handler(job)
+        except Exception:
+            stage_failures.inc(stage=stage)
+            raise
+    return timed
+
+
+async def submit_pinned(job, start_stage='download'):
+    """pipeline.submit with the episode's file pinned in artifact_cache meanwhile"""
+    _, mp4_file = get_download_path(job.series_key, job.season_id, job.episode_id)
+    artifact_cache.pin(mp4_file)
+    try:
+        await pipeline.submit(job, start_stage=start_stage)
+    finally:
+        artifact_cache.unpin(mp4_file)
+        # whatever a failed download left behind counts against the budget too
+        artifact_cache.add(mp4_file)
+
+
+async def upload_episode(filepath, chat_id, object_id):
+    """
+    Upload an episode through the uploader daemon when one is configured,
+    otherwise (or when it cannot be reached) spawn the one-shot uploader.
+    """
+    daemon_address = configdata.get('uploader_daemon')
+    if daemon_address:
+        try:
+            return await upload_via_daemon(daemon_address, filepath, chat_id, object_id)
+        except OSError as e:
+            logger.warning(f'Uploader daemon unavailable ({e}), spawning uploader')
+
+    uploader_script = PROJECT_ROOT / 'uploaderService' / 'main.py'
+    upload_cmd = [
+        sys.executable,
+        str(uploader_script),
+        filepath,
+        str(chat_id),
+        object_id
+    ]
+    await run_command(upload_cmd, cwd=str(PROJECT_ROOT))
+
+
+def job_document(job):
+    """The fields of a job that are persisted in the jobs collection"""
+    return {
+        "object_id": job.object_id,
+        "series_key": job.series_key,
+        "series_name": job.series_name,
+        "season_id": job.season_id,
+        "episode_id": job.episode_id
+    }
+
+
+STAGE_JOB_STATES = {
+    'download': JOB_DOWNLOADING,
+    'remux': JOB_REMUXING,
+    'upload': JOB_UPLOADING
+}
 
-            # Use deterministic path instead of scanning
-            filepath = getalltsfiles(series_key, season_id, episode_id)
-            if filepath and os.path.exists(filepath):
-                # Create object_id with season: series_key-s{season_id}-e{episode_id}
-                object_id = f"{series_key}-s{season_id}-e{episode_id}"
-                uploader_script = PROJECT_ROOT / 'uploaderService' / 'main.py'
-                upload_cmd = [
-                    sys.executable,
-                    str(uploader_script),
-                    filepath,
-                    str(chat_id),
-                    object_id
-                ]
+
+async def record_stage(job, stage):
+    """Pipeline hook: persist the stage a job is entering"""
+    await updateJobStateAsync(job.object_id, STAGE_JOB_STATES[stage])
+
+
+def resume_stage(download_dir):
+    """
+    Where a restarted job picks up: at remux when the episode was already
+    downloaded (an mp4, or a .ts the downloader marked as complete),
+    otherwise from the download. A .ts without the marker may have been cut
+    short by the restart and is downloaded again.
+    """
+    if (download_dir / EPISODE_FILENAME).exists() or (download_dir / DOWNLOAD_DONE_NAME).exists():
+        return 'remux'
+    return 'download'
+
+
+async def resume_jobs(application):
+    """
+    Startup: pick up jobs a previous run left unfinished, reusing whatever
+    they already downloaded or remuxed.
+    """
+    # leader chat -> its unfinished jobs
+    resumable = {}
+    for doc in await getUnfinishedJobsAsync():
+        object_id = doc['object_id']
+        chat_ids = doc.get('chat_ids') or [PREFETCH_CHAT_ID]
+        # the upload may have finished before the restart
+        delivered = await lookup_episode(doc['series_key'], doc['season_id'], doc['episode_id'])
+        if delivered and delivered.get('file_id'):
+            logger.info(f'{object_id} was uploaded before the restart')
+            await updateJobStateAsync(object_id, JOB_DELIVERED)
+            for chat_id in chat_ids:
+                if chat_id == PREFETCH_CHAT_ID:
+                    continue
                 try:
-                    subprocess.check_call(upload_cmd, cwd=str(PROJECT_ROOT))
-                    # Cleanup: Delete the local mp4 file after successful upload
-                    # (Telegram file_id is now cached, so local file is no longer needed)
-                    if os.path.exists(filepath):
-                        os.remove(filepath)
-                        logger.info(f'Cleaned up local file: {filepath}')
-                except subprocess.CalledProcessError as upload_error:
-                    logger.error(f"Upload failed: {upload_error}")
-                    # Keep the file for potential retry
-                    raise
-            else:
-                await update.message.reply_text("Error: Could not find downloaded file")
-        except subprocess.CalledProcessError as e:
-            logger.error(f"Error in subprocess call: {e}")
-            await update.message.reply_text("Error during download/upload process. Please retry.")
-        except Exception as e:
-            logger.error(f"Unexpected error: {e}")
-            await update.message.reply_text("An unexpected error occurred. Please retry.")
+                    await application.bot.send_video(
+                        chat_id=chat_id,
+                        video=delivered['file_id'],
+                        supports_streaming=True,
+                        read_timeout=120,
+                        write_timeout=120
+                    )
+                except Exception as e:
+                    logger.error(f'Error sending video to {chat_id}: {e}')
+            continue
 
-    else:
-        await update.message.reply_text("Please refer to /help")
+        for chat_id in chat_ids:
+            inflight.join(object_id, chat_id)
+        download_dir = get_download_path(doc['series_key'], doc['season_id'], doc['episode_id'])[0]
+        job = EpisodeJob(
+            doc['series_name'], doc['series_key'], doc['season_id'], doc['episode_id'],
+            chat_ids[0], download_dir
+        )
+        resumable.setdefault(job.chat_id, []).append(job)
+
+    # a chat's jobs are admitted as one request (like a range), so the rest
+    # of an interrupted range does not run into the chat quota
+    for jobs in resumable.values():
+        try:
+            pipeline.admit(*jobs)
+        except AdmissionError as e:
+            for job in jobs:
+                logger.warning(f'Not resuming {job.object_id}: {e}')
+                await notify_failed_waiters(application, job.object_id, None, error=e)
+            continue
+        for job in jobs:
+            inflight.attach_job(job.object_id, job)
+            start_stage = resume_stage(job.download_dir)
+            logger.info(f'Resuming {job.object_id} from {start_stage}')
+            job.download_dir.mkdir(parents=True, exist_ok=True)
+            application.create_task(run_resumed_job(application, job, start_stage))
+
+
+async def run_resumed_job(application, job, start_stage):
+    try:
+        await submit_pinned(job, start_stage)
+    except Exception as e:
+        logger.error(f'Resumed job {job.object_id} failed: {e}')
+        await notify_failed_waiters(application, job.object_id, None, error=e)
+
+
+def admission_reply(error):
+    """Message for a request the pipeline turned away"""
+    if isinstance(error, QuotaExceeded):
+        return ("You already have episodes being fetched, "
+                "please wait for them to arrive before asking for more.")
+    return "Too many episodes are being fetched right now. Please retry in a few minutes."
+
+
+async def notify_failed_waiters(context, object_id, leader_chat_id, error=None):
+    """Release an in-flight fetch, mark its job failed and tell the chats that joined it"""
+    await updateJobStateAsync(object_id, JOB_FAILED, str(error) if error else None)
+    for waiting_chat_id in inflight.fail(object_id):
+        if waiting_chat_id in (leader_chat_id, PREFETCH_CHAT_ID):
+            continue
+        try:
+            await context.bot.send_message(
+                chat_id=waiting_chat_id,
+                text="Error during download/upload process. Please retry."
+            )
+        except Exception as e:
+            logger.error(f'Error notifying chat {waiting_chat_id}: {e}')
 
 
 async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE):
@@ -196,6 +760,60 @@ async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE):
             pass  # Ignore errors when trying to send error message
 
 
+def is_agent(user_id):
+    """True for any of the uploader's agent accounts"""
+    agent_ids = set(configdata.get('agent_user_ids', []))
+    if configdata.get('agent_user_id'):
+        agent_ids.add(configdata.get('agent_user_id'))
+    return user_id in agent_ids
+
+
+def parse_object_id(object_id):
+    """
+    (series_key, season_id, episode_id) from an object_id such as
+    "death_note-s1-e3", or None if it is malformed
+    """
+    # Split by '-' and look for 's' and 'e' prefixes
+    parts_obj = object_id.split("-")
+    if len(parts_obj) < 3:
+        logger.error(f'Invalid object_id format: {object_id}')
+        return None
+
+    series_key = parts_obj[0]
+    season_part = None
+    episode_part = None
+
+    for part in parts_obj[1:]:
+        if part.startswith('s') and part[1:].isdigit():
+            season_part = part
+        elif part.startswith('e') and part[1:].isdigit():
+            episode_part = part
+
+    if not season_part or not episode_part:
+        logger.error(f'Invalid object_id format (missing s/e): {object_id}')
+        return None
+
+    return series_key, int(season_part[1:]), int(episode_part[1:])
+
+
+async def correlate_upload(object_id):
+    """
+    What an uploaded video is and who is waiting for it: series_key,
+    series_name, season_id, episode_id and chat_ids of the job, from the
+    in-flight fetch or else the jobs collection. None for unknown jobs.
+    """
+    job = inflight.job(object_id)
+    if job:
+        return {
+            "series_key": job.series_key,
+            "series_name": job.series_name,
+            "season_id": job.season_id,
+            "episode_id": job.episode_id,
+            "chat_ids": inflight.chat_ids(object_id)
+        }
+    return await getJobAsync(object_id)
+
+
 async def check_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
     '''
     This function is important as this checks for all the files uploaded
@@ -204,93 +822,170 @@ async def check_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
     logger.info('check_document function is called!')
     user_id = update.message.from_user.id
 
-    if user_id == configdata.get('agent_user_id'):
+    if is_agent(user_id):
         if not update.message.video:
             logger.warning('Received message without video')
             return
 
         file_id = update.message.video.file_id
-        caption = update.message.caption
-
-        if not caption or ':' not in caption:
-            logger.warning('Received video without proper caption format')
-            return
+        caption = update.message.caption or ''
 
         try:
-            parts = caption.split(":")
-            if len(parts) < 2:
-                logger.error(f'Invalid caption format: {caption}')
+            if caption.startswith(JOB_CAPTION_PREFIX):
+                object_id = caption[len(JOB_CAPTION_PREFIX):]
+                chat_ids = []
+            elif ':' in caption:
+                # legacy "chat_id:object_id" caption
+                end_user_chat_id, object_id = caption.split(":", 1)
+                chat_ids = [int(end_user_chat_id)]
+            else:
+                logger.warning('Received video without proper caption format')
                 return
 
-            end_user_chat_id = parts[0]
-            object_id = parts[1]
-
-            # Parse object_id format: series_key-s{season_id}-e{episode_id}
-            # Example: "death_note-s1-e3"
-            try:
-                # Split by '-' and look for 's' and 'e' prefixes
-                parts_obj = object_id.split("-")
-                if len(parts_obj) < 3:
-                    logger.error(f'Invalid object_id format: {object_id}')
-                    return
-                
-                series_key = parts_obj[0]
-                season_part = None
-                episode_part = None
-                
-                for part in parts_obj[1:]:
-                    if part.startswith('s') and part[1:].isdigit():
-                        season_part = part
-                    elif part.startswith('e') and part[1:].isdigit():
-                        episode_part = part
-                
-                if not season_part or not episode_part:
-                    logger.error(f'Invalid object_id format (missing s/e): {object_id}')
+            leader_job = inflight.job(object_id)
+            episode = await correlate_upload(object_id)
+            if episode is None:
+                # unknown job (e.g. an old uploader): recover the episode from
+                # the object_id and the series_name from earlier episodes
+                parsed = parse_object_id(object_id)
+                if not parsed:
                     return
-                
-                season_id = int(season_part[1:])
-                episode_id = int(episode_part[1:])
-                
-                # Try to get original series_name from database if exists, otherwise use series_key
-                existing = getData({"series_key": series_key, "season_id": season_id, "episode_id": episode_id})
+                series_key, season_id, episode_id = parsed
+                existing = await getDataAsync({"series_key": series_key, "season_id": season_id, "episode_id": episode_id})
                 series_name = existing.get("series_name") if existing and existing.get("series_name") else series_key.replace("_", " ").title()
-                
-            except (ValueError, IndexError) as e:
-                logger.error(f'Error parsing object_id: {object_id}, error: {e}')
-                return
+                episode = {
+                    "series_key": series_key,
+                    "series_name": series_name,
+                    "season_id": season_id,
+                    "episode_id": episode_id
+                }
 
             data2post = {
-                "series_key": series_key,
-                "series_name": series_name,
-                "season_id": season_id,
-                "episode_id": episode_id,
+                "series_key": episode["series_key"],
+                "series_name": episode["series_name"],
+                "season_id": episode["season_id"],
+                "episode_id": episode["episode_id"],
                 "file_id": file_id,
-                "times_queried": 0,
                 "date_added": datetime.now()
             }
             logger.info('Got Posting data to mongoDB')
             logger.info(data2post)
-            postData(data2post)
-
-            # Keep in mind here i have to parse the chat_id from caption above
-            await context.bot.send_video(
-                chat_id=int(end_user_chat_id),
-                video=file_id,
-                supports_streaming=True,
-                read_timeout=120,
-                write_timeout=120
+            # an upsert, so a re-upload replaces the stale file_id
+            await saveEpisodeAsync(data2post)
+            # replace whatever (possibly stale) file_id was cached for the episode
+            episode_cache.put(
+                (episode["series_key"], episode["season_id"], episode["episode_id"]), file_id
             )
+
+            # Send to every chat waiting for this job
+            waiting = episode.get("chat_ids", []) + inflight.resolve(object_id, file_id)
+            for waiting_chat_id in waiting:
+                if waiting_chat_id not in chat_ids:
+                    chat_ids.append(waiting_chat_id)
+            await updateJobStateAsync(object_id, JOB_DELIVERED)
+
+            for target_chat_id in chat_ids:
+                if target_chat_id == PREFETCH_CHAT_ID:
+                    continue
+                try:
+                    await context.bot.send_video(
+                        chat_id=target_chat_id,
+                        video=file_id,
+                        supports_streaming=True,
+                        read_timeout=120,
+                        write_timeout=120
+                    )
+                except Exception as e:
+                    logger.error(f'Error sending video to {target_chat_id}: {e}')
+            if leader_job and leader_job.chat_id != PREFETCH_CHAT_ID:
+                request_seconds.observe(time.monotonic() - leader_job.created, path='miss')
         except ValueError as e:
             logger.error(f'Error parsing caption or chat_id: {e}')
         except Exception as e:
             logger.error(f'Error in check_document: {e}')
 
 
+# download -> remux -> upload worker pool, started in on_startup
+pipeline = Pipeline(
+    {
+        'download': timed_stage('download', download_stage),
+        'remux': timed_stage('remux', remux_stage),
+        'upload': timed_stage('upload', upload_stage),
+    },
+    concurrency=configdata.get('pipeline_concurrency'),
+    queue_size=configdata.get('pipeline_queue_size', 8),
+    max_pending=configdata.get('max_pending_jobs', DEFAULT_MAX_PENDING),
+    chat_quota=configdata.get('chat_quota', DEFAULT_CHAT_QUOTA),
+    on_stage=record_stage
+)
+
+
+async def prefetch_popular(context: ContextTypes.DEFAULT_TYPE):
+    '''
+    Scheduled job: while the bot is idle, push the episodes users are most
+    likely to ask for next through the pipeline, up to the prefetch budget.
+    '''
+    if len(inflight) or any(pipeline.depth().values()):
+        logger.info('Fetches in progress, skipping prefetch')
+        return
+
+    since = datetime.now() - timedelta(hours=prefetcher.window_hours)
+    documents = await getPopularEpisodesAsync(since)
+    started = 0
+    for candidate in prefetcher.candidates(documents):
+        if started >= prefetcher.budget:
+            break
+        if not prefetcher.should_try(candidate.object_id):
+            continue
+        prefetcher.mark_attempt(candidate.object_id)
+
+        cached = await getDataAsync({
+            "series_key": candidate.series_key,
+            "season_id": candidate.season_id,
+            "episode_id": candidate.episode_id
+        })
+        if cached or not inflight.join(candidate.object_id, PREFETCH_CHAT_ID):
+            continue
+
+        download_dir, _ = get_download_path(
+            candidate.series_key, candidate.season_id, candidate.episode_id
+        )
+        job = EpisodeJob(
+            candidate.series_name, candidate.series_key, candidate.season_id,
+            candidate.episode_id, PREFETCH_CHAT_ID, download_dir
+        )
+        try:
+            # the prefetch budget, not the chat quota, limits the bot's own fetches
+            pipeline.admit(job, quota=False)
+        except AdmissionError as e:
+            # users come first; try again on the next run
+            logger.info(f'Not prefetching {candidate}: {e}')
+            inflight.fail(candidate.object_id)
+            break
+        inflight.attach_job(job.object_id, job)
+        await saveJobAsync(job_document(job), [PREFETCH_CHAT_ID])
+        download_dir.mkdir(parents=True, exist_ok=True)
+        logger.info(f'Prefetching {candidate}')
+        context.application.create_task(run_prefetch(context, job))
+        started += 1
+
+
+async def run_prefetch(context, job):
+    try:
+        await submit_pinned(job)
+    except Exception as e:
+        logger.warning(f'Prefetch of {job.object_id} failed: {e}')
+        await notify_failed_waiters(context, job.object_id, PREFETCH_CHAT_ID, error=e)
+
+
 async def debug_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     logger.info('debug_message function is called!')
 
 
 async def callback_minute(context: ContextTypes.DEFAULT_TYPE):
+    logger.info(f'Episode cache: {episode_cache.stats()}')
+    logger.info(f'Telegram rate limiter: {rate_limiter.stats()}')
+    logger.info(f'Artifact cache: {artifact_cache.stats()}')
     agent_id = configdata.get('agent_user_id')
     if agent_id:
         try:
@@ -299,18 +994,51 @@ async def callback_minute(context: ContextTypes.DEFAULT_TYPE):
             logger.error(f'Error sending heartbeat: {e}')
 
 
+async def on_startup(application):
+    # connect (ping + indexes) here rather than at import so cold start,
+    # tests and forked workers don't pay for it
+    await asyncio.get_running_loop().run_in_executor(None, init_database)
+    await asyncio.get_running_loop().run_in_executor(None, artifact_cache.scan)
+    pipeline.start()
+    if metrics_server.port:
+        await metrics_server.start()
+    await resume_jobs(application)
+
+
+async def on_shutdown(application):
+    await metrics_server.close()
+    await pipeline.stop()
+    await flushQueryIncrementsAsync()
+    close_database()
+
+
 def main():
     # Create application
-    application = Application.builder().token(API_TOKEN).build()
+    application = (
+        Application.builder()
+        .token(API_TOKEN)
+        .rate_limiter(TelegramRateLimiter(rate_limiter))
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
+        .build()
+    )
 
     # Get job queue for scheduled tasks
     job_queue = application.job_queue
     job_queue.run_repeating(callback_minute, interval=120, first=10)
+    job_queue.run_repeating(
+        flush_query_counts, interval=configdata.get('query_flush_interval', 30)
+    )
+    prefetch_interval = configdata.get('prefetch_interval', 30 * 60)
+    if prefetch_interval:
+        job_queue.run_repeating(prefetch_popular, interval=prefetch_interval, first=prefetch_interval)
 
     # Add handlers
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("help", help_command))
-    application.add_handler(CommandHandler("getanime", getanime))
+    # block=False runs each /getanime as its own task so a long cache miss
+    # does not hold up the updates queued behind it
+    application.add_handler(CommandHandler("getanime", getanime, block=False))
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, debug_message))
     application.add_handler(MessageHandler(filters.VIDEO, check_document))
 
@@ -8,18 +8,32 @@ example - /get Death note, s1, ep3
 example - /search Death Note
 
 '''
-import os
+import json
+import math
 import re
 from pathlib import Path
 
 # Get the project root directory
 PROJECT_ROOT = Path(__file__).parent.parent
 
+# Largest episode range a single /getanime may ask for
+MAX_EPISODE_RANGE = 26
+
+# The downloader's file names in an episode directory. It runs as a separate
+# script, so they are repeated in downloaderService/main.py;
+# tests/test_botUtils.py checks the two agree.
+# the episode the downloader produced
+EPISODE_FILENAME = 'episode.mp4'
+# written by the downloader next to the episode it produced
+RESULT_NAME = 'result.json'
+# written by the downloader once an episode's .ts is completely downloaded
+DOWNLOAD_DONE_NAME = 'download.done'
+
 
 def showhelp():
     helpText = "Here are the following bot commands\n \
     \n/getanime - will download the anime episode you wanted(make sure you seperate the name and the season and ep with comma) \
-    \nexample - /getanime Death note, 1, 3\n\n/search(still in development) \
+    \nexample - /getanime Death note, 1, 3\nor a range of episodes - /getanime Death note, 1, 1-12\n\n/search(still in development) \
     - will provide deatails about an anime\nexample - /search Death Note"
     return helpText
 
@@ -41,6 +55,12 @@ def normalize_series_name(series_name):
     return normalized
 
 def parse_search_query(raw_input):
+    """
+    Parse "<series name>, <season>, <episode>" where episode may also be a
+    range like "1-12". episode_end is the last episode asked for and equals
+    episode_id for a single episode. A range longer than MAX_EPISODE_RANGE is
+    cut short; requested_end keeps the end that was asked for.
+    """
     text = raw_input.split(',')
     series_name = text[0].strip() if len(text) > 0 else ""
     try:
@@ -48,19 +68,51 @@ def parse_search_query(raw_input):
         season_id = int(season_id) if season_id else -1
     except (IndexError, ValueError):
         season_id = -1
-    try:
-        episode_id = ''.join([n for n in text[2] if n.isdigit()]) if len(text) > 2 else "-1"
-        episode_id = int(episode_id) if episode_id else -1
-    except (IndexError, ValueError):
-        episode_id = -1
+
+    episode_text = text[2] if len(text) > 2 else ""
+    episode_range = re.search(r'(\d+)\s*-\s*(\d+)', episode_text)
+    if episode_range:
+        episode_id, requested_end = sorted(int(n) for n in episode_range.groups())
+        episode_end = min(requested_end, episode_id + MAX_EPISODE_RANGE - 1)
+    else:
+        try:
+            episode_id = ''.join([n for n in episode_text if n.isdigit()])
+            episode_id = int(episode_id) if episode_id else -1
+        except ValueError:
+            episode_id = -1
+        episode_end = requested_end = episode_id
 
     query_obj = {
         "series_name" : series_name,
         "season_id" : season_id,
-        "episode_id": episode_id
+        "episode_id": episode_id,
+        "episode_end": episode_end,
+        "requested_end": requested_end
     }
     return query_obj
 
+def format_episode_range(episode_ids):
+    """
+    Compress episode numbers into animdl's range syntax,
+    e.g. [1, 2, 3, 5, 7, 8] -> "1-3,5,7-8"
+    """
+    ranges = []
+    for episode_id in sorted(set(episode_ids)):
+        if ranges and episode_id == ranges[-1][1] + 1:
+            ranges[-1][1] = episode_id
+        else:
+            ranges.append([episode_id, episode_id])
+    return ','.join(
+        str(start) if start == end else f"{start}-{end}" for start, end in ranges
+    )
+
+def format_eta(seconds):
+    """Human readable wait time, e.g. 150 -> ~3 min, 4000 -> ~1h 07m"""
+    minutes = max(math.ceil(seconds / 60), 1)
+    if minutes < 60:
+        return f"~{minutes} min"
+    return f"~{minutes // 60}h {minutes % 60:02d}m"
+
 def get_download_path(series_key, season_id, episode_id):
     """
     Get deterministic download path for an anime episode.
@@ -70,31 +122,34 @@ def get_download_path(series_key, season_id, episode_id):
     season_str = f"S{season_id:02d}" if season_id >= 0 else "S00"
     episode_str = f"E{episode_id:02d}" if episode_id >= 0 else "E00"
     download_dir = PROJECT_ROOT / "downloads" / series_key / f"{season_str}{episode_str}"
-    mp4_file = download_dir / "episode.mp4"
+    mp4_file = download_dir / EPISODE_FILENAME
     return download_dir, mp4_file
 
-def getalltsfiles(series_key=None, season_id=None, episode_id=None):
+def getalltsfiles(series_key, season_id, episode_id):
     """
-    Get the mp4 file path. If parameters are provided, use deterministic path.
-    Otherwise, fall back to scanning (for backward compatibility during transition).
+    Get the mp4 file path of an episode from its deterministic download
+    path, or None if it is not there. The filesystem is never searched.
     """
-    if series_key and season_id is not None and episode_id is not None:
-        # Use deterministic path
-        _, mp4_file = get_download_path(series_key, season_id, episode_id)
-        if mp4_file.exists():
-            return str(mp4_file)
-        return None
-    
-    # Fallback: Find .mp4 files in the project directory (legacy behavior)
-    walk_dir = PROJECT_ROOT
-    for root, _, files in os.walk(walk_dir):
-        for file in files:
-            if file.split(".")[-1].lower() == 'mp4':
-                mp4FilePath = os.path.join(root, file)
-                # Normalize path separators
-                mp4FilePath = os.path.normpath(mp4FilePath)
-                return mp4FilePath
+    _, mp4_file = get_download_path(series_key, season_id, episode_id)
+    if mp4_file.exists():
+        return str(mp4_file)
     return None
 
+def read_download_result(download_dir):
+    """
+    The downloader's result.json for download_dir (path, size, duration,
+    codecs) with path made absolute, or None if there is none or the file
+    it points at is missing or a different size.
+    """
+    try:
+        with open(Path(download_dir) / RESULT_NAME) as f:
+            result = json.load(f)
+        path = Path(download_dir) / result['path']
+        if path.stat().st_size != result['size']:
+            return None
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+    return dict(result, path=str(path))
+
 
 # python uploaderService/main.py ./Naruto/E04.mp4 5023977571 naruto4
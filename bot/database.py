@@ -1,26 +1,111 @@
-from pymongo import MongoClient
+from pymongo import MongoClient, ReturnDocument, UpdateOne
 from pymongo.errors import ConnectionFailure, ServerSelectionTimeoutError
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import asyncio
 import os
 import logging
+import threading
+import time
 
 logger = logging.getLogger(__name__)
 
 # Get MongoDB URL from environment variable or use default
 MONGO_DB_URL = os.getenv('MONGO_DB_URL', 'mongodb://localhost:27017/')
+# Connection pool size, also the number of threads serving the async API
+MONGO_POOL_SIZE = int(os.getenv('MONGO_POOL_SIZE', '16'))
+# Per-operation socket timeout; a slow Mongo fails the call instead of hanging it
+MONGO_TIMEOUT_MS = int(os.getenv('MONGO_TIMEOUT_MS', '5000'))
+
+DATABASE_NAME = "animeDatabase"
+COLLECTION_NAME = "animeDatabase"
+JOBS_COLLECTION_NAME = "jobs"
+
+# Job states, in the order a fetch goes through them
+JOB_QUEUED = 'queued'
+JOB_DOWNLOADING = 'downloading'
+JOB_REMUXING = 'remuxing'
+JOB_UPLOADING = 'uploading'
+JOB_DELIVERED = 'delivered'
+JOB_FAILED = 'failed'
+UNFINISHED_JOB_STATES = (JOB_QUEUED, JOB_DOWNLOADING, JOB_REMUXING, JOB_UPLOADING)
+
+# The client is created on first use rather than at import, and again in any
+# process that did not create it (pymongo clients are not fork safe), so
+# every worker process gets its own connection pool.
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """Return this process's MongoClient, creating it on first use"""
+    global _client, _client_pid
+    pid = os.getpid()
+    if _client is None or _client_pid != pid:
+        with _client_lock:
+            if _client is None or _client_pid != pid:
+                _client = MongoClient(
+                    MONGO_DB_URL,
+                    serverSelectionTimeoutMS=5000,
+                    connectTimeoutMS=MONGO_TIMEOUT_MS,
+                    socketTimeoutMS=MONGO_TIMEOUT_MS,
+                    maxPoolSize=MONGO_POOL_SIZE,
+                    connect=False
+                )
+                _client_pid = pid
+    return _client
+
+
+def get_database():
+    return get_client()[DATABASE_NAME]
+
+
+def get_collection(name=COLLECTION_NAME):
+    return get_database()[name]
+
+
+class _LazyCollection:
+    """Module level handle that resolves the collection on each access"""
+
+    def __init__(self, name):
+        self._name = name
+
+    def __getattr__(self, attr):
+        return getattr(get_collection(self._name), attr)
+
 
-try:
-    client = MongoClient(MONGO_DB_URL, serverSelectionTimeoutMS=5000)
-    # Test connection
-    client.admin.command('ping')
-    logger.info('Successfully connected to MongoDB')
-except (ConnectionFailure, ServerSelectionTimeoutError) as e:
-    logger.error(f'Failed to connect to MongoDB: {e}')
-    raise
-
-#database
-db = client["animeDatabase"]
 #collection
-col = db["animeDatabase"]
+col = _LazyCollection(COLLECTION_NAME)
+jobs_col = _LazyCollection(JOBS_COLLECTION_NAME)
+
+
+def init_database():
+    """
+    Startup hook: check the server is reachable and create indexes.
+    Raises if MongoDB cannot be reached.
+    """
+    try:
+        get_client().admin.command('ping')
+        logger.info('Successfully connected to MongoDB')
+    except (ConnectionFailure, ServerSelectionTimeoutError) as e:
+        logger.error(f'Failed to connect to MongoDB: {e}')
+        raise
+    create_indexes()
+
+
+def close_database():
+    """Shutdown hook: close this process's client and database threads"""
+    global _client, _client_pid, _executor, _executor_pid
+    with _client_lock:
+        if _client is not None and _client_pid == os.getpid():
+            _client.close()
+        _client = None
+        _client_pid = None
+        if _executor is not None and _executor_pid == os.getpid():
+            _executor.shutdown(wait=False)
+        _executor = None
+        _executor_pid = None
 
 '''
  * DB Models
@@ -32,7 +117,17 @@ col = db["animeDatabase"]
          - episode_id <int>
          - file_id <string>
          - times_queried <int>
+         - daily_queries <dict> (YYYY-MM-DD -> queries that day)
          - date_added <date>
+         - last_queried <date>
+    * jobs
+         - object_id <string> *Unique* (series_key-s{season_id}-e{episode_id})
+         - series_key, series_name, season_id, episode_id
+         - chat_ids <list of int> (chats waiting for the episode)
+         - state <string> (queued, downloading, remuxing, uploading, delivered, failed)
+         - error <string>
+         - created <date>
+         - updated <date>
 '''
 
 def create_indexes():
@@ -47,9 +142,16 @@ def create_indexes():
     except Exception as e:
         # Index might already exist, which is fine
         logger.debug(f'Index creation note: {e}')
-
-# Create indexes on module load
-create_indexes()
+    try:
+        # getPopularEpisodes filters and sorts on it
+        col.create_index([("last_queried", -1)], name="last_queried")
+    except Exception as e:
+        logger.debug(f'Index creation note: {e}')
+    try:
+        jobs_col.create_index([("object_id", 1)], unique=True, name="object_id_unique")
+        jobs_col.create_index([("state", 1)], name="state")
+    except Exception as e:
+        logger.debug(f'Index creation note: {e}')
 
 def postData(data):
     """Insert data into the database"""
@@ -62,6 +164,23 @@ def postData(data):
         return None
 
 
+def saveEpisode(data):
+    """
+    Store an uploaded episode. A re-upload (e.g. after a stale file_id)
+    replaces the file_id of the existing document and keeps its times_queried.
+    """
+    try:
+        fields = {k: v for k, v in data.items() if k != 'times_queried'}
+        return col.update_one(
+            _episode_query(data),
+            {'$set': fields, '$setOnInsert': {'times_queried': 0}},
+            upsert=True
+        )
+    except Exception as e:
+        logger.error(f'Error saving episode: {e}')
+        return None
+
+
 def getData(data):
     """Query data from the database"""
     try:
@@ -72,26 +191,69 @@ def getData(data):
         return None
 
 
+def getEpisodes(series_key, season_id, episode_ids):
+    """Query several episodes of a season in one round trip"""
+    try:
+        return list(col.find({
+            'series_key': series_key,
+            'season_id': season_id,
+            'episode_id': {'$in': list(episode_ids)}
+        }))
+    except Exception as e:
+        logger.error(f'Error querying episodes: {e}')
+        return []
+
+
+def getDataAndCount(data):
+    """
+    Query a document and count the query in the same round trip: a single
+    find_one_and_update bumping times_queried, returning the updated document
+    """
+    try:
+        return col.find_one_and_update(
+            data,
+            _count_queries(1, datetime.now()),
+            return_document=ReturnDocument.AFTER
+        )
+    except Exception as e:
+        logger.error(f'Error querying data: {e}')
+        return None
+
+
+def _count_queries(count, now):
+    """
+    The update counting `count` queries made at `now`: in times_queried for
+    good, and in that day's daily_queries for the pre-fetcher's recent rate
+    """
+    return {
+        '$inc': {'times_queried': count, f'daily_queries.{now.date().isoformat()}': count},
+        '$set': {'last_queried': now},
+    }
+
+
+def _episode_query(data):
+    """Build the key query (series_key/season_id/episode_id) for a document"""
+    query = {}
+    if 'series_key' in data:
+        query['series_key'] = data.get('series_key')
+    elif 'series_name' in data:
+        # Fallback for backward compatibility
+        query['series_name'] = data.get('series_name')
+
+    if 'season_id' in data:
+        query['season_id'] = data.get('season_id')
+    if 'episode_id' in data:
+        query['episode_id'] = data.get('episode_id')
+    return query
+
+
 def updateData(data):
     """Update the times_queried field for a document"""
     try:
         # Build query with all key fields
-        query = {}
-        if 'series_key' in data:
-            query['series_key'] = data.get('series_key')
-        elif 'series_name' in data:
-            # Fallback for backward compatibility
-            query['series_name'] = data.get('series_name')
-        
-        if 'season_id' in data:
-            query['season_id'] = data.get('season_id')
-        if 'episode_id' in data:
-            query['episode_id'] = data.get('episode_id')
+        query = _episode_query(data)
         
-        update_result = col.update_one(
-            query,
-            {'$inc': {'times_queried': 1}}
-        )
+        update_result = col.update_one(query, _count_queries(1, datetime.now()))
         if update_result.matched_count > 0:
             logger.info(f'Updated document: {query}')
         return update_result
@@ -99,4 +261,253 @@ def updateData(data):
         logger.error(f'Error updating data: {e}')
         return None
 
-#result = db.test.update_one({'x': 1}, {'$inc': {'x': 3}})
+
+class QueryCounter:
+    '''
+    Write-behind buffer for times_queried increments.
+
+    Cache hits only bump an in-memory count; flush() writes all pending
+    counts with a single unordered bulk_write of $inc operations.
+    '''
+    def __init__(self, flush_threshold=100):
+        self.flush_threshold = flush_threshold
+        self._pending = {}
+        self._total = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._total
+
+    def increment(self, data, count=1):
+        """Queue an increment; returns True once flush_threshold is reached"""
+        key = tuple(sorted(_episode_query(data).items()))
+        with self._lock:
+            self._pending[key] = self._pending.get(key, 0) + count
+            self._total += count
+            return self._total >= self.flush_threshold
+
+    def flush(self):
+        """Write pending increments, returns the number of documents updated"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._total = 0
+        if not pending:
+            return 0
+
+        now = datetime.now()
+        operations = [
+            UpdateOne(dict(key), _count_queries(count, now))
+            for key, count in pending.items()
+        ]
+        try:
+            result = col.bulk_write(operations, ordered=False)
+            logger.info(f'Flushed times_queried for {len(operations)} documents')
+            return result.modified_count
+        except Exception as e:
+            logger.error(f'Error flushing times_queried: {e}')
+            # keep the counts for the next flush
+            for key, count in pending.items():
+                self.increment(dict(key), count)
+            return 0
+
+
+query_counter = QueryCounter(
+    flush_threshold=int(os.getenv('MEIDO_QUERY_FLUSH_THRESHOLD', '100'))
+)
+
+
+def queueQueryIncrement(data):
+    """Count a query of a document without writing to Mongo right away"""
+    return query_counter.increment(data)
+
+
+def flushQueryIncrements():
+    """Write all queued times_queried increments with one bulk_write"""
+    return query_counter.flush()
+
+
+def getPopularEpisodes(since, limit=200):
+    """Episodes queried since `since`, most recently queried first"""
+    try:
+        cursor = col.find(
+            {'last_queried': {'$gte': since}},
+            projection={'_id': 0, 'file_id': 0}
+        )
+        return list(cursor.sort('last_queried', -1).limit(limit))
+    except Exception as e:
+        logger.error(f'Error querying popular episodes: {e}')
+        return []
+
+
+def saveJob(data, chat_ids):
+    """
+    Record a queued fetch for data's episode, waited on by chat_ids (the
+    leader first, then every chat that joined so far). A job left over from
+    an earlier fetch of the same episode is reset.
+    """
+    now = datetime.now()
+    try:
+        return jobs_col.update_one(
+            {'object_id': data['object_id']},
+            {
+                '$set': dict(data, chat_ids=list(chat_ids), state=JOB_QUEUED,
+                             error=None, updated=now),
+                '$setOnInsert': {'created': now}
+            },
+            upsert=True
+        )
+    except Exception as e:
+        logger.error(f'Error saving job: {e}')
+        return None
+
+
+def addJobChat(object_id, chat_id):
+    """Add a chat to the chats waiting on a job"""
+    try:
+        return jobs_col.update_one(
+            {'object_id': object_id}, {'$addToSet': {'chat_ids': chat_id}}
+        )
+    except Exception as e:
+        logger.error(f'Error updating job: {e}')
+        return None
+
+
+def updateJobState(object_id, state, error=None):
+    """
+    Move an unfinished job to state, keeping error for failed jobs.
+    Delivered and failed jobs are left alone.
+    """
+    try:
+        return jobs_col.update_one(
+            {'object_id': object_id, 'state': {'$in': list(UNFINISHED_JOB_STATES)}},
+            {'$set': {'state': state, 'error': error, 'updated': datetime.now()}}
+        )
+    except Exception as e:
+        logger.error(f'Error updating job: {e}')
+        return None
+
+
+def getJob(object_id):
+    """The job for object_id (chats, series_name, season, episode), or None"""
+    try:
+        return jobs_col.find_one({'object_id': object_id}, projection={'_id': 0})
+    except Exception as e:
+        logger.error(f'Error querying job: {e}')
+        return None
+
+
+def getUnfinishedJobs():
+    """Jobs that were neither delivered nor failed, oldest first"""
+    try:
+        cursor = jobs_col.find(
+            {'state': {'$in': list(UNFINISHED_JOB_STATES)}}, projection={'_id': 0}
+        )
+        return list(cursor.sort('created', 1))
+    except Exception as e:
+        logger.error(f'Error querying jobs: {e}')
+        return []
+
+
+# Async API
+#
+# pymongo is blocking, so the awaitable variants run the calls above on a
+# dedicated thread pool sized like the connection pool. Handlers on the
+# event loop await these instead of blocking it on a slow Mongo.
+_executor = None
+_executor_pid = None
+# called with (operation, seconds) after every awaitable call, see setLatencyObserver
+_latency_observer = None
+
+
+def _get_executor():
+    # threads do not survive a fork, so each process builds its own pool
+    global _executor, _executor_pid
+    pid = os.getpid()
+    if _executor is None or _executor_pid != pid:
+        with _client_lock:
+            if _executor is None or _executor_pid != pid:
+                _executor = ThreadPoolExecutor(
+                    max_workers=MONGO_POOL_SIZE, thread_name_prefix='mongo'
+                )
+                _executor_pid = pid
+    return _executor
+
+
+def setLatencyObserver(observer):
+    """Have observer(operation, seconds) called after every awaitable call (None to stop)"""
+    global _latency_observer
+    _latency_observer = observer
+
+
+async def _run(func, *args):
+    started = time.monotonic()
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_get_executor(), func, *args)
+    finally:
+        if _latency_observer:
+            _latency_observer(func.__name__, time.monotonic() - started)
+
+
+async def saveEpisodeAsync(data):
+    """Awaitable saveEpisode"""
+    return await _run(saveEpisode, data)
+
+
+async def getDataAsync(data):
+    """Awaitable getData"""
+    return await _run(getData, data)
+
+
+async def getEpisodesAsync(series_key, season_id, episode_ids):
+    """Awaitable getEpisodes"""
+    return await _run(getEpisodes, series_key, season_id, episode_ids)
+
+
+async def getDataAndCountAsync(data):
+    """Awaitable getDataAndCount"""
+    return await _run(getDataAndCount, data)
+
+
+async def postDataAsync(data):
+    """Awaitable postData"""
+    return await _run(postData, data)
+
+
+async def updateDataAsync(data):
+    """Awaitable updateData"""
+    return await _run(updateData, data)
+
+
+async def flushQueryIncrementsAsync():
+    """Awaitable flushQueryIncrements"""
+    return await _run(flushQueryIncrements)
+
+
+async def getPopularEpisodesAsync(since, limit=200):
+    """Awaitable getPopularEpisodes"""
+    return await _run(getPopularEpisodes, since, limit)
+
+
+async def saveJobAsync(data, chat_ids):
+    """Awaitable saveJob"""
+    return await _run(saveJob, data, chat_ids)
+
+
+async def addJobChatAsync(object_id, chat_id):
+    """Awaitable addJobChat"""
+    return await _run(addJobChat, object_id, chat_id)
+
+
+async def updateJobStateAsync(object_id, state, error=None):
+    """Awaitable updateJobState"""
+    return await _run(updateJobState, object_id, state, error)
+
+
+async def getJobAsync(object_id):
+    """Awaitable getJob"""
+    return await _run(getJob, object_id)
+
+
+async def getUnfinishedJobsAsync():
+    """Awaitable getUnfinishedJobs"""
+    return await _run(getUnfinishedJobs)
@@ -0,0 +1,90 @@
+'''
+Single-flight registry for episode fetches.
+
+When several chats ask for the same episode while it is still being
+downloaded, only the first request (the leader) runs the download and upload.
+Everyone else is attached to the in-flight entry and is sent the video when
+check_document receives the uploaded file and resolves the entry.
+
+The entry also keeps the leader's job, so check_document can tell which
+episode an upload belongs to from the job id alone.
+'''
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# An entry that has been in flight this long is assumed lost (e.g. the upload
+# never reached check_document) and the next request takes over as leader.
+INFLIGHT_TIMEOUT = 2 * 60 * 60
+
+
+class InflightEntry:
+    def __init__(self, object_id, leader_chat_id):
+        self.object_id = object_id
+        self.chat_ids = [leader_chat_id]
+        self.job = None
+        self.started = time.monotonic()
+
+    def add_chat(self, chat_id):
+        if chat_id not in self.chat_ids:
+            self.chat_ids.append(chat_id)
+
+
+class InflightRegistry:
+    def __init__(self, timeout=INFLIGHT_TIMEOUT):
+        self.timeout = timeout
+        self._entries = {}
+
+    def __contains__(self, object_id):
+        return object_id in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def join(self, object_id, chat_id):
+        """
+        Attach chat_id to the fetch for object_id.
+        Returns True if the caller is the leader and must do the work,
+        False if the episode is already being fetched by another request.
+        """
+        entry = self._entries.get(object_id)
+        if entry and time.monotonic() - entry.started > self.timeout:
+            logger.warning(f'Dropping stale in-flight entry for {object_id}')
+            self._finish(object_id)
+            entry = None
+
+        if entry:
+            entry.add_chat(chat_id)
+            logger.info(f'Attached chat {chat_id} to in-flight fetch of {object_id}')
+            return False
+
+        self._entries[object_id] = InflightEntry(object_id, chat_id)
+        return True
+
+    def chat_ids(self, object_id):
+        entry = self._entries.get(object_id)
+        return list(entry.chat_ids) if entry else []
+
+    def attach_job(self, object_id, job):
+        """Remember the job fetching object_id (series name, season, episode)"""
+        entry = self._entries.get(object_id)
+        if entry:
+            entry.job = job
+
+    def job(self, object_id):
+        entry = self._entries.get(object_id)
+        return entry.job if entry else None
+
+    def resolve(self, object_id, file_id):
+        """Complete the fetch and return every chat waiting for it"""
+        logger.info(f'{object_id} fetched as {file_id}')
+        return self._finish(object_id)
+
+    def fail(self, object_id):
+        """Abort the fetch and return every chat waiting for it"""
+        return self._finish(object_id)
+
+    def _finish(self, object_id):
+        entry = self._entries.pop(object_id, None)
+        return entry.chat_ids if entry else []
@@ -0,0 +1,35 @@
+'''
+Async helpers for running the downloader and uploader services.
+
+The services are separate Python processes; running them through asyncio
+subprocesses keeps the bot's event loop free to answer cache hits, /start
+and the heartbeat job while a download or upload is in progress.
+'''
+import asyncio
+import logging
+import subprocess
+
+logger = logging.getLogger(__name__)
+
+
+async def run_command(cmd, cwd=None):
+    """
+    Run a command as an asyncio subprocess and wait for it to exit.
+
+    Raises subprocess.CalledProcessError on a non-zero exit code, the same
+    as subprocess.check_call, so callers keep their existing error handling.
+    If the awaiting task is cancelled the child process is killed.
+    """
+    cmd = [str(part) for part in cmd]
+    logger.info('Running: %s', ' '.join(cmd))
+    process = await asyncio.create_subprocess_exec(*cmd, cwd=cwd)
+    try:
+        returncode = await process.wait()
+    except asyncio.CancelledError:
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+        raise
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, cmd)
+    return returncode
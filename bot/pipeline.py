@@ -0,0 +1,265 @@
+'''
+Staged worker pool for cache misses.
+
+A miss goes through three stages: download (animdl), remux (ffmpeg) and
+upload (Telethon agent). Each stage has its own bounded queue and a fixed
+number of workers, so while episode N is uploading, N+1 can be remuxing and
+N+2 downloading. A full queue makes the previous stage wait, which keeps a
+fast stage from piling work up in front of a slow one.
+
+Jobs are admitted before they are queued: the pipeline holds at most
+max_pending jobs and each chat at most chat_quota open requests, so a burst
+of requests is turned away up front instead of piling onto the host.
+'''
+import asyncio
+import contextlib
+import logging
+import math
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+STAGES = ('download', 'remux', 'upload')
+
+DEFAULT_CONCURRENCY = {'download': 2, 'remux': 1, 'upload': 1}
+DEFAULT_QUEUE_SIZE = 8
+DEFAULT_MAX_PENDING = 32
+DEFAULT_CHAT_QUOTA = 2
+# ETA guess per job until a few jobs have finished
+DEFAULT_JOB_SECONDS = 120
+
+
+class AdmissionError(Exception):
+    pass
+
+
+class QueueFull(AdmissionError):
+    pass
+
+
+class QuotaExceeded(AdmissionError):
+    pass
+
+
+class _Request:
+    """Jobs admitted together for one chat (one /getanime call)"""
+    def __init__(self, chat_id, size):
+        self.chat_id = chat_id
+        self.open = size
+
+
+class EpisodeJob:
+    '''
+    One episode travelling through the pipeline.
+    notify is an optional coroutine function used to send progress
+    messages to the requesting chat.
+    '''
+    def __init__(self, series_name, series_key, season_id, episode_id, chat_id,
+                 download_dir, notify=None):
+        self.series_name = series_name
+        self.series_key = series_key
+        self.season_id = season_id
+        self.episode_id = episode_id
+        self.chat_id = chat_id
+        self.download_dir = download_dir
+        self.notify = notify
+        self.object_id = f"{series_key}-s{season_id}-e{episode_id}"
+        self.filepath = None
+        # the downloader's result.json (size, duration, codecs) once remuxed
+        self.media = None
+        self.stage = None
+        self.created = time.monotonic()
+        self.stage_seconds = {}
+        self.future = None
+        self.request = None
+        self.admitted = None
+
+    def __repr__(self):
+        return f'<EpisodeJob {self.object_id} stage={self.stage}>'
+
+
+class Pipeline:
+    def __init__(self, handlers, concurrency=None, queue_size=DEFAULT_QUEUE_SIZE,
+                 max_pending=DEFAULT_MAX_PENDING, chat_quota=DEFAULT_CHAT_QUOTA,
+                 on_stage=None):
+        '''
+        handlers maps each stage name to a coroutine function taking the job.
+        concurrency maps each stage name to its worker count.
+        max_pending caps the jobs admitted at once and chat_quota the open
+        requests per chat; 0 disables either limit.
+        on_stage is an optional coroutine function called with the job and
+        the stage name before each stage runs.
+        '''
+        self.handlers = handlers
+        self.on_stage = on_stage
+        self.concurrency = dict(DEFAULT_CONCURRENCY, **(concurrency or {}))
+        self.queue_size = queue_size
+        self.max_pending = max_pending
+        self.chat_quota = chat_quota
+        self.queues = {}
+        # one slot per worker; run_batch takes one too
+        self._slots = {}
+        self._workers = []
+        self._pending = []
+        self._chat_requests = {}
+        self._durations = deque(maxlen=20)
+
+    @property
+    def running(self):
+        return bool(self._workers)
+
+    def start(self):
+        if self.running:
+            return
+        for stage in STAGES:
+            self.queues[stage] = asyncio.Queue(maxsize=self.queue_size)
+            self._slots[stage] = asyncio.Semaphore(self.concurrency[stage])
+            for index in range(self.concurrency[stage]):
+                self._workers.append(
+                    asyncio.create_task(self._worker(stage), name=f'{stage}-worker-{index}')
+                )
+        logger.info(f'Pipeline started with concurrency {self.concurrency}')
+
+    async def stop(self):
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        self.queues = {}
+        self._slots = {}
+
+    def depth(self):
+        """Number of jobs waiting in each stage queue"""
+        return {stage: queue.qsize() for stage, queue in self.queues.items()}
+
+    def pending(self):
+        """Number of admitted jobs that have not finished yet"""
+        return len(self._pending)
+
+    def admit(self, *jobs, quota=True):
+        """
+        Reserve room for one chat's request. Raises QueueFull when the
+        pipeline is at capacity and QuotaExceeded when the chat already has
+        chat_quota requests open (not checked with quota=False). Returns the
+        queue position and ETA in seconds of the last job.
+        """
+        chat_id = jobs[0].chat_id
+        if self.max_pending and len(self._pending) + len(jobs) > self.max_pending:
+            raise QueueFull(f'{len(self._pending)} episodes are queued already')
+        if quota and self.chat_quota and self._chat_requests.get(chat_id, 0) >= self.chat_quota:
+            raise QuotaExceeded(f'chat {chat_id} has {self.chat_quota} requests open')
+
+        request = _Request(chat_id, len(jobs))
+        self._chat_requests[chat_id] = self._chat_requests.get(chat_id, 0) + 1
+        now = time.monotonic()
+        for job in jobs:
+            job.request = request
+            job.admitted = now
+            self._pending.append(job)
+        position = len(self._pending)
+        return position, self.eta(position)
+
+    def release(self, job, duration=None):
+        """Give back the room held by job; safe to call more than once"""
+        request = job.request
+        if request is None:
+            return
+        job.request = None
+        self._pending.remove(job)
+        if duration is not None:
+            self._durations.append(duration)
+        request.open -= 1
+        if request.open == 0:
+            self._chat_requests[request.chat_id] -= 1
+            if not self._chat_requests[request.chat_id]:
+                del self._chat_requests[request.chat_id]
+
+    def eta(self, position):
+        """Seconds until the job at position (1 = next) is done"""
+        if self._durations:
+            job_seconds = sum(self._durations) / len(self._durations)
+        else:
+            job_seconds = DEFAULT_JOB_SECONDS
+        return math.ceil(position / self.concurrency['download']) * job_seconds
+
+    async def submit(self, job, start_stage='download'):
+        """
+        Run job through the pipeline from start_stage and wait for it to
+        finish. Raises whatever the failing stage raised. Jobs not admitted
+        yet are admitted first, which can raise AdmissionError. When the
+        pipeline has not been started the stages run inline in the caller.
+        """
+        if job.request is None:
+            self.admit(job)
+
+        try:
+            if not self.running:
+                for stage in STAGES[STAGES.index(start_stage):]:
+                    await self._run_stage(stage, job)
+            else:
+                job.future = asyncio.get_running_loop().create_future()
+                await self.queues[start_stage].put(job)
+                await job.future
+        except BaseException:
+            self.release(job)
+            raise
+        self.release(job, duration=time.monotonic() - job.admitted)
+        return job
+
+    async def run_batch(self, stage, jobs, handler):
+        """
+        Run handler() once as stage for several jobs (e.g. a single download
+        of an episode range), outside the stage queues but within the stage's
+        worker count. on_stage is called for every job first. Returns what
+        handler returned.
+        """
+        async with self._slot(stage):
+            for job in jobs:
+                job.stage = stage
+                if self.on_stage:
+                    await self.on_stage(job, stage)
+            started = time.monotonic()
+            result = await handler()
+            for job in jobs:
+                job.stage_seconds[stage] = time.monotonic() - started
+            logger.info(f'{len(jobs)} jobs: {stage} took {time.monotonic() - started:.1f}s')
+            return result
+
+    def _slot(self, stage):
+        """A worker slot of stage; unlimited while stages run inline"""
+        return self._slots.get(stage) or contextlib.nullcontext()
+
+    async def _run_stage(self, stage, job):
+        job.stage = stage
+        if self.on_stage:
+            await self.on_stage(job, stage)
+        started = time.monotonic()
+        await self.handlers[stage](job)
+        job.stage_seconds[stage] = time.monotonic() - started
+        logger.info(f'{job.object_id}: {stage} took {job.stage_seconds[stage]:.1f}s')
+
+    async def _worker(self, stage):
+        queue = self.queues[stage]
+        next_stage = STAGES[STAGES.index(stage) + 1] if stage != STAGES[-1] else None
+        while True:
+            job = await queue.get()
+            try:
+                async with self._slot(stage):
+                    await self._run_stage(stage, job)
+            except asyncio.CancelledError:
+                if not job.future.done():
+                    job.future.cancel()
+                raise
+            except Exception as e:
+                logger.error(f'{job.object_id}: {stage} failed: {e}')
+                if not job.future.done():
+                    job.future.set_exception(e)
+            else:
+                if next_stage:
+                    # blocks while the next stage is full (backpressure)
+                    await self.queues[next_stage].put(job)
+                elif not job.future.done():
+                    job.future.set_result(job)
+            finally:
+                queue.task_done()
@@ -0,0 +1,102 @@
+'''
+Popularity driven pre-fetching.
+
+Ranks recently queried episodes by query rate and predicts the episodes
+users are likely to ask for next: the episode after a popular one, and the
+first episode of the next season of a popular series. The bot runs these
+through the normal pipeline while it is idle so the next request is a hit.
+'''
+import logging
+import time
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUDGET = 2
+DEFAULT_WINDOW_HOURS = 72
+# Don't retry a predicted episode (e.g. a season that doesn't exist yet)
+# more often than this
+DEFAULT_COOLDOWN = 6 * 60 * 60
+# A next season is less certain than a next episode
+NEXT_SEASON_WEIGHT = 0.5
+
+
+def query_rate(document, now, window_hours=DEFAULT_WINDOW_HOURS):
+    """
+    Queries per hour over the last window_hours, from the per-day counts in
+    daily_queries; the day the window starts in is counted whole
+    """
+    first_day = (now - timedelta(hours=window_hours)).date().isoformat()
+    daily_queries = document.get('daily_queries') or {}
+    recent = sum(count for day, count in daily_queries.items() if day >= first_day)
+    return recent / window_hours
+
+
+class PrefetchCandidate:
+    def __init__(self, series_name, series_key, season_id, episode_id, score):
+        self.series_name = series_name
+        self.series_key = series_key
+        self.season_id = season_id
+        self.episode_id = episode_id
+        self.score = score
+        self.object_id = f"{series_key}-s{season_id}-e{episode_id}"
+
+    def __repr__(self):
+        return f'<PrefetchCandidate {self.object_id} score={self.score:.2f}>'
+
+
+class Prefetcher:
+    def __init__(self, budget=DEFAULT_BUDGET, window_hours=DEFAULT_WINDOW_HOURS,
+                 cooldown=DEFAULT_COOLDOWN, clock=time.monotonic):
+        self.budget = budget
+        self.window_hours = window_hours
+        self.cooldown = cooldown
+        self.clock = clock
+        self._attempts = {}
+
+    def candidates(self, documents, now=None):
+        """Predicted episodes, best first, from recently queried documents"""
+        now = now or datetime.now()
+        known = {
+            (doc.get('series_key'), doc.get('season_id'), doc.get('episode_id'))
+            for doc in documents
+        }
+        scores = {}
+        names = {}
+        latest_season = {}
+        season_scores = {}
+
+        for doc in documents:
+            series_key = doc.get('series_key')
+            season_id = doc.get('season_id')
+            episode_id = doc.get('episode_id')
+            if not series_key or season_id is None or episode_id is None or episode_id < 0:
+                continue
+            rate = query_rate(doc, now, self.window_hours)
+            if rate <= 0:
+                continue
+            names[series_key] = doc.get('series_name') or series_key
+            latest_season[series_key] = max(latest_season.get(series_key, season_id), season_id)
+            season_scores[(series_key, season_id)] = season_scores.get((series_key, season_id), 0) + rate
+
+            key = (series_key, season_id, episode_id + 1)
+            scores[key] = max(scores.get(key, 0), rate)
+
+        for (series_key, season_id), score in season_scores.items():
+            if season_id >= 0 and season_id == latest_season[series_key]:
+                key = (series_key, season_id + 1, 1)
+                scores[key] = max(scores.get(key, 0), score * NEXT_SEASON_WEIGHT)
+
+        ranked = [
+            PrefetchCandidate(names[key[0]], key[0], key[1], key[2], score)
+            for key, score in scores.items() if key not in known
+        ]
+        ranked.sort(key=lambda candidate: candidate.score, reverse=True)
+        return ranked
+
+    def should_try(self, object_id):
+        last = self._attempts.get(object_id)
+        return last is None or self.clock() - last >= self.cooldown
+
+    def mark_attempt(self, object_id):
+        self._attempts[object_id] = self.clock()
@@ -0,0 +1,160 @@
+'''
+Rate shaping for outgoing Telegram calls.
+
+Telegram lets a bot send about 30 messages a second overall and about one a
+second to a single chat; going over earns a FloodWait (RetryAfter) that
+stalls delivery for far longer than the burst saved. Every call takes a
+token from the global bucket and from its chat's bucket first, waiting
+rather than failing when one is empty, and a FloodWait pauses the chat's
+bucket for as long as Telegram asks before the call is retried.
+
+The limiter only relies on the error's retry_after (python-telegram-bot
+RetryAfter) or seconds (Telethon FloodWaitError) attribute.
+'''
+import asyncio
+import logging
+import time
+from datetime import timedelta
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_GLOBAL_RATE = 25
+DEFAULT_CHAT_RATE = 1.0
+DEFAULT_CHAT_BURST = 3
+DEFAULT_MAX_RETRIES = 3
+# idle chat buckets are dropped once there are more than this many
+MAX_CHAT_BUCKETS = 10000
+
+
+def retry_after_seconds(error):
+    """Seconds a FloodWait error asks us to wait, None for other errors"""
+    value = getattr(error, 'retry_after', None)
+    if value is None:
+        value = getattr(error, 'seconds', None)
+    if isinstance(value, timedelta):
+        value = value.total_seconds()
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    return None
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self.clock = clock
+        self.tokens = float(capacity)
+        # tokens refill from here on; in the future while paused
+        self.updated = clock()
+
+    def reserve(self):
+        """Take a token, returning how many seconds to wait before using it"""
+        now = self.clock()
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+        self.tokens -= 1
+        wait = self.updated - now
+        if self.tokens < 0:
+            wait += -self.tokens / self.rate
+        return wait
+
+    def pause(self, seconds):
+        """Hand out no tokens for the next seconds"""
+        resume = self.clock() + seconds
+        if resume > self.updated:
+            self.tokens = min(self.tokens, 0.0)
+            self.updated = resume
+
+    def idle(self):
+        """True when the bucket is full again, i.e. nobody used it lately"""
+        return self.tokens + (self.clock() - self.updated) * self.rate >= self.capacity
+
+
+class RateLimiter:
+    def __init__(self, global_rate=DEFAULT_GLOBAL_RATE, chat_rate=DEFAULT_CHAT_RATE,
+                 chat_burst=DEFAULT_CHAT_BURST, max_retries=DEFAULT_MAX_RETRIES,
+                 max_flood_wait=None, clock=time.monotonic, sleep=asyncio.sleep):
+        '''
+        max_flood_wait: FloodWaits longer than this are raised to the caller
+        instead of being waited out (None waits out any FloodWait).
+        '''
+        self.global_bucket = TokenBucket(global_rate, global_rate, clock)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.max_flood_wait = max_flood_wait
+        self.clock = clock
+        self.sleep = sleep
+        self._chats = {}
+        self.calls = 0
+        self.delayed = 0
+        self.wait_seconds = 0.0
+        self.max_wait = 0.0
+        self.flood_waits = 0
+        self.flood_wait_seconds = 0.0
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= MAX_CHAT_BUCKETS:
+                self._chats = {
+                    key: value for key, value in self._chats.items() if not value.idle()
+                }
+            bucket = self._chats[chat_id] = TokenBucket(
+                self.chat_rate, self.chat_burst, self.clock
+            )
+        return bucket
+
+    async def acquire(self, chat_id=None):
+        """Wait until a call to chat_id may go out; returns the seconds waited"""
+        wait = self.global_bucket.reserve()
+        if chat_id is not None:
+            wait = max(wait, self._chat_bucket(chat_id).reserve())
+        self.calls += 1
+        if wait > 0:
+            self.delayed += 1
+            self.wait_seconds += wait
+            self.max_wait = max(self.max_wait, wait)
+            await self.sleep(wait)
+        return max(wait, 0.0)
+
+    def flood_wait(self, seconds, chat_id=None):
+        """Telegram asked for a pause: hold the chat (or every call) back"""
+        self.flood_waits += 1
+        self.flood_wait_seconds += seconds
+        if chat_id is None:
+            self.global_bucket.pause(seconds)
+        else:
+            self._chat_bucket(chat_id).pause(seconds)
+
+    async def run(self, chat_id, func, /, *args, **kwargs):
+        """
+        Await func(*args, **kwargs) once the buckets allow it, waiting out
+        and retrying FloodWaits up to max_retries times.
+        """
+        attempt = 0
+        while True:
+            await self.acquire(chat_id)
+            try:
+                return await func(*args, **kwargs)
+            except Exception as e:
+                seconds = retry_after_seconds(e)
+                if seconds is None or attempt >= self.max_retries or (
+                    self.max_flood_wait is not None and seconds > self.max_flood_wait
+                ):
+                    raise
+                attempt += 1
+                logger.warning(f'FloodWait of {seconds:.0f}s for chat {chat_id}, retrying')
+                self.flood_wait(seconds, chat_id)
+
+    def stats(self):
+        return {
+            'calls': self.calls,
+            'delayed': self.delayed,
+            'wait_seconds': round(self.wait_seconds, 2),
+            'max_wait': round(self.max_wait, 2),
+            'flood_waits': self.flood_waits,
+            'flood_wait_seconds': round(self.flood_wait_seconds, 1),
+            'chats': len(self._chats),
+        }
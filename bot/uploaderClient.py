@@ -0,0 +1,69 @@
+'''
+Client for the long running uploader daemon (uploaderService/daemon.py).
+
+Jobs are sent as newline delimited JSON over a local TCP socket; the daemon
+answers with progress events and one final done/error event.
+'''
+import asyncio
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class UploadError(Exception):
+    """The daemon accepted the job but could not upload the file"""
+
+
+def parse_address(address):
+    host, _, port = str(address).rpartition(':')
+    return host or '127.0.0.1', int(port)
+
+
+async def upload_via_daemon(address, file_path, chat_id, object_id, on_progress=None):
+    """
+    Hand an upload to the daemon at address ("host:port") and wait for it.
+
+    Returns the daemon's done event. Raises OSError if the daemon cannot be
+    reached (nothing was uploaded, so the caller may fall back to spawning
+    the uploader) and UploadError if the upload itself failed or the
+    connection broke after the job was handed over (the daemon may have
+    uploaded the file anyway, so it must not be uploaded again).
+    """
+    host, port = parse_address(address)
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        request = {
+            'op': 'upload',
+            'file_path': str(file_path),
+            'chat_id': chat_id,
+            'object_id': object_id,
+        }
+        writer.write((json.dumps(request) + '\n').encode())
+        await writer.drain()
+
+        while True:
+            line = await reader.readline()
+            if not line:
+                raise UploadError(f'Uploader daemon closed the connection during {object_id}')
+            event = json.loads(line)
+            kind = event.get('event')
+            if kind == 'progress':
+                if on_progress:
+                    on_progress(event.get('current', 0), event.get('total', 0))
+            elif kind == 'done':
+                logger.info(
+                    f"Daemon uploaded {object_id}: {event.get('bytes')} bytes "
+                    f"in {event.get('seconds')}s ({event.get('mb_per_s')} MB/s)"
+                )
+                return event
+            elif kind == 'error':
+                raise UploadError(event.get('error') or f'Upload of {object_id} failed')
+    except OSError as e:
+        raise UploadError(f'Lost the uploader daemon during {object_id}: {e}') from e
+    finally:
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except ConnectionError:
+            pass
@@ -1,13 +1,31 @@
 #!/usr/bin/env python3
 
 import subprocess
+import json
 import os
+import re
+import shutil
 import sys
+import time
 from pathlib import Path
 
+from mediaProbe import RENAME, chooseRemux, ffmpegCommand, isFaststart, probeMedia
+from segmentDownload import UnsupportedStream, completedDownload, downloadStream
+
 # Get the project root directory
 PROJECT_ROOT = Path(__file__).parent.parent
 
+# Name of the finished episode inside its download directory
+EPISODE_FILENAME = 'episode.mp4'
+# What the downloader produced (path, size, duration, codecs), read by the bot
+RESULT_NAME = 'result.json'
+# Written once the .ts is completely downloaded; a .ts without it may be cut short
+DOWNLOAD_DONE_NAME = 'download.done'
+
+
+class NotStreamable(Exception):
+    """A finished mp4 Telegram clients could only play once fully downloaded"""
+
 
 def downloadVideo(search_query, search_query_range, download_dir):
     # animdl download "demon slayer" -r 1
@@ -24,39 +42,301 @@ def downloadVideo(search_query, search_query_range, download_dir):
     subprocess.run(cmd, cwd=str(download_dir), check=True)
 
 
+def episodefiles(download_dir, extension):
+    """
+    Files with extension (e.g. 'ts') in an episode's download directory and
+    its immediate subdirectories, where animdl writes "<anime name>/E03.ts".
+    Only those two levels are listed, never the whole tree.
+    """
+    download_path = Path(download_dir)
+    if not download_path.is_dir():
+        return []
+    # glob is case sensitive, so spell out both cases of every letter
+    suffix = ''.join(f'[{c.lower()}{c.upper()}]' for c in extension)
+    files = []
+    for pattern in (f'*.{suffix}', f'*/*.{suffix}'):
+        files += sorted(path for path in download_path.glob(pattern) if path.is_file())
+    return files
+
+
 def getalltsfiles(download_dir):
     """Find .ts files in the download directory and return tuple of (ts_file, mp4_file) paths"""
-    download_path = Path(download_dir)
-    if not download_path.exists():
-        return None, None
-    
-    # Look for .ts files in the download directory (and immediate subdirectories)
-    for root, _, files in os.walk(download_path):
-        for file in files:
-            if file.split(".")[-1].lower() == 'ts':
-                filePath = os.path.join(root, file)
-                mp4FilePath = os.path.join(root, os.path.splitext(file)[0] + ".mp4")
-                if os.path.isfile(mp4FilePath):
-                    continue
-                return filePath, mp4FilePath
+    for ts_file in episodefiles(download_dir, 'ts'):
+        mp4_file = ts_file.with_suffix('.mp4')
+        if mp4_file.is_file():
+            continue
+        return str(ts_file), str(mp4_file)
     return None, None
 
 
 def convert2mp4(infile, outfile):
-    # ffmpeg -i E01.ts -c:v copy -c:a copy -preset:v ultrafast
-    # -segment_list_flags +live video.mp4
+    """
+    Turn infile into a streamable mp4 at outfile: a rename when it already
+    is one (faststart included), a stream copy into mp4 otherwise and a
+    transcode only for codecs Telegram can't stream. Returns the path taken.
+    """
     if not os.path.exists(infile):
         raise FileNotFoundError(f'Input file not found: {infile}')
-    
-    subprocess.run([
-        'ffmpeg', '-i', infile, '-c:v', 'copy', '-c:a', 'copy',
-        '-preset:v', 'ultrafast', '-segment_list_flags', '+live', outfile
-    ], cwd=str(PROJECT_ROOT), check=True)
+
+    started = time.monotonic()
+    media = probeMedia(infile)
+    plan = chooseRemux(media, faststart=isFaststart(infile))
+    if plan == RENAME:
+        os.replace(infile, outfile)
+    else:
+        # ffmpeg -i E01.ts -c:v copy -c:a copy -movflags +faststart episode.mp4
+        subprocess.run(ffmpegCommand(infile, outfile, plan, media), cwd=str(PROJECT_ROOT), check=True)
+    print(f'Remux path: {plan} ({media or "unprobed"}) in {time.monotonic() - started:.1f}s')
+    checkFaststart(outfile)
+    return plan
+
+
+def writeResult(download_dir, outfile):
+    """
+    Record the finished episode in download_dir/result.json: its path
+    (relative to download_dir), size, duration and codecs, so the bot can
+    pick it up without looking around the filesystem.
+    """
+    outfile = Path(outfile)
+    media = probeMedia(outfile) or {}
+    result = {
+        'path': os.path.relpath(outfile, download_dir),
+        'size': outfile.stat().st_size,
+        'duration': media.get('duration'),
+        'container': media.get('container'),
+        'video': media.get('video'),
+        'audio': media.get('audio'),
+    }
+    # write then rename, so the bot never reads a half-written result
+    path = Path(download_dir) / RESULT_NAME
+    tmp = path.with_name(path.name + '.tmp')
+    with open(tmp, 'w') as f:
+        json.dump(result, f, indent=1)
+    os.replace(tmp, path)
+    return result
+
+
+def checkFaststart(path):
+    """Warn when an mp4 would make Telegram clients wait for the whole file"""
+    if isFaststart(path):
+        return True
+    print(f'Warning: {path} has its moov atom after the media data, '
+          'playback will only start once most of it is downloaded')
+    return False
+
+
+def grabStreams(search_query, search_query_range):
+    """
+    Resolve stream urls with `animdl grab` instead of downloading.
+    Returns the list of stream dicts (stream_url, headers, quality, ...)
+    of the first episode animdl prints.
+    """
+    # animdl grab "demon slayer" -r 1
+    cmd = ['animdl', 'grab', search_query, '-r', str(search_query_range), '--auto']
+    print(*cmd)
+    result = subprocess.run(cmd, check=True, capture_output=True, text=True)
+    for line in result.stdout.splitlines():
+        line = line.strip()
+        if not line.startswith('{'):
+            continue
+        try:
+            grabbed = json.loads(line)
+        except json.JSONDecodeError:
+            continue
+        streams = [s for s in grabbed.get('streams', []) if s.get('stream_url')]
+        if streams:
+            return streams
+    return []
+
+
+def pickStream(streams):
+    """Prefer the highest numeric quality, keeping animdl's order otherwise"""
+    def quality(stream):
+        try:
+            return int(str(stream.get('quality', '')).rstrip('p'))
+        except ValueError:
+            return 0
+    return max(streams, key=quality) if streams else None
+
+
+def streamRemuxCommand(stream, outfile):
+    """ffmpeg command that reads the stream url and writes the mp4 as segments arrive"""
+    cmd = ['ffmpeg', '-y', '-loglevel', 'error']
+    headers = stream.get('headers') or {}
+    if headers:
+        cmd += ['-headers', ''.join(f'{k}: {v}\r\n' for k, v in headers.items())]
+    # a fragmented mp4: an empty moov up front, then a fragment per keyframe
+    # written as the segments arrive, so unlike +faststart there is no second
+    # pass rewriting the whole file once the last segment is in
+    cmd += ['-i', stream['stream_url'], '-c:v', 'copy', '-c:a', 'copy',
+            '-movflags', 'frag_keyframe+empty_moov+default_base_moof',
+            '-f', 'mp4', str(outfile)]
+    return cmd
+
+
+def streamVideo(search_query, search_query_range, download_dir):
+    """
+    Streaming pipeline: ffmpeg pulls the episode's segments straight from the
+    source and muxes them into the mp4 as they arrive, so no .ts file is
+    written and the mp4 is ready right after the last segment.
+    Returns the mp4 path, or None if animdl could not resolve a stream.
+    Raises NotStreamable when the mp4 came out without a leading moov.
+    """
+    stream = pickStream(grabStreams(search_query, search_query_range))
+    if not stream:
+        return None
+
+    outfile = Path(download_dir) / EPISODE_FILENAME
+    # write to a temporary name so a half-written file is never picked up
+    partfile = outfile.with_name(outfile.name + '.part')
+    subprocess.run(streamRemuxCommand(stream, partfile), cwd=str(PROJECT_ROOT), check=True)
+    if not isFaststart(partfile):
+        partfile.unlink(missing_ok=True)
+        raise NotStreamable(f'{outfile} has its moov atom after the media data')
+    os.replace(partfile, outfile)
+    writeResult(download_dir, outfile)
+    return outfile
+
+
+def resumableDownload(search_query, search_query_range, download_dir):
+    """
+    Fetch the episode's stream into download_dir/episode.ts, continuing
+    whatever an earlier attempt left behind. Returns the .ts path, or None
+    when animdl finds no stream url or the stream can't be fetched piece by
+    piece (e.g. encrypted HLS), in which case animdl download should be used.
+    Network errors are raised; the next retry resumes where this one stopped.
+    """
+    done = completedDownload(download_dir)
+    if done:
+        print(f'Already downloaded: {done}')
+        return done
+
+    try:
+        stream = pickStream(grabStreams(search_query, search_query_range))
+    except (subprocess.CalledProcessError, OSError) as e:
+        print(f'Warning: Could not resolve stream ({e})')
+        return None
+    if not stream:
+        return None
+
+    try:
+        return downloadStream(stream, download_dir)
+    except UnsupportedStream as e:
+        print(f'Warning: Stream not resumable ({e})')
+        return None
+
+
+def markDownloaded(download_dir, done=True):
+    """Write (or with done=False remove) the marker of a finished download"""
+    marker = Path(download_dir) / DOWNLOAD_DONE_NAME
+    if done:
+        marker.touch()
+    else:
+        marker.unlink(missing_ok=True)
+
+
+def getdownloadedmp4(download_dir):
+    """An .mp4 animdl downloaded directly (some sources aren't HLS), or None"""
+    for path in episodefiles(download_dir, 'mp4'):
+        if path.name != EPISODE_FILENAME:
+            return str(path)
+    return None
+
+
+def remux(download_dir):
+    """
+    Convert the downloaded .ts (or .mp4) in download_dir to
+    download_dir/episode.mp4 (where the bot expects it) and remove the
+    original. Returns the mp4 path, or None if there was nothing to convert.
+    """
+    infile, _ = getalltsfiles(download_dir)
+    if not infile:
+        infile = getdownloadedmp4(download_dir)
+    if not infile:
+        return None
+    outfile = Path(download_dir) / EPISODE_FILENAME
+    convert2mp4(infile, str(outfile))
+    # Clean up the original after conversion (a rename already moved it)
+    if os.path.exists(infile):
+        os.remove(infile)
+    writeResult(download_dir, outfile)
+    # the download it marked is gone, result.json covers the episode now
+    markDownloaded(download_dir, done=False)
+    return outfile
+
+
+def episodeNumber(ts_path):
+    """Episode number from an animdl file name such as E04.ts"""
+    stem = Path(ts_path).stem
+    match = re.search(r'E(\d+)', stem, re.IGNORECASE) or re.search(r'(\d+)(?!.*\d)', stem)
+    return int(match.group(1)) if match else None
+
+
+def getepisodetsfiles(download_dir):
+    """Map episode number -> .ts path for every episode animdl wrote"""
+    episodes = {}
+    for root, _, files in os.walk(download_dir):
+        for file in files:
+            if file.split(".")[-1].lower() == 'ts':
+                episode_id = episodeNumber(file)
+                if episode_id is not None:
+                    episodes[episode_id] = os.path.join(root, file)
+    return episodes
+
+
+def episodeDir(series_dir, season_id, episode_id):
+    """Same <series_dir>/SxxEyy layout as botUtils.get_download_path"""
+    season_str = f"S{season_id:02d}" if season_id >= 0 else "S00"
+    episode_str = f"E{episode_id:02d}" if episode_id >= 0 else "E00"
+    return Path(series_dir) / f"{season_str}{episode_str}"
+
+
+def downloadBatch(search_query, season_id, search_query_range, series_dir):
+    """
+    Download a whole episode range in one animdl run, then split the result
+    into one <series_dir>/SxxEyy/episode.mp4 per episode.
+    Returns the list of episode numbers that were produced.
+    """
+    safe_range = re.sub(r'[^0-9]+', '_', str(search_query_range))
+    staging_dir = Path(series_dir) / f'.batch-S{int(season_id):02d}-{safe_range}'
+    staging_dir.mkdir(parents=True, exist_ok=True)
+
+    downloadVideo(search_query, search_query_range, staging_dir)
+
+    produced = []
+    for episode_id, infile in sorted(getepisodetsfiles(staging_dir).items()):
+        outdir = episodeDir(series_dir, int(season_id), episode_id)
+        outdir.mkdir(parents=True, exist_ok=True)
+        convert2mp4(infile, str(outdir / EPISODE_FILENAME))
+        os.remove(infile)
+        writeResult(outdir, outdir / EPISODE_FILENAME)
+        produced.append(episode_id)
+    shutil.rmtree(staging_dir, ignore_errors=True)
+    print(f'Batch produced episodes: {produced}')
+    return produced
 
 
 def main(argv):
+    flags = {arg for arg in argv if arg.startswith('--')}
+    argv = [arg for arg in argv if not arg.startswith('--')]
+
+    if '--remux-only' in flags:
+        # python main.py --remux-only <download_dir>
+        if len(argv) < 2:
+            print('Usage: python main.py --remux-only <download_dir>')
+            sys.exit(1)
+        try:
+            if not remux(Path(argv[1])):
+                print('Warning: No .ts files found to convert')
+        except Exception as e:
+            print(f'Error: {e}')
+            sys.exit(1)
+        return
+
     if len(argv) < 5:
-        print('Usage: python main.py <search_query> <season_id> <episode_range> <download_dir>')
+        print('Usage: python main.py <search_query> <season_id> <episode_range> <download_dir> '
+              '[--stream] [--skip-remux]')
+        print('       python main.py <search_query> <season_id> <episode_range> <series_dir> --batch')
         sys.exit(1)
     
     search_query = argv[1]
@@ -70,15 +350,26 @@ def main(argv):
     print(f'Downloading: {search_query}, Season: {season_id}, Episode: {search_query_range}')
     
     try:
-        downloadVideo(search_query, search_query_range, download_dir)
-        infile, outfile = getalltsfiles(download_dir)
-        
-        if infile and outfile:
-            convert2mp4(infile, outfile)
-            # Clean up .ts file after conversion
-            if os.path.exists(infile):
-                os.remove(infile)
-        else:
+        if '--batch' in flags:
+            # python main.py "Death Note" 1 1-12 downloads/death_note --batch
+            if not downloadBatch(search_query, season_id, search_query_range, download_dir):
+                print('Warning: No .ts files found to convert')
+            return
+
+        if '--stream' in flags:
+            try:
+                if streamVideo(search_query, search_query_range, download_dir):
+                    return
+                print('Warning: No stream url found, falling back to download')
+            except subprocess.CalledProcessError as e:
+                print(f'Warning: Streaming failed ({e}), falling back to download')
+
+        markDownloaded(download_dir, done=False)
+        if not resumableDownload(search_query, search_query_range, download_dir):
+            downloadVideo(search_query, search_query_range, download_dir)
+        markDownloaded(download_dir)
+        # With --skip-remux the .ts is left for a separate --remux-only run
+        if '--skip-remux' not in flags and not remux(download_dir):
             print('Warning: No .ts files found to convert')
     except subprocess.CalledProcessError as e:
         print(f'Error in subprocess: {e}')
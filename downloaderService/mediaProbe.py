@@ -0,0 +1,140 @@
+'''
+Picks the cheapest way to turn a download into a streamable episode.mp4.
+
+ffprobe reports the container and codecs of the input, and only as much
+work is done as Telegram needs to stream it:
+
+    rename     already a faststart MP4 with H.264 video and AAC/MP3 audio
+    remux      streamable codecs in another container (the usual .ts),
+               copied into an MP4 with the index moved to the front
+    transcode  a codec Telegram can't stream; only that stream is re-encoded
+
+Every MP4 we hand to the uploader has its moov atom (the index) before the
+media data ("faststart"). With the index at the end a Telegram client has to
+fetch nearly the whole file before the first frame; isFaststart() checks
+the finished file.
+'''
+import json
+import struct
+import subprocess
+
+PROBE_TIMEOUT = 60
+
+# codecs Telegram clients play inline
+STREAMABLE_VIDEO = {'h264'}
+STREAMABLE_AUDIO = {'aac', 'mp3'}
+
+RENAME = 'rename'
+REMUX = 'remux'
+TRANSCODE = 'transcode'
+
+
+def probeMedia(path):
+    """
+    Container, duration (seconds) and codecs of path as {'container',
+    'duration', 'video', 'audio'} (None for a missing stream or an unknown
+    duration), or None when ffprobe can't tell.
+    """
+    cmd = [
+        'ffprobe', '-v', 'error',
+        '-show_entries', 'format=format_name,duration:stream=codec_type,codec_name',
+        '-of', 'json', str(path),
+    ]
+    try:
+        result = subprocess.run(cmd, check=True, capture_output=True, text=True,
+                                timeout=PROBE_TIMEOUT)
+        probed = json.loads(result.stdout)
+    except (subprocess.CalledProcessError, subprocess.TimeoutExpired, OSError, ValueError):
+        return None
+
+    fmt = probed.get('format', {})
+    try:
+        duration = round(float(fmt['duration']), 2)
+    except (KeyError, TypeError, ValueError):
+        duration = None
+    media = {
+        'container': fmt.get('format_name', ''),
+        'duration': duration,
+        'video': None,
+        'audio': None,
+    }
+    for stream in probed.get('streams', []):
+        kind = stream.get('codec_type')
+        # the first stream of a kind is the one ffmpeg maps by default
+        if kind in ('video', 'audio') and media[kind] is None:
+            media[kind] = stream.get('codec_name')
+    return media
+
+
+def topLevelAtoms(path):
+    """Types of the top-level MP4 boxes of path, in file order"""
+    atoms = []
+    with open(path, 'rb') as f:
+        f.seek(0, 2)
+        end = f.tell()
+        offset = 0
+        while offset + 8 <= end:
+            f.seek(offset)
+            size, kind = struct.unpack('>I4s', f.read(8))
+            if size == 1:
+                # 64-bit size follows the type
+                size = struct.unpack('>Q', f.read(8))[0]
+            elif size == 0:
+                # box runs to the end of the file
+                size = end - offset
+            if size < 8:
+                break
+            atoms.append(kind.decode('latin-1'))
+            offset += size
+    return atoms
+
+
+def isFaststart(path):
+    """True when the moov atom of the MP4 at path comes before its mdat"""
+    try:
+        atoms = topLevelAtoms(path)
+    except (OSError, struct.error):
+        return False
+    if 'moov' not in atoms:
+        return False
+    # a fragmented MP4 (moof boxes) is streamable with a leading moov too
+    return 'mdat' not in atoms or atoms.index('moov') < atoms.index('mdat')
+
+
+def isMp4(media):
+    # ffprobe names the whole ISO family "mov,mp4,m4a,3gp,3g2,mj2"
+    return 'mp4' in media['container'].split(',')
+
+
+def streamable(media):
+    return media['video'] in STREAMABLE_VIDEO and \
+        media['audio'] in STREAMABLE_AUDIO | {None}
+
+
+def chooseRemux(media, faststart=False):
+    """
+    rename, remux or transcode for a probed input (remux when unknown).
+    faststart tells whether the input already has its moov up front; an MP4
+    without it is remuxed so the index moves to the front.
+    """
+    if media is None:
+        return REMUX
+    if not streamable(media):
+        return TRANSCODE
+    return RENAME if isMp4(media) and faststart else REMUX
+
+
+def ffmpegCommand(infile, outfile, plan, media=None):
+    """ffmpeg command carrying out a remux or transcode plan"""
+    cmd = ['ffmpeg', '-y', '-loglevel', 'error', '-i', str(infile)]
+    if plan == TRANSCODE and media and media['video'] not in STREAMABLE_VIDEO:
+        cmd += ['-c:v', 'libx264', '-preset', 'veryfast', '-crf', '23']
+    else:
+        cmd += ['-c:v', 'copy']
+    if plan == TRANSCODE and media and media['audio'] not in STREAMABLE_AUDIO | {None}:
+        cmd += ['-c:a', 'aac', '-b:a', '160k']
+    else:
+        cmd += ['-c:a', 'copy']
+    # moov atom up front, so playback can start before the whole file arrives
+    cmd += ['-movflags', '+faststart', '-f', 'mp4', str(outfile)]
+    return cmd
@@ -0,0 +1,216 @@
+'''
+Resumable stream downloads.
+
+The episode is fetched straight from the stream url animdl resolves: an HLS
+playlist segment by segment, anything else as a single file. Every finished
+piece is recorded in manifest.json (size and sha256) inside the download
+directory and a partly fetched piece is continued with a Range request, so a
+retry after a flaky mirror only fetches what is still missing. The pieces are
+joined into one .ts for the usual remux step.
+'''
+import hashlib
+import json
+import os
+import urllib.error
+import urllib.parse
+import urllib.request
+from pathlib import Path
+
+MANIFEST_NAME = 'manifest.json'
+SEGMENTS_DIRNAME = '.segments'
+OUTPUT_NAME = 'episode.ts'
+
+REQUEST_TIMEOUT = 30
+SEGMENT_ATTEMPTS = 3
+CHUNK_SIZE = 256 * 1024
+
+
+class UnsupportedStream(Exception):
+    """The stream can't be fetched segment by segment (encrypted, fMP4, ...)"""
+
+
+def isPlaylist(url):
+    return urllib.parse.urlparse(url).path.lower().endswith('.m3u8')
+
+
+def parsePlaylist(text, base_url):
+    """
+    Parse an HLS playlist. Returns ('master', [(bandwidth, url), ...]) for a
+    master playlist and ('media', [segment_url, ...]) for a media playlist.
+    Raises UnsupportedStream for encrypted or fMP4 playlists.
+    """
+    variants = []
+    segments = []
+    bandwidth = None
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith('#EXT-X-KEY'):
+            if 'METHOD=NONE' not in line:
+                raise UnsupportedStream('encrypted playlist')
+        elif line.startswith('#EXT-X-MAP'):
+            raise UnsupportedStream('fMP4 playlist')
+        elif line.startswith('#EXT-X-STREAM-INF'):
+            bandwidth = 0
+            for attribute in line.split(':', 1)[1].split(','):
+                if attribute.startswith('BANDWIDTH='):
+                    bandwidth = int(attribute.split('=', 1)[1])
+        elif not line.startswith('#'):
+            url = urllib.parse.urljoin(base_url, line)
+            if bandwidth is not None:
+                variants.append((bandwidth, url))
+                bandwidth = None
+            else:
+                segments.append(url)
+    if variants:
+        return 'master', variants
+    return 'media', segments
+
+
+def openUrl(url, headers=None, offset=0):
+    request = urllib.request.Request(url, headers=dict(headers or {}))
+    if offset:
+        request.add_header('Range', f'bytes={offset}-')
+    return urllib.request.urlopen(request, timeout=REQUEST_TIMEOUT)
+
+
+def fetchText(url, headers=None):
+    with openUrl(url, headers) as response:
+        return response.read().decode('utf-8', errors='replace')
+
+
+def resolveSegments(url, headers=None):
+    """Segment urls of the best variant of an HLS stream"""
+    kind, entries = parsePlaylist(fetchText(url, headers), url)
+    if kind == 'master':
+        _, url = max(entries)
+        kind, entries = parsePlaylist(fetchText(url, headers), url)
+        if kind == 'master':
+            raise UnsupportedStream('nested master playlist')
+    return entries
+
+
+def fileDigest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def loadManifest(download_dir):
+    try:
+        with open(Path(download_dir) / MANIFEST_NAME) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def saveManifest(download_dir, manifest):
+    # write then rename, so a crash never leaves a half-written manifest
+    path = Path(download_dir) / MANIFEST_NAME
+    tmp = path.with_name(path.name + '.tmp')
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(tmp, path)
+
+
+def isComplete(path, entry):
+    """True when path matches the size and checksum recorded in entry"""
+    path = Path(path)
+    return bool(entry) and path.is_file() and path.stat().st_size == entry['size'] \
+        and fileDigest(path) == entry['sha256']
+
+
+def fetchResumable(url, path, headers=None):
+    """
+    Download url to path, continuing a leftover path.part with a Range
+    request. Returns the manifest entry (size, sha256) of the finished file.
+    """
+    path = Path(path)
+    partfile = path.with_name(path.name + '.part')
+    last_error = None
+    for _ in range(SEGMENT_ATTEMPTS):
+        offset = partfile.stat().st_size if partfile.exists() else 0
+        try:
+            with openUrl(url, headers, offset) as response:
+                # 206 continues the partial file, anything else starts over
+                mode = 'ab' if offset and response.status == 206 else 'wb'
+                with open(partfile, mode) as f:
+                    for chunk in iter(lambda: response.read(CHUNK_SIZE), b''):
+                        f.write(chunk)
+            break
+        except urllib.error.HTTPError as e:
+            if e.code == 416 and offset:
+                # the partial file already holds everything
+                break
+            last_error = e
+        except (urllib.error.URLError, OSError) as e:
+            last_error = e
+    else:
+        raise last_error
+
+    os.replace(partfile, path)
+    return {'size': path.stat().st_size, 'sha256': fileDigest(path)}
+
+
+def completedDownload(download_dir):
+    """The .ts a previous attempt finished, if it is still intact"""
+    output = Path(download_dir) / OUTPUT_NAME
+    manifest = loadManifest(download_dir) or {}
+    return output if isComplete(output, manifest.get('output')) else None
+
+
+def downloadStream(stream, download_dir):
+    """
+    Fetch stream (an animdl stream dict) into download_dir/episode.ts,
+    skipping whatever a previous attempt already finished.
+    Returns the .ts path.
+    """
+    download_dir = Path(download_dir)
+    headers = stream.get('headers') or {}
+    url = stream['stream_url']
+    output = download_dir / OUTPUT_NAME
+
+    if completedDownload(download_dir):
+        print(f'Already downloaded: {output}')
+        return output
+    manifest = loadManifest(download_dir) or {}
+
+    segment_urls = resolveSegments(url, headers) if isPlaylist(url) else [url]
+    # stream urls are often signed per request, so finished pieces are
+    # matched by position; a different segment count means a different
+    # rendition and the old pieces can't be reused
+    if manifest.get('segment_count') != len(segment_urls):
+        manifest = {'segment_count': len(segment_urls), 'segments': {}}
+
+    segments_dir = download_dir / SEGMENTS_DIRNAME
+    segments_dir.mkdir(parents=True, exist_ok=True)
+    reused = 0
+    for index, segment_url in enumerate(segment_urls):
+        path = segments_dir / f'{index:05d}.seg'
+        if isComplete(path, manifest['segments'].get(str(index))):
+            reused += 1
+            continue
+        manifest['segments'][str(index)] = fetchResumable(segment_url, path, headers)
+        saveManifest(download_dir, manifest)
+    print(f'Fetched {len(segment_urls) - reused} of {len(segment_urls)} pieces '
+          f'({reused} reused from an earlier attempt)')
+
+    # MPEG-TS segments can simply be concatenated
+    partfile = output.with_name(output.name + '.part')
+    with open(partfile, 'wb') as out:
+        for index in range(len(segment_urls)):
+            with open(segments_dir / f'{index:05d}.seg', 'rb') as f:
+                for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                    out.write(chunk)
+    os.replace(partfile, output)
+
+    manifest['output'] = {'path': OUTPUT_NAME, 'size': output.stat().st_size,
+                          'sha256': fileDigest(output)}
+    saveManifest(download_dir, manifest)
+    for path in segments_dir.iterdir():
+        path.unlink()
+    segments_dir.rmdir()
+    return output
@@ -8,6 +8,7 @@ from unittest.mock import AsyncMock, Mock, MagicMock, patch
 import json
 import tempfile
 import os
+from types import ModuleType, SimpleNamespace
 
 # Add project root to path
 PROJECT_ROOT = Path(__file__).parent.parent
@@ -48,6 +49,7 @@ if 'telegram' not in sys.modules:
     telegram_mock.Update = MagicMock
     telegram_mock.ext = MagicMock()
     telegram_mock.ext.Application = MagicMock
+    telegram_mock.ext.BaseRateLimiter = type('BaseRateLimiter', (), {})
     telegram_mock.ext.CommandHandler = MagicMock
     telegram_mock.ext.MessageHandler = MagicMock
     telegram_mock.ext.ContextTypes = MagicMock()
@@ -59,6 +61,42 @@ if 'telegram' not in sys.modules:
     sys.modules['telegram'] = telegram_mock
     sys.modules['telegram.ext'] = telegram_mock.ext
 
+
+def _request_type(name, fields):
+    def __init__(self, *args):
+        self.__dict__.update(zip(fields, args))
+    return type(name, (), {'__init__': __init__})
+
+
+# Stand in for the telethon pieces the uploader uses
+if 'telethon' not in sys.modules:
+    telethon_mock = ModuleType('telethon')
+    telethon_mock.helpers = SimpleNamespace(generate_random_long=lambda: 42)
+    upload_mock = ModuleType('telethon.tl.functions.upload')
+    upload_mock.SaveBigFilePartRequest = _request_type(
+        'SaveBigFilePartRequest', ['file_id', 'file_part', 'file_total_parts', 'bytes'])
+    upload_mock.SaveFilePartRequest = _request_type(
+        'SaveFilePartRequest', ['file_id', 'file_part', 'bytes'])
+    types_mock = ModuleType('telethon.tl.types')
+    types_mock.InputFileBig = _request_type('InputFileBig', ['id', 'parts', 'name'])
+    types_mock.InputFile = _request_type('InputFile', ['id', 'parts', 'name', 'md5_checksum'])
+    errors_mock = ModuleType('telethon.errors')
+
+    class FloodWaitError(Exception):
+        def __init__(self, seconds):
+            super().__init__(f'A wait of {seconds} seconds is required')
+            self.seconds = seconds
+
+    errors_mock.FloodWaitError = FloodWaitError
+    errors_mock.ServerError = type('ServerError', (Exception,), {})
+    sys.modules['telethon.errors'] = errors_mock
+    sys.modules['telethon'] = telethon_mock
+    sys.modules['telethon.tl'] = ModuleType('telethon.tl')
+    sys.modules['telethon.tl.functions'] = ModuleType('telethon.tl.functions')
+    sys.modules['telethon.tl.functions.upload'] = upload_mock
+    sys.modules['telethon.tl.types'] = types_mock
+
+
 # Create temporary config files for testing
 @pytest.fixture(autouse=True)
 def temp_config_dir(tmp_path, monkeypatch):
@@ -85,6 +123,17 @@ def temp_config_dir(tmp_path, monkeypatch):
     # Return the project root (tmp_path) so tests can use it
     return tmp_path
 
+@pytest.fixture(autouse=True)
+def reset_bot_state(monkeypatch):
+    """Give each test fresh in-memory bot state (in-flight fetches etc.)"""
+    bot_module = sys.modules.get('bot.bot')
+    if bot_module is not None:
+        monkeypatch.setattr(bot_module, 'inflight', type(bot_module.inflight)())
+        monkeypatch.setattr(bot_module, 'episode_cache', type(bot_module.episode_cache)())
+        monkeypatch.setattr(bot_module, 'prefetcher', type(bot_module.prefetcher)())
+        monkeypatch.setattr(bot_module, 'artifact_cache',
+                            type(bot_module.artifact_cache)(bot_module.artifact_cache.root))
+
 @pytest.fixture
 def temp_agent_config_dir(tmp_path):
     """Create temporary agent config directory"""
@@ -0,0 +1,208 @@
+"""
+In-memory stand-ins for external services, for tests and benchmarks
+"""
+import copy
+import itertools
+import threading
+
+
+class DuplicateKeyError(Exception):
+    pass
+
+
+class _Result:
+    def __init__(self, **fields):
+        self.__dict__.update(fields)
+
+
+def _matches(document, query):
+    for field, expected in query.items():
+        value = document.get(field)
+        if isinstance(expected, dict) and any(k.startswith('$') for k in expected):
+            for op, operand in expected.items():
+                if op == '$in' and value not in operand:
+                    return False
+                if op == '$nin' and value in operand:
+                    return False
+                if op == '$ne' and value == operand:
+                    return False
+                if op == '$gt' and not (value is not None and value > operand):
+                    return False
+                if op == '$gte' and not (value is not None and value >= operand):
+                    return False
+                if op == '$lt' and not (value is not None and value < operand):
+                    return False
+                if op == '$lte' and not (value is not None and value <= operand):
+                    return False
+                if op == '$exists' and (field in document) != bool(operand):
+                    return False
+        elif value != expected:
+            return False
+    return True
+
+
+def _parent(document, field):
+    """The (sub)document holding a dotted field and the field's last key"""
+    *parents, key = field.split('.')
+    for parent in parents:
+        document = document.setdefault(parent, {})
+    return document, key
+
+
+def _apply_update(document, update, inserting=False):
+    for op, fields in update.items():
+        for field, operand in fields.items():
+            if op == '$inc':
+                parent, key = _parent(document, field)
+                parent[key] = parent.get(key, 0) + operand
+            elif op == '$set':
+                parent, key = _parent(document, field)
+                parent[key] = operand
+            elif op == '$setOnInsert' and inserting:
+                document[field] = operand
+            elif op == '$unset':
+                document.pop(field, None)
+            elif op == '$addToSet':
+                values = document.setdefault(field, [])
+                if operand not in values:
+                    values.append(operand)
+
+
+def _project(document, projection):
+    """Apply an exclusion projection ({'field': 0}) to a copy of document"""
+    document = copy.deepcopy(document)
+    for field, keep in (projection or {}).items():
+        if not keep:
+            document.pop(field, None)
+    return document
+
+
+class FakeCursor(list):
+    def sort(self, key, direction=1):
+        keys = key if isinstance(key, list) else [(key, direction)]
+        for field, order in reversed(keys):
+            super().sort(key=lambda doc: (doc.get(field) is None, doc.get(field)),
+                         reverse=order < 0)
+        return self
+
+    def limit(self, count):
+        if count:
+            del self[count:]
+        return self
+
+
+class InMemoryCollection:
+    """
+    A small pymongo Collection stand-in: equality and basic comparison
+    filters, $inc/$set/$setOnInsert/$unset/$addToSet updates, upserts and unique
+    indexes. Thread safe, so it also works behind the async executor.
+    """
+
+    def __init__(self):
+        self.documents = []
+        self.unique_indexes = []
+        self.operations = []
+        self._ids = itertools.count(1)
+        self._lock = threading.RLock()
+
+    def create_index(self, keys, unique=False, name=None, **kwargs):
+        if unique:
+            self.unique_indexes.append([field for field, _ in keys])
+        return name
+
+    def _check_unique(self, document, ignore=None):
+        for fields in self.unique_indexes:
+            key = {field: document.get(field) for field in fields}
+            for existing in self.documents:
+                if existing is not ignore and _matches(existing, key):
+                    raise DuplicateKeyError(key)
+
+    def insert_one(self, document):
+        with self._lock:
+            self.operations.append('insert_one')
+            document.setdefault('_id', next(self._ids))
+            self._check_unique(document)
+            self.documents.append(copy.deepcopy(document))
+            return _Result(inserted_id=document['_id'])
+
+    def find_one(self, filter=None, projection=None, **kwargs):
+        with self._lock:
+            self.operations.append('find_one')
+            for document in self.documents:
+                if _matches(document, filter or {}):
+                    return _project(document, projection)
+            return None
+
+    def find(self, filter=None, projection=None, **kwargs):
+        with self._lock:
+            self.operations.append('find')
+            return FakeCursor(
+                _project(document, projection) for document in self.documents
+                if _matches(document, filter or {})
+            )
+
+    def _update(self, filter, update, upsert=False, many=False):
+        matched = [d for d in self.documents if _matches(d, filter)]
+        if not many:
+            matched = matched[:1]
+        for document in matched:
+            _apply_update(document, update)
+        upserted_id = None
+        if not matched and upsert:
+            document = {k: v for k, v in filter.items() if not isinstance(v, dict)}
+            _apply_update(document, update, inserting=True)
+            upserted_id = self.insert_one(document).inserted_id
+        return _Result(matched_count=len(matched), modified_count=len(matched),
+                       upserted_id=upserted_id)
+
+    def update_one(self, filter, update, upsert=False, **kwargs):
+        with self._lock:
+            self.operations.append('update_one')
+            return self._update(filter, update, upsert=upsert)
+
+    def update_many(self, filter, update, upsert=False, **kwargs):
+        with self._lock:
+            self.operations.append('update_many')
+            return self._update(filter, update, upsert=upsert, many=True)
+
+    def find_one_and_update(self, filter, update, upsert=False, return_document=False, **kwargs):
+        with self._lock:
+            self.operations.append('find_one_and_update')
+            for document in self.documents:
+                if _matches(document, filter):
+                    before = copy.deepcopy(document)
+                    _apply_update(document, update)
+                    return copy.deepcopy(document) if return_document else before
+            if upsert:
+                self._update(filter, update, upsert=True)
+                return copy.deepcopy(self.documents[-1]) if return_document else None
+            return None
+
+    def delete_one(self, filter):
+        with self._lock:
+            self.operations.append('delete_one')
+            for document in self.documents:
+                if _matches(document, filter):
+                    self.documents.remove(document)
+                    return _Result(deleted_count=1)
+            return _Result(deleted_count=0)
+
+    def bulk_write(self, requests, ordered=True):
+        """Accepts pymongo UpdateOne-like objects (_filter, _doc, _upsert)"""
+        with self._lock:
+            self.operations.append('bulk_write')
+            modified = 0
+            for request in requests:
+                result = self._update(request._filter, request._doc,
+                                      upsert=getattr(request, '_upsert', False))
+                modified += result.modified_count
+            return _Result(modified_count=modified, matched_count=modified)
+
+
+class FakeUpdateOne:
+    """Stand-in for pymongo.UpdateOne when pymongo itself is mocked out"""
+
+    def __init__(self, filter, update, upsert=False):
+        self._filter = filter
+        self._doc = update
+        self._upsert = upsert
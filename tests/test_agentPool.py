@@ -0,0 +1,84 @@
+"""
+Tests for scheduling uploads over several agent accounts
+"""
+import pytest
+import sys
+import asyncio
+import time
+from pathlib import Path
+
+# Add project root to path
+PROJECT_ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+
+from uploaderService.agentPool import Agent, AgentPool
+
+
+def make_pool(count=3, **kwargs):
+    return AgentPool([Agent(f"agent{i}") for i in range(count)], **kwargs)
+
+
+class TestAgentPool:
+    """Tests for AgentPool"""
+
+    def test_needs_an_agent(self):
+        with pytest.raises(ValueError):
+            AgentPool([])
+
+    @pytest.mark.asyncio
+    async def test_spreads_uploads(self):
+        """Test that concurrent uploads go to different agents"""
+        pool = make_pool(3)
+
+        picked = [await pool.acquire() for _ in range(3)]
+
+        assert {agent.name for agent in picked} == {"agent0", "agent1", "agent2"}
+        assert pool.pick() is None
+
+    @pytest.mark.asyncio
+    async def test_prefers_least_used(self):
+        pool = make_pool(2)
+        pool.agents[0].uploads = 10
+
+        assert (await pool.acquire()).name == "agent1"
+
+    @pytest.mark.asyncio
+    async def test_skips_flood_waited_agent(self):
+        pool = make_pool(2)
+        pool.flood_wait(pool.agents[1], 60)
+        pool.agents[0].uploads = 10
+
+        assert (await pool.acquire()).name == "agent0"
+        assert pool.stats()[1]["flood_wait"] == pytest.approx(60, abs=1)
+
+    @pytest.mark.asyncio
+    async def test_waits_for_release(self):
+        pool = make_pool(1)
+        agent = await pool.acquire()
+
+        waiter = asyncio.ensure_future(pool.acquire())
+        await asyncio.sleep(0.01)
+        assert not waiter.done()
+
+        await pool.release(agent)
+        assert await asyncio.wait_for(waiter, 1) is agent
+
+    @pytest.mark.asyncio
+    async def test_waits_for_flood_wait_to_end(self):
+        pool = make_pool(1)
+        pool.flood_wait(pool.agents[0], 0.05)
+
+        started = time.monotonic()
+        agent = await asyncio.wait_for(pool.acquire(), 1)
+
+        assert agent.name == "agent0"
+        assert time.monotonic() - started >= 0.04
+
+    @pytest.mark.asyncio
+    async def test_max_active_per_agent(self):
+        pool = make_pool(2, max_active=2)
+
+        picked = [await pool.acquire() for _ in range(4)]
+
+        assert pool.capacity == 4
+        assert sorted(agent.name for agent in picked) == ["agent0", "agent0", "agent1", "agent1"]
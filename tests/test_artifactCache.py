@@ -0,0 +1,147 @@
+"""
+Tests for the on-disk artifact cache
+"""
+import pytest
+import os
+import sys
+from collections import namedtuple
+from pathlib import Path
+
+# Add project root to path
+PROJECT_ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+
+from bot.artifactCache import ArtifactCache
+
+DiskUsage = namedtuple('DiskUsage', 'total used free')
+
+
+def plenty_of_space(path):
+    return DiskUsage(1 << 50, 0, 1 << 50)
+
+
+@pytest.fixture
+def downloads(tmp_path):
+    return tmp_path / "downloads"
+
+
+def write_episode(root, name, size, mtime=None):
+    path = root / "death_note" / name / "episode.mp4"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(b"x" * size)
+    if mtime is not None:
+        os.utime(path, (mtime, mtime))
+    return path
+
+
+class TestArtifactCache:
+    """Tests for ArtifactCache"""
+
+    def test_evicts_least_recently_used(self, downloads):
+        cache = ArtifactCache(downloads, max_bytes=25, disk_usage=plenty_of_space)
+        first = write_episode(downloads, "S01E01", 10)
+        second = write_episode(downloads, "S01E02", 10)
+        cache.add(first)
+        cache.add(second)
+        cache.get(first)
+
+        third = write_episode(downloads, "S01E03", 10)
+        cache.add(third)
+
+        assert not second.exists()
+        # the emptied episode directory goes too
+        assert not second.parent.exists()
+        assert first.exists() and third.exists()
+        assert cache.bytes == 20
+
+    def test_eviction_removes_sidecar_files(self, downloads):
+        """Test that the downloader's files go with the episode and its directory"""
+        cache = ArtifactCache(downloads, max_bytes=15, disk_usage=plenty_of_space)
+        first = write_episode(downloads, "S01E01", 10)
+        (first.parent / "result.json").write_text("{}")
+        (first.parent / "manifest.json").write_text("{}")
+        cache.add(first)
+
+        cache.add(write_episode(downloads, "S01E02", 10))
+
+        assert not first.parent.exists()
+        assert cache.stats()["evictions"] == 1
+
+    def test_partial_downloads_count_and_are_evicted(self, downloads):
+        """Test that the leftovers of a failed download are accounted and evicted"""
+        cache = ArtifactCache(downloads, max_bytes=25, disk_usage=plenty_of_space)
+        partial = downloads / "death_note" / "S01E01"
+        (partial / ".segments").mkdir(parents=True)
+        (partial / ".segments" / "00000.ts").write_bytes(b"x" * 8)
+        (partial / "E01.ts").write_bytes(b"x" * 4)
+        cache.add(partial / "episode.mp4")
+
+        assert cache.bytes == 12
+        # no episode to hand out, the leftovers stay tracked
+        assert cache.get(partial / "episode.mp4") is None
+        assert partial / "episode.mp4" in cache
+
+        cache.add(write_episode(downloads, "S01E02", 20))
+
+        assert not partial.exists()
+        assert cache.bytes == 20
+
+    def test_pinned_files_are_kept(self, downloads):
+        cache = ArtifactCache(downloads, max_bytes=15, disk_usage=plenty_of_space)
+        pinned = write_episode(downloads, "S01E01", 10)
+        cache.pin(pinned)
+        cache.add(pinned)
+
+        other = write_episode(downloads, "S01E02", 10)
+        cache.add(other)
+
+        assert pinned.exists()
+        assert not other.exists()
+
+        cache.unpin(pinned)
+        cache.add(write_episode(downloads, "S01E03", 10))
+        assert not pinned.exists()
+
+    def test_low_disk_space_evicts(self, downloads):
+        free = {"bytes": 5}
+
+        def disk_usage(path):
+            return DiskUsage(100, 100 - free["bytes"], free["bytes"])
+
+        cache = ArtifactCache(downloads, max_bytes=1000, min_free_bytes=10, disk_usage=disk_usage)
+        path = write_episode(downloads, "S01E01", 10)
+        cache.pin(path)
+        cache.add(path)
+        cache.unpin(path)
+        free["bytes"] = 50
+        cache.add(write_episode(downloads, "S01E02", 10))
+        assert path.exists()
+
+        free["bytes"] = 5
+        cache.evict()
+        assert not path.exists()
+
+    def test_scan_indexes_existing_files_oldest_first(self, downloads):
+        newest = write_episode(downloads, "S01E01", 10, mtime=3000)
+        oldest = write_episode(downloads, "S01E02", 10, mtime=1000)
+        write_episode(downloads, "S01E03", 10, mtime=2000)
+        # a batch download still being split up is left alone
+        (downloads / "death_note" / ".batch-S01-1_3").mkdir()
+        (downloads / "death_note" / ".batch-S01-1_3" / "E04.ts").write_bytes(b"x")
+
+        cache = ArtifactCache(downloads, max_bytes=25, disk_usage=plenty_of_space)
+        assert cache.scan() == 3
+
+        assert len(cache) == 2
+        assert not oldest.exists()
+        assert newest in cache
+
+    def test_get_missing_file(self, downloads):
+        cache = ArtifactCache(downloads, disk_usage=plenty_of_space)
+        path = write_episode(downloads, "S01E01", 10)
+        cache.add(path)
+        path.unlink()
+
+        assert cache.get(path) is None
+        assert path not in cache
+        assert cache.bytes == 0
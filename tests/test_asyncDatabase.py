@@ -0,0 +1,244 @@
+"""
+Tests for the async database API, run against the in-memory collection
+"""
+import pytest
+import sys
+import asyncio
+from pathlib import Path
+from unittest.mock import patch
+
+# Add project root to path
+PROJECT_ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+
+import bot.database as database
+from bot.database import (
+    getDataAsync, getDataAndCountAsync, getEpisodesAsync, saveEpisodeAsync, postDataAsync, updateDataAsync, flushQueryIncrementsAsync, QueryCounter,
+    getPopularEpisodesAsync, saveJobAsync, addJobChatAsync, updateJobStateAsync,
+    getUnfinishedJobsAsync, getJobAsync
+)
+from tests.fakes import InMemoryCollection, FakeUpdateOne
+
+
+@pytest.fixture
+def fake_col():
+    collection = InMemoryCollection()
+    collection.create_index(
+        [("series_key", 1), ("season_id", 1), ("episode_id", 1)], unique=True
+    )
+    with patch.object(database, 'col', collection), \
+         patch.object(database, 'UpdateOne', FakeUpdateOne), \
+         patch.object(database, 'query_counter', QueryCounter()):
+        yield collection
+
+
+class TestAsyncDatabase:
+    """Tests for getDataAsync/postDataAsync/updateDataAsync"""
+
+    @pytest.mark.asyncio
+    async def test_post_then_get(self, fake_col, sample_anime_data):
+        await postDataAsync(dict(sample_anime_data))
+
+        result = await getDataAsync({"series_key": "death_note", "season_id": 1, "episode_id": 3})
+
+        assert result["file_id"] == sample_anime_data["file_id"]
+
+    @pytest.mark.asyncio
+    async def test_get_missing(self, fake_col):
+        assert await getDataAsync({"series_key": "nothing", "season_id": 1, "episode_id": 1}) is None
+
+    @pytest.mark.asyncio
+    async def test_get_and_count(self, fake_col, sample_anime_data):
+        """Test that the combined lookup returns the document already counted"""
+        await postDataAsync(dict(sample_anime_data, times_queried=0))
+        query = {"series_key": "death_note", "season_id": 1, "episode_id": 3}
+
+        result = await getDataAndCountAsync(query)
+
+        assert result["file_id"] == sample_anime_data["file_id"]
+        assert result["times_queried"] == 1
+        assert "last_queried" in result
+        assert fake_col.operations.count('find_one_and_update') == 1
+        assert await getDataAndCountAsync(dict(query, episode_id=99)) is None
+
+    @pytest.mark.asyncio
+    async def test_get_episodes(self, fake_col, sample_anime_data):
+        """Test that several episodes of a season come back from one query"""
+        for episode_id in (1, 2, 3):
+            await postDataAsync(dict(sample_anime_data, episode_id=episode_id))
+        await postDataAsync(dict(sample_anime_data, season_id=2, episode_id=2))
+
+        result = await getEpisodesAsync("death_note", 1, [2, 3, 4])
+
+        assert sorted(doc["episode_id"] for doc in result) == [2, 3]
+        assert fake_col.operations.count('find') == 1
+
+    @pytest.mark.asyncio
+    async def test_save_episode_upserts(self, fake_col, sample_anime_data):
+        """Test that saving an episode again replaces its file_id in place"""
+        await saveEpisodeAsync(dict(sample_anime_data, file_id="OLD"))
+        fake_col.documents[0]["times_queried"] = 5
+
+        await saveEpisodeAsync(dict(sample_anime_data, file_id="NEW"))
+
+        [document] = fake_col.documents
+        assert (document["file_id"], document["times_queried"]) == ("NEW", 5)
+
+    @pytest.mark.asyncio
+    async def test_duplicate_post_is_rejected(self, fake_col, sample_anime_data):
+        assert await postDataAsync(dict(sample_anime_data)) is not None
+        assert await postDataAsync(dict(sample_anime_data)) is None
+        assert len(fake_col.documents) == 1
+
+    @pytest.mark.asyncio
+    async def test_update_increments(self, fake_col, sample_anime_data):
+        await postDataAsync(dict(sample_anime_data))
+
+        await updateDataAsync(sample_anime_data)
+
+        assert fake_col.documents[0]["times_queried"] == sample_anime_data["times_queried"] + 1
+
+    @pytest.mark.asyncio
+    async def test_flush_query_increments(self, fake_col, sample_anime_data):
+        await postDataAsync(dict(sample_anime_data))
+        for _ in range(3):
+            database.queueQueryIncrement(sample_anime_data)
+
+        await flushQueryIncrementsAsync()
+
+        assert fake_col.documents[0]["times_queried"] == sample_anime_data["times_queried"] + 3
+        assert fake_col.operations.count('bulk_write') == 1
+
+    @pytest.mark.asyncio
+    async def test_popular_episodes(self, fake_col, sample_anime_data):
+        """Test that only recently queried episodes come back, most recent first"""
+        from datetime import datetime, timedelta
+        now = datetime.now()
+        for episode_id, hours_ago in ((3, 0.5), (4, 0.1), (5, 2)):
+            await postDataAsync(dict(sample_anime_data, episode_id=episode_id,
+                                     last_queried=now - timedelta(hours=hours_ago)))
+
+        popular = await getPopularEpisodesAsync(now - timedelta(hours=1))
+
+        assert [doc["episode_id"] for doc in popular] == [4, 3]
+        assert "file_id" not in popular[0]
+
+    @pytest.mark.asyncio
+    async def test_queries_are_counted_per_day(self, fake_col, sample_anime_data):
+        """Test that every way of counting a query also counts it for the day"""
+        from datetime import date
+        await postDataAsync(dict(sample_anime_data, times_queried=0))
+        query = {"series_key": "death_note", "season_id": 1, "episode_id": 3}
+
+        await getDataAndCountAsync(query)
+        database.queueQueryIncrement(query)
+        database.queueQueryIncrement(query)
+        await flushQueryIncrementsAsync()
+
+        document = fake_col.documents[0]
+        assert document["times_queried"] == 3
+        assert document["daily_queries"] == {date.today().isoformat(): 3}
+
+    @pytest.mark.asyncio
+    async def test_calls_do_not_block_loop(self, fake_col):
+        """Test that a slow Mongo call leaves the event loop free"""
+        import time
+        ticks = []
+
+        def slow_find_one(*args, **kwargs):
+            time.sleep(0.3)
+            return None
+
+        async def ticker():
+            for _ in range(5):
+                ticks.append(time.monotonic())
+                await asyncio.sleep(0.01)
+
+        started = time.monotonic()
+        with patch.object(fake_col, 'find_one', side_effect=slow_find_one):
+            await asyncio.gather(getDataAsync({"series_key": "x"}), ticker())
+
+        assert ticks[-1] - started < 0.25
+
+    @pytest.mark.asyncio
+    async def test_latency_observer(self, fake_col):
+        """Test that every awaitable call reports its operation and duration"""
+        observed = []
+        database.setLatencyObserver(lambda operation, seconds: observed.append((operation, seconds)))
+        try:
+            await getDataAsync({"series_key": "x"})
+        finally:
+            database.setLatencyObserver(None)
+
+        [(operation, seconds)] = observed
+        assert operation == "getData"
+        assert seconds >= 0
+
+
+JOB = {
+    "object_id": "death_note-s1-e3",
+    "series_key": "death_note",
+    "series_name": "Death Note",
+    "season_id": 1,
+    "episode_id": 3
+}
+
+
+@pytest.fixture
+def fake_jobs():
+    collection = InMemoryCollection()
+    collection.create_index([("object_id", 1)], unique=True)
+    with patch.object(database, 'jobs_col', collection):
+        yield collection
+
+
+class TestJobs:
+    """Tests for the persisted job queue"""
+
+    @pytest.mark.asyncio
+    async def test_job_lifecycle(self, fake_jobs):
+        await saveJobAsync(JOB, [42])
+        await addJobChatAsync(JOB["object_id"], 7)
+        await addJobChatAsync(JOB["object_id"], 7)
+        await updateJobStateAsync(JOB["object_id"], database.JOB_DOWNLOADING)
+
+        [job] = await getUnfinishedJobsAsync()
+        assert job["state"] == "downloading"
+        assert job["chat_ids"] == [42, 7]
+
+        await updateJobStateAsync(JOB["object_id"], database.JOB_DELIVERED)
+        assert await getUnfinishedJobsAsync() == []
+
+    @pytest.mark.asyncio
+    async def test_finished_jobs_keep_their_state(self, fake_jobs):
+        await saveJobAsync(JOB, [42])
+        await updateJobStateAsync(JOB["object_id"], database.JOB_DELIVERED)
+
+        await updateJobStateAsync(JOB["object_id"], database.JOB_FAILED, "late error")
+
+        assert fake_jobs.documents[0]["state"] == "delivered"
+
+    @pytest.mark.asyncio
+    async def test_refetch_resets_job(self, fake_jobs):
+        """Test that fetching a failed episode again starts a fresh job"""
+        await saveJobAsync(JOB, [42])
+        await updateJobStateAsync(JOB["object_id"], database.JOB_FAILED, "boom")
+
+        await saveJobAsync(JOB, [99])
+
+        assert len(fake_jobs.documents) == 1
+        job = fake_jobs.documents[0]
+        assert (job["state"], job["chat_ids"], job["error"]) == ("queued", [99], None)
+
+    @pytest.mark.asyncio
+    async def test_get_job(self, fake_jobs):
+        """Test that a job is found by object_id with its waiting chats"""
+        await saveJobAsync(JOB, [42])
+        await addJobChatAsync(JOB["object_id"], 7)
+
+        job = await getJobAsync(JOB["object_id"])
+
+        assert job["series_name"] == JOB["series_name"]
+        assert job["chat_ids"] == [42, 7]
+        assert "_id" not in job
+        assert await getJobAsync("unknown-s1-e1") is None
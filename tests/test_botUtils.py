@@ -2,6 +2,7 @@
 Tests for botUtils module
 """
 import pytest
+import json
 import sys
 from pathlib import Path
 from unittest.mock import patch, mock_open
@@ -11,7 +12,10 @@ import os
 PROJECT_ROOT = Path(__file__).parent.parent
 sys.path.insert(0, str(PROJECT_ROOT))
 
-from bot.botUtils import showhelp, parse_search_query, getalltsfiles, normalize_series_name, get_download_path
+from bot.botUtils import (
+    showhelp, parse_search_query, getalltsfiles, normalize_series_name, get_download_path,
+    format_episode_range, format_eta, read_download_result, MAX_EPISODE_RANGE
+)
 
 
 class TestShowHelp:
@@ -88,61 +92,77 @@ class TestParseSearchQuery:
         assert result["episode_id"] == -1
 
 
+    def test_parse_single_episode_has_same_end(self):
+        """Test that a single episode sets episode_end to the episode"""
+        result = parse_search_query("Death Note, 1, 3")
+        assert result["episode_end"] == 3
+
+    def test_parse_episode_range(self):
+        """Test parsing an episode range"""
+        result = parse_search_query("Death Note, 1, 1-12")
+
+        assert result["season_id"] == 1
+        assert result["episode_id"] == 1
+        assert result["episode_end"] == 12
+
+    def test_parse_episode_range_with_text_and_spaces(self):
+        """Test parsing a reversed range written with words and spaces"""
+        result = parse_search_query("Death Note, season 1, episodes 12 - 3")
+
+        assert result["episode_id"] == 3
+        assert result["episode_end"] == 12
+
+    def test_parse_episode_range_is_capped(self):
+        """Test that overly long ranges are capped"""
+        result = parse_search_query("One Piece, 1, 1-1000")
+
+        assert result["episode_end"] == MAX_EPISODE_RANGE
+        assert result["requested_end"] == 1000
+
+
+class TestFormatEpisodeRange:
+    """Tests for format_episode_range function"""
+
+    def test_contiguous(self):
+        assert format_episode_range([1, 2, 3]) == "1-3"
+
+    def test_gaps(self):
+        assert format_episode_range([8, 1, 2, 3, 5, 7]) == "1-3,5,7-8"
+
+    def test_single(self):
+        assert format_episode_range([4]) == "4"
+
+
+
+class TestFormatEta:
+    """Tests for format_eta function"""
+
+    def test_minutes(self):
+        assert format_eta(150) == "~3 min"
+
+    def test_rounds_up_to_a_minute(self):
+        assert format_eta(0) == "~1 min"
+
+    def test_hours(self):
+        assert format_eta(4000) == "~1h 07m"
+
 class TestGetAllTsFiles:
     """Tests for getalltsfiles function"""
     
-    def test_getalltsfiles_no_files(self, tmp_path):
-        """Test when no mp4 files exist"""
-        with patch('bot.botUtils.PROJECT_ROOT', tmp_path):
-            result = getalltsfiles()
-            assert result is None
-    
-    def test_getalltsfiles_finds_mp4(self, tmp_path):
-        """Test finding an mp4 file"""
-        # Create a test mp4 file
-        test_file = tmp_path / "test_video.mp4"
-        test_file.write_bytes(b"fake video data")
-        
-        with patch('bot.botUtils.PROJECT_ROOT', tmp_path):
-            result = getalltsfiles()
-            assert result is not None
-            assert "test_video.mp4" in result
-    
-    def test_getalltsfiles_finds_nested_mp4(self, tmp_path):
-        """Test finding mp4 file in subdirectory"""
-        subdir = tmp_path / "subdir"
-        subdir.mkdir()
-        test_file = subdir / "nested_video.mp4"
-        test_file.write_bytes(b"fake video data")
-        
-        with patch('bot.botUtils.PROJECT_ROOT', tmp_path):
-            result = getalltsfiles()
-            assert result is not None
-            assert "nested_video.mp4" in result
-    
-    def test_getalltsfiles_ignores_other_extensions(self, tmp_path):
-        """Test that other file extensions are ignored"""
-        # Create files with different extensions
-        (tmp_path / "test.ts").write_bytes(b"data")
-        (tmp_path / "test.avi").write_bytes(b"data")
-        (tmp_path / "test.mp4").write_bytes(b"data")
-        
-        with patch('bot.botUtils.PROJECT_ROOT', tmp_path):
-            result = getalltsfiles()
-            assert result is not None
-            assert result.endswith(".mp4")
-            assert "test.ts" not in result
-            assert "test.avi" not in result
-    
-    def test_getalltsfiles_case_insensitive(self, tmp_path):
-        """Test that file extension matching is case insensitive"""
-        test_file = tmp_path / "test.MP4"
-        test_file.write_bytes(b"fake video data")
-        
+    def test_getalltsfiles_does_not_scan(self, tmp_path):
+        """Test that mp4 files outside the episode's download path are not picked up"""
+        (tmp_path / "test_video.mp4").write_bytes(b"fake video data")
+        other_episode = tmp_path / "downloads" / "death_note" / "S01E04"
+        other_episode.mkdir(parents=True)
+        (other_episode / "episode.mp4").write_bytes(b"fake video data")
+
         with patch('bot.botUtils.PROJECT_ROOT', tmp_path):
-            result = getalltsfiles()
-            assert result is not None
-            assert "test.MP4" in result or "test.mp4" in result
+            assert getalltsfiles("death_note", 1, 3) is None
+
+    def test_getalltsfiles_needs_an_episode(self):
+        """Test that there is no lookup without an episode to look for"""
+        with pytest.raises(TypeError):
+            getalltsfiles()
     
     def test_getalltsfiles_deterministic_path(self, tmp_path):
         """Test getalltsfiles with deterministic path parameters"""
@@ -165,6 +185,31 @@ class TestGetAllTsFiles:
             assert result is None
 
 
+class TestReadDownloadResult:
+    """Tests for read_download_result function"""
+
+    def write_result(self, download_dir, size):
+        (download_dir / "episode.mp4").write_bytes(b"fake video data")
+        (download_dir / "result.json").write_text(json.dumps({
+            "path": "episode.mp4", "size": size, "duration": 1420.05,
+            "container": "mov,mp4,m4a,3gp,3g2,mj2", "video": "h264", "audio": "aac"
+        }))
+
+    def test_reads_result(self, tmp_path):
+        self.write_result(tmp_path, 15)
+        result = read_download_result(tmp_path)
+        assert result["path"] == str(tmp_path / "episode.mp4")
+        assert result["duration"] == 1420.05
+
+    def test_no_result(self, tmp_path):
+        assert read_download_result(tmp_path) is None
+
+    def test_size_mismatch(self, tmp_path):
+        """Test that a result not matching the file on disk is ignored"""
+        self.write_result(tmp_path, 999)
+        assert read_download_result(tmp_path) is None
+
+
 class TestNormalizeSeriesName:
     """Tests for normalize_series_name function"""
     
@@ -223,3 +268,17 @@ class TestGetDownloadPath:
             download_dir, mp4_file = get_download_path("test_anime", -1, 3)
             
             assert "S00E03" in str(download_dir)
+
+
+class TestDownloaderFileNames:
+    """The bot's copy of the downloader's file names"""
+
+    def test_names_match_downloader(self):
+        """Test that the bot looks for the files the downloader writes"""
+        sys.path.insert(0, str(PROJECT_ROOT / 'downloaderService'))
+        import bot.botUtils as botUtils
+        import downloaderService.main as downloader
+
+        assert botUtils.EPISODE_FILENAME == downloader.EPISODE_FILENAME
+        assert botUtils.RESULT_NAME == downloader.RESULT_NAME
+        assert botUtils.DOWNLOAD_DONE_NAME == downloader.DOWNLOAD_DONE_NAME
@@ -3,7 +3,10 @@ Tests for bot commands
 """
 import pytest
 import sys
+import asyncio
+from datetime import datetime
 from pathlib import Path
+from types import SimpleNamespace
 from unittest.mock import MagicMock, patch, AsyncMock, mock_open
 import json
 
@@ -29,6 +32,7 @@ if 'telegram' not in sys.modules:
     telegram_mock.Update = MagicMock
     telegram_mock.ext = MagicMock()
     telegram_mock.ext.Application = MagicMock
+    telegram_mock.ext.BaseRateLimiter = type('BaseRateLimiter', (), {})
     telegram_mock.ext.CommandHandler = MagicMock
     telegram_mock.ext.MessageHandler = MagicMock
     telegram_mock.ext.ContextTypes = MagicMock()
@@ -92,8 +96,8 @@ class TestGetAnimeCommand:
         """Test /getanime with valid query and cached data"""
         mock_update.message.text = "/getanime Death Note, 1, 3"
         
-        with patch('bot.bot.getData', return_value=sample_anime_data), \
-             patch('bot.bot.updateData') as mock_update_data, \
+        with patch('bot.bot.getDataAndCountAsync', new_callable=AsyncMock, return_value=sample_anime_data) as mock_get_data, \
+             patch('bot.bot.queueQueryIncrement', return_value=False) as mock_update_data, \
              patch('bot.bot.normalize_series_name', return_value="death_note"):
             
             from bot.bot import getanime
@@ -102,16 +106,90 @@ class TestGetAnimeCommand:
             
             # Should send video from cache
             mock_context.bot.send_video.assert_called_once()
-            mock_update_data.assert_called_once()
+            # counted by the lookup itself, not write-behind
+            mock_get_data.assert_called_once_with(
+                {"series_key": "death_note", "season_id": 1, "episode_id": 3}
+            )
+            mock_update_data.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_getanime_hit_sends_only_the_video(self, mock_update, mock_context,
+                                                     temp_config_dir, sample_anime_data):
+        """Test that a hit is answered without a status message"""
+        mock_update.message.text = "/getanime Death Note, 1, 3"
+
+        with patch('bot.bot.getDataAndCountAsync', new_callable=AsyncMock, return_value=sample_anime_data):
+            from bot.bot import getanime
+
+            await getanime(mock_update, mock_context)
+
+            mock_context.bot.send_video.assert_called_once()
+            mock_update.message.reply_text.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_getanime_flushes_counts_at_threshold(self, mock_update, mock_context,
+                                                        temp_config_dir, sample_anime_data):
+        """Test that reaching the flush threshold writes the counts in the background"""
+        mock_update.message.text = "/getanime Death Note, 1, 3"
+
+        with patch('bot.bot.queueQueryIncrement', return_value=True), \
+             patch('bot.bot.flushQueryIncrementsAsync', new_callable=AsyncMock) as mock_flush:
+
+            import bot.bot as bot_module
+            # answered from memory, so counted write-behind
+            bot_module.episode_cache.put(("death_note", 1, 3), sample_anime_data["file_id"])
+
+            await bot_module.getanime(mock_update, mock_context)
+            # let the executor run the flush
+            await asyncio.sleep(0.05)
+
+            mock_flush.assert_called_once()
     
+    @pytest.mark.asyncio
+    async def test_getanime_second_hit_served_from_memory(self, mock_update, mock_context,
+                                                          temp_config_dir, sample_anime_data):
+        """Test that a repeated request does not query Mongo again"""
+        mock_update.message.text = "/getanime Death Note, 1, 3"
+
+        with patch('bot.bot.getDataAndCountAsync', new_callable=AsyncMock, return_value=sample_anime_data) as mock_get_data, \
+             patch('bot.bot.queueQueryIncrement', return_value=False) as mock_update_data:
+
+            from bot.bot import getanime
+
+            await getanime(mock_update, mock_context)
+            await getanime(mock_update, mock_context)
+
+            mock_get_data.assert_called_once()
+            assert mock_context.bot.send_video.call_count == 2
+            # only the memory hit is counted write-behind
+            assert mock_update_data.call_count == 1
+
+    @pytest.mark.asyncio
+    async def test_getanime_failed_send_invalidates_cache(self, mock_update, mock_context,
+                                                          temp_config_dir, sample_anime_data):
+        """Test that a file_id that fails to send is dropped from the cache"""
+        mock_update.message.text = "/getanime Death Note, 1, 3"
+        mock_context.bot.send_video.side_effect = Exception("wrong file identifier")
+
+        with patch('bot.bot.getDataAndCountAsync', new_callable=AsyncMock, return_value=sample_anime_data), \
+             patch('bot.bot.queueQueryIncrement', return_value=False), \
+             patch('bot.bot.getalltsfiles', return_value=None), \
+             patch('bot.bot.run_command', new_callable=AsyncMock):
+
+            import bot.bot as bot_module
+
+            await bot_module.getanime(mock_update, mock_context)
+
+            assert bot_module.episode_cache.get(("death_note", 1, 3)) is None
+
     @pytest.mark.asyncio
     async def test_getanime_not_in_cache(self, mock_update, mock_context, temp_config_dir):
         """Test /getanime when anime is not in cache"""
         mock_update.message.text = "/getanime New Anime, 1, 1"
         
-        with patch('bot.bot.getData', return_value=None), \
+        with patch('bot.bot.getDataAndCountAsync', new_callable=AsyncMock, return_value=None), \
              patch('bot.bot.getalltsfiles', return_value=None), \
-             patch('subprocess.check_call') as mock_subprocess:
+             patch('bot.bot.run_command', new_callable=AsyncMock) as mock_subprocess:
             
             from bot.bot import getanime
             
@@ -120,6 +198,209 @@ class TestGetAnimeCommand:
             # Should attempt to download
             assert mock_subprocess.called
     
+    @pytest.mark.asyncio
+    async def test_getanime_reports_queue_position(self, mock_update, mock_context, temp_config_dir):
+        """Test that a miss is told its place in the queue straight away"""
+        mock_update.message.text = "/getanime New Anime, 1, 1"
+
+        with patch('bot.bot.getDataAndCountAsync', new_callable=AsyncMock, return_value=None), \
+             patch('bot.bot.getalltsfiles', return_value=None), \
+             patch('bot.bot.run_command', new_callable=AsyncMock):
+
+            import bot.bot as bot_module
+
+            await bot_module.getanime(mock_update, mock_context)
+
+            messages = [call.args[0] for call in mock_update.message.reply_text.call_args_list]
+            assert any(msg.startswith("You are #1 in queue, ETA") for msg in messages)
+            assert bot_module.pipeline.pending() == 0
+
+    @pytest.mark.asyncio
+    async def test_getanime_over_quota(self, mock_update, mock_context, temp_config_dir):
+        """Test that a chat over its quota is turned away without downloading"""
+        mock_update.message.text = "/getanime New Anime, 1, 1"
+        # bot.py imports its modules flat, so use its own exception class
+        from bot.bot import QuotaExceeded
+
+        with patch('bot.bot.getDataAndCountAsync', new_callable=AsyncMock, return_value=None), \
+             patch('bot.bot.pipeline.admit', side_effect=QuotaExceeded("quota")), \
+             patch('bot.bot.run_command', new_callable=AsyncMock) as mock_run:
+
+            import bot.bot as bot_module
+
+            await bot_module.getanime(mock_update, mock_context)
+
+            mock_run.assert_not_called()
+            assert "new_anime-s1-e1" not in bot_module.inflight
+            last_reply = mock_update.message.reply_text.call_args[0][0]
+            assert "already have episodes being fetched" in last_reply
+
+    @pytest.mark.asyncio
+    async def test_getanime_joins_inflight_fetch(self, mock_update, mock_context, temp_config_dir):
+        """Test that a second request for an episode being fetched does not download again"""
+        mock_update.message.text = "/getanime New Anime, 1, 1"
+
+        with patch('bot.bot.getDataAndCountAsync', new_callable=AsyncMock, return_value=None), \
+             patch('bot.bot.run_command', new_callable=AsyncMock) as mock_subprocess:
+
+            import bot.bot as bot_module
+            bot_module.inflight.join("new_anime-s1-e1", 111)
+
+            await bot_module.getanime(mock_update, mock_context)
+
+            mock_subprocess.assert_not_called()
+            assert bot_module.inflight.chat_ids("new_anime-s1-e1") == [111, 987654321]
+            call_args = mock_update.message.reply_text.call_args[0][0]
+            assert "already being fetched" in call_args
+
+    @pytest.mark.asyncio
+    async def test_saved_job_keeps_chats_that_joined_early(self, mock_update, mock_context,
+                                                           temp_config_dir):
+        """Test that a chat joining before the job is saved is part of the saved job"""
+        mock_update.message.text = "/getanime New Anime, 1, 1"
+
+        import bot.bot as bot_module
+        admit = bot_module.pipeline.admit
+
+        def admit_while_another_chat_joins(*jobs):
+            bot_module.inflight.join("new_anime-s1-e1", 555)
+            return admit(*jobs)
+
+        with patch('bot.bot.getDataAndCountAsync', new_callable=AsyncMock, return_value=None), \
+             patch('bot.bot.pipeline.admit', side_effect=admit_while_another_chat_joins), \
+             patch('bot.bot.saveJobAsync', new_callable=AsyncMock) as mock_save, \
+             patch('bot.bot.getalltsfiles', return_value=None), \
+             patch('bot.bot.run_command', new_callable=AsyncMock):
+
+            await bot_module.getanime(mock_update, mock_context)
+
+            assert mock_save.call_args[0][1] == [987654321, 555]
+
+    @pytest.mark.asyncio
+    async def test_getanime_range_batches_missing_episodes(self, mock_update, mock_context,
+                                                          temp_config_dir, sample_anime_data):
+        """Test that a range sends cached episodes and downloads the rest in one run"""
+        mock_update.message.text = "/getanime Death Note, 1, 2-5"
+
+        cached = [dict(sample_anime_data, episode_id=episode_id) for episode_id in (2, 4)]
+
+        with patch('bot.bot.getEpisodesAsync', new_callable=AsyncMock, return_value=cached) as mock_get, \
+             patch('bot.bot.getDataAndCountAsync', new_callable=AsyncMock) as mock_get_one, \
+             patch('bot.bot.queueQueryIncrement', return_value=False) as mock_count, \
+             patch('bot.bot.getalltsfiles', return_value=None), \
+             patch('bot.bot.run_command', new_callable=AsyncMock) as mock_subprocess:
+
+            from bot.bot import getanime
+
+            await getanime(mock_update, mock_context)
+
+            # the whole range is looked up with one query
+            mock_get.assert_awaited_once_with("death_note", 1, [2, 3, 4, 5])
+            mock_get_one.assert_not_called()
+            assert mock_count.call_count == 2
+            # the two cached episodes are sent right away
+            assert mock_context.bot.send_video.call_count == 2
+            # one batched download for the missing episodes
+            batch_cmd = mock_subprocess.call_args_list[0][0][0]
+            assert batch_cmd[-1] == '--batch'
+            assert batch_cmd[-3] == '3,5'
+
+    @pytest.mark.asyncio
+    async def test_getanime_range_records_downloading(self, mock_update, mock_context,
+                                                      temp_config_dir):
+        """Test that the batch download goes through the download stage"""
+        mock_update.message.text = "/getanime Death Note, 1, 2-3"
+
+        with patch('bot.bot.getEpisodesAsync', new_callable=AsyncMock, return_value=[]), \
+             patch('bot.bot.updateJobStateAsync', new_callable=AsyncMock) as mock_state, \
+             patch('bot.bot.getalltsfiles', return_value=None), \
+             patch('bot.bot.run_command', new_callable=AsyncMock):
+
+            import bot.bot as bot_module
+
+            await bot_module.getanime(mock_update, mock_context)
+
+            recorded = [call.args for call in mock_state.call_args_list]
+            assert ("death_note-s1-e2", "downloading") in recorded
+            assert ("death_note-s1-e3", "downloading") in recorded
+
+    @pytest.mark.asyncio
+    async def test_getanime_range_all_cached(self, mock_update, mock_context,
+                                             temp_config_dir, sample_anime_data):
+        """Test that a fully cached range does not download"""
+        mock_update.message.text = "/getanime Death Note, 1, 1-3"
+        cached = [dict(sample_anime_data, episode_id=episode_id) for episode_id in (1, 2, 3)]
+
+        with patch('bot.bot.getEpisodesAsync', new_callable=AsyncMock, return_value=cached), \
+             patch('bot.bot.queueQueryIncrement', return_value=False), \
+             patch('bot.bot.run_command', new_callable=AsyncMock) as mock_subprocess:
+
+            from bot.bot import getanime
+
+            await getanime(mock_update, mock_context)
+
+            assert mock_context.bot.send_video.call_count == 3
+            mock_subprocess.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_getanime_range_says_it_was_cut(self, mock_update, mock_context,
+                                                  temp_config_dir, sample_anime_data):
+        """Test that the user is told an overly long range was cut short"""
+        mock_update.message.text = "/getanime One Piece, 1, 1-1000"
+        cached = [dict(sample_anime_data, episode_id=episode_id) for episode_id in range(1, 27)]
+
+        with patch('bot.bot.getEpisodesAsync', new_callable=AsyncMock, return_value=cached), \
+             patch('bot.bot.queueQueryIncrement', return_value=False):
+
+            from bot.bot import getanime
+
+            await getanime(mock_update, mock_context)
+
+            replies = [call.args[0] for call in mock_update.message.reply_text.call_args_list]
+            assert any("getting episodes 1-26" in reply for reply in replies)
+
+    @pytest.mark.asyncio
+    async def test_getanime_range_reuses_files_on_disk(self, mock_update, mock_context,
+                                                       temp_config_dir):
+        """Test that episodes kept in the artifact cache are not downloaded again"""
+        mock_update.message.text = "/getanime Death Note, 1, 2-3"
+        import bot.bot as bot_module
+        kept = bot_module.get_download_path("death_note", 1, 2)[1]
+
+        with patch('bot.bot.getEpisodesAsync', new_callable=AsyncMock, return_value=[]), \
+             patch('bot.bot.artifact_cache.get', side_effect=lambda path: path == kept), \
+             patch('bot.bot.submit_pinned', new_callable=AsyncMock) as mock_submit, \
+             patch('bot.bot.run_command', new_callable=AsyncMock) as mock_subprocess:
+
+            await bot_module.getanime(mock_update, mock_context)
+
+            batch_cmd = mock_subprocess.call_args_list[0][0][0]
+            assert batch_cmd[-3] == '3'
+            stages = {call.args[0].episode_id: call.args[1] for call in mock_submit.call_args_list}
+            assert stages == {2: 'remux', 3: 'remux'}
+            for call in mock_submit.call_args_list:
+                bot_module.pipeline.release(call.args[0])
+
+    @pytest.mark.asyncio
+    async def test_getanime_range_streams_each_episode(self, mock_update, mock_context,
+                                                       temp_config_dir):
+        """Test that stream mode fetches every episode through its own download stage"""
+        mock_update.message.text = "/getanime Death Note, 1, 2-3"
+        import bot.bot as bot_module
+
+        with patch.dict(bot_module.configdata, {'download_mode': 'stream'}), \
+             patch('bot.bot.getEpisodesAsync', new_callable=AsyncMock, return_value=[]), \
+             patch('bot.bot.submit_pinned', new_callable=AsyncMock) as mock_submit, \
+             patch('bot.bot.run_command', new_callable=AsyncMock) as mock_subprocess:
+
+            await bot_module.getanime(mock_update, mock_context)
+
+            mock_subprocess.assert_not_called()
+            stages = {call.args[0].episode_id: call.args[1] for call in mock_submit.call_args_list}
+            assert stages == {2: 'download', 3: 'download'}
+            for call in mock_submit.call_args_list:
+                bot_module.pipeline.release(call.args[0])
+
     @pytest.mark.asyncio
     async def test_getanime_empty_query(self, mock_update, mock_context, temp_config_dir):
         """Test /getanime with empty query"""
@@ -146,11 +427,11 @@ class TestGetAnimeCommand:
             "file_id": None
         }
         
-        with patch('bot.bot.getData', return_value=data_without_file_id), \
-             patch('bot.bot.updateData'), \
+        with patch('bot.bot.getDataAndCountAsync', new_callable=AsyncMock, return_value=data_without_file_id), \
+             patch('bot.bot.queueQueryIncrement', return_value=False), \
              patch('bot.bot.normalize_series_name', return_value="death_note"), \
              patch('bot.bot.getalltsfiles', return_value=None), \
-             patch('subprocess.check_call'):
+             patch('bot.bot.run_command', new_callable=AsyncMock):
             
             from bot.bot import getanime
             
@@ -170,7 +451,71 @@ class TestGetAnimeCommand:
 
 class TestCheckDocument:
     """Tests for check_document function (handles video uploads)"""
-    
+
+    @pytest.fixture(autouse=True)
+    def no_stored_job(self, temp_config_dir):
+        """The jobs collection knows no job unless a test says otherwise"""
+        with patch('bot.bot.getJobAsync', new_callable=AsyncMock, return_value=None) as mock_get_job, \
+             patch('bot.bot.updateJobStateAsync', new_callable=AsyncMock):
+            yield mock_get_job
+
+    @pytest.mark.asyncio
+    async def test_check_document_job_caption_uses_inflight_job(self, mock_update, mock_context):
+        """Test that a job caption is resolved from the in-flight job without a name lookup"""
+        mock_video = MagicMock()
+        mock_video.file_id = "BAACAgIAAxkBAAIB"
+        mock_update.message.video = mock_video
+        mock_update.message.caption = "job:death_note-s1-e3"
+        mock_update.message.from_user.id = 123456789
+
+        with patch('bot.bot.saveEpisodeAsync', new_callable=AsyncMock) as mock_post, \
+             patch('bot.bot.getDataAsync', new_callable=AsyncMock) as mock_get:
+            import bot.bot as bot_module
+            from bot.pipeline import EpisodeJob
+
+            bot_module.inflight.join("death_note-s1-e3", 987654321)
+            bot_module.inflight.join("death_note-s1-e3", 555)
+            bot_module.inflight.attach_job(
+                "death_note-s1-e3",
+                EpisodeJob("Death Note", "death_note", 1, 3, 987654321, None)
+            )
+
+            await bot_module.check_document(mock_update, mock_context)
+
+            mock_get.assert_not_called()
+            posted_data = mock_post.call_args[0][0]
+            assert posted_data["series_name"] == "Death Note"
+            assert (posted_data["season_id"], posted_data["episode_id"]) == (1, 3)
+            sent_to = [call.kwargs["chat_id"] for call in mock_context.bot.send_video.call_args_list]
+            assert sent_to == [987654321, 555]
+
+    @pytest.mark.asyncio
+    async def test_check_document_job_caption_uses_stored_job(self, mock_update, mock_context,
+                                                             no_stored_job):
+        """Test that a job caption falls back to the jobs collection (e.g. after a restart)"""
+        mock_video = MagicMock()
+        mock_video.file_id = "BAACAgIAAxkBAAIB"
+        mock_update.message.video = mock_video
+        mock_update.message.caption = "job:death_note-s1-e3"
+        mock_update.message.from_user.id = 123456789
+        no_stored_job.return_value = {
+            "object_id": "death_note-s1-e3", "series_key": "death_note",
+            "series_name": "Death Note", "season_id": 1, "episode_id": 3,
+            "chat_ids": [987654321, 0, 555]
+        }
+
+        with patch('bot.bot.saveEpisodeAsync', new_callable=AsyncMock) as mock_post, \
+             patch('bot.bot.getDataAsync', new_callable=AsyncMock) as mock_get:
+            from bot.bot import check_document
+
+            await check_document(mock_update, mock_context)
+
+            mock_get.assert_not_called()
+            assert mock_post.call_args[0][0]["series_name"] == "Death Note"
+            # the prefetch placeholder chat is never messaged
+            sent_to = [call.kwargs["chat_id"] for call in mock_context.bot.send_video.call_args_list]
+            assert sent_to == [987654321, 555]
+
     @pytest.mark.asyncio
     async def test_check_document_valid_video(self, mock_update, mock_context, temp_config_dir):
         """Test check_document with valid video from agent"""
@@ -181,8 +526,8 @@ class TestCheckDocument:
         mock_update.message.caption = "987654321:death_note-s1-e3"
         mock_update.message.from_user.id = 123456789  # agent_user_id
         
-        with patch('bot.bot.postData') as mock_post, \
-             patch('bot.bot.getData', return_value=None):
+        with patch('bot.bot.saveEpisodeAsync', new_callable=AsyncMock) as mock_post, \
+             patch('bot.bot.getDataAsync', new_callable=AsyncMock, return_value=None):
             
             from bot.bot import check_document
             
@@ -198,6 +543,51 @@ class TestCheckDocument:
             assert posted_data.get("season_id") == 1
             assert posted_data.get("episode_id") == 3
     
+    @pytest.mark.asyncio
+    async def test_check_document_sends_to_inflight_waiters(self, mock_update, mock_context,
+                                                           temp_config_dir):
+        """Test that every chat waiting on the episode receives the video"""
+        mock_video = MagicMock()
+        mock_video.file_id = "BAACAgIAAxkBAAIB"
+        mock_update.message.video = mock_video
+        mock_update.message.caption = "987654321:death_note-s1-e3"
+        mock_update.message.from_user.id = 123456789
+
+        with patch('bot.bot.saveEpisodeAsync', new_callable=AsyncMock), \
+             patch('bot.bot.getDataAsync', new_callable=AsyncMock, return_value=None):
+
+            import bot.bot as bot_module
+            bot_module.inflight.join("death_note-s1-e3", 987654321)
+            bot_module.inflight.join("death_note-s1-e3", 555)
+
+            await bot_module.check_document(mock_update, mock_context)
+
+            sent_to = [call.kwargs["chat_id"] for call in mock_context.bot.send_video.call_args_list]
+            assert sent_to == [987654321, 555]
+            assert "death_note-s1-e3" not in bot_module.inflight
+            # the new file_id is cached for the next request
+            assert bot_module.episode_cache.get(("death_note", 1, 3)) == "BAACAgIAAxkBAAIB"
+
+    @pytest.mark.asyncio
+    async def test_check_document_from_any_agent(self, mock_update, mock_context, temp_config_dir):
+        """Test that videos from every registered agent account are accepted"""
+        mock_video = MagicMock()
+        mock_video.file_id = "BAACAgIAAxkBAAIB"
+        mock_update.message.video = mock_video
+        mock_update.message.caption = "987654321:death_note-s1-e3"
+        mock_update.message.from_user.id = 222
+
+        with patch('bot.bot.saveEpisodeAsync', new_callable=AsyncMock) as mock_post, \
+             patch('bot.bot.getDataAsync', new_callable=AsyncMock, return_value=None), \
+             patch.dict('bot.bot.configdata', {"agent_user_ids": [111, 222]}):
+
+            from bot.bot import check_document
+
+            await check_document(mock_update, mock_context)
+
+            mock_post.assert_called_once()
+            mock_context.bot.send_video.assert_called_once()
+
     @pytest.mark.asyncio
     async def test_check_document_wrong_user(self, mock_update, mock_context, temp_config_dir):
         """Test check_document with video from non-agent user"""
@@ -228,6 +618,32 @@ class TestCheckDocument:
             # Should not process
             mock_context.bot.send_video.assert_not_called()
     
+    @pytest.mark.asyncio
+    async def test_check_document_replaces_stale_file_id(self, mock_update, mock_context,
+                                                         sample_anime_data):
+        """Test that a re-upload replaces the file_id already stored for the episode"""
+        from tests.fakes import InMemoryCollection
+        collection = InMemoryCollection()
+        collection.create_index(
+            [("series_key", 1), ("season_id", 1), ("episode_id", 1)], unique=True
+        )
+        collection.insert_one(dict(sample_anime_data, file_id="STALE", times_queried=7))
+        mock_video = MagicMock()
+        mock_video.file_id = "FRESH"
+        mock_update.message.video = mock_video
+        mock_update.message.caption = "job:death_note-s1-e3"
+        mock_update.message.from_user.id = 123456789
+
+        with patch.object(database_module, 'col', collection):
+            import bot.bot as bot_module
+
+            await bot_module.check_document(mock_update, mock_context)
+
+            [document] = collection.documents
+            assert document["file_id"] == "FRESH"
+            assert document["times_queried"] == 7
+            assert bot_module.episode_cache.get(("death_note", 1, 3)) == "FRESH"
+
     @pytest.mark.asyncio
     async def test_check_document_object_id_with_season(self, mock_update, mock_context, temp_config_dir):
         """Test check_document parses new object_id format with season correctly"""
@@ -237,8 +653,8 @@ class TestCheckDocument:
         mock_update.message.caption = "987654321:test_anime-s2-e5"
         mock_update.message.from_user.id = 123456789
         
-        with patch('bot.bot.postData') as mock_post, \
-             patch('bot.bot.getData', return_value=None):
+        with patch('bot.bot.saveEpisodeAsync', new_callable=AsyncMock) as mock_post, \
+             patch('bot.bot.getDataAsync', new_callable=AsyncMock, return_value=None):
             
             from bot.bot import check_document
             
@@ -249,3 +665,283 @@ class TestCheckDocument:
             assert posted_data.get("series_key") == "test_anime"
             assert posted_data.get("season_id") == 2
             assert posted_data.get("episode_id") == 5
+
+
+class TestPrefetch:
+    """Tests for the scheduled prefetch_popular job"""
+
+    @pytest.mark.asyncio
+    async def test_prefetch_starts_predicted_episode(self, mock_context, sample_anime_data, tmp_path,
+                                                    temp_config_dir):
+        """Test that the episodes after a popular one are fetched"""
+        started = []
+        mock_context.application.create_task = lambda coro: started.append(coro) or coro.close()
+        popular = dict(sample_anime_data, daily_queries={datetime.now().date().isoformat(): 5})
+
+        with patch('bot.bot.getPopularEpisodesAsync', new_callable=AsyncMock,
+                   return_value=[popular]), \
+             patch('bot.bot.getDataAsync', new_callable=AsyncMock, return_value=None), \
+             patch('bot.bot.get_download_path', return_value=(tmp_path / "s1e4", tmp_path)):
+            import bot.bot as bot_module
+
+            await bot_module.prefetch_popular(mock_context)
+
+            # next episode and next season, within the default budget of 2
+            assert len(started) == 2
+            assert "death_note-s1-e4" in bot_module.inflight
+            assert "death_note-s2-e1" in bot_module.inflight
+            assert bot_module.inflight.chat_ids("death_note-s1-e4") == [bot_module.PREFETCH_CHAT_ID]
+
+    @pytest.mark.asyncio
+    async def test_prefetch_is_not_capped_by_chat_quota(self, mock_context, sample_anime_data,
+                                                        tmp_path, temp_config_dir):
+        """Test that the prefetch budget, not the chat quota, limits prefetches"""
+        started = []
+        mock_context.application.create_task = lambda coro: started.append(coro) or coro.close()
+        popular = dict(sample_anime_data, daily_queries={datetime.now().date().isoformat(): 5})
+
+        import bot.bot as bot_module
+        with patch('bot.bot.getPopularEpisodesAsync', new_callable=AsyncMock,
+                   return_value=[popular]), \
+             patch('bot.bot.getDataAsync', new_callable=AsyncMock, return_value=None), \
+             patch('bot.bot.get_download_path', return_value=(tmp_path / "s1e4", tmp_path)), \
+             patch.object(bot_module.pipeline, 'chat_quota', 1):
+
+            await bot_module.prefetch_popular(mock_context)
+
+            assert len(started) == 2
+            for object_id in ("death_note-s1-e4", "death_note-s2-e1"):
+                bot_module.pipeline.release(bot_module.inflight.job(object_id))
+
+    @pytest.mark.asyncio
+    async def test_prefetch_skips_cached_episode(self, mock_context, sample_anime_data, tmp_path,
+                                                 temp_config_dir):
+        mock_context.application.create_task = MagicMock()
+
+        with patch('bot.bot.getPopularEpisodesAsync', new_callable=AsyncMock,
+                   return_value=[sample_anime_data]), \
+             patch('bot.bot.getDataAsync', new_callable=AsyncMock,
+                   return_value={"file_id": "cached"}), \
+             patch('bot.bot.get_download_path', return_value=(tmp_path / "s1e4", tmp_path)):
+            import bot.bot as bot_module
+
+            await bot_module.prefetch_popular(mock_context)
+
+            mock_context.application.create_task.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_prefetch_waits_for_idle(self, mock_context, temp_config_dir):
+        """Test that nothing is prefetched while user fetches are running"""
+        with patch('bot.bot.getPopularEpisodesAsync', new_callable=AsyncMock) as mock_popular:
+            import bot.bot as bot_module
+            bot_module.inflight.join("one_piece-s1-e1", 42)
+
+            await bot_module.prefetch_popular(mock_context)
+
+            mock_popular.assert_not_called()
+
+
+class TestResumeJobs:
+    """Tests for resuming persisted jobs on startup"""
+
+    JOB = {
+        "object_id": "death_note-s1-e3",
+        "series_key": "death_note",
+        "series_name": "Death Note",
+        "season_id": 1,
+        "episode_id": 3,
+        "chat_ids": [987654321, 555],
+        "state": "downloading"
+    }
+
+    def test_resume_stage(self, tmp_path, temp_config_dir):
+        from bot.bot import resume_stage
+
+        assert resume_stage(tmp_path / "missing") == "download"
+        assert resume_stage(tmp_path) == "download"
+        (tmp_path / "Death Note").mkdir()
+        (tmp_path / "Death Note" / "ep3.ts").write_bytes(b"ts")
+        (tmp_path / "download.done").touch()
+        assert resume_stage(tmp_path) == "remux"
+
+    @pytest.mark.asyncio
+    async def test_chat_quota_does_not_drop_resumed_jobs(self, tmp_path, temp_config_dir):
+        """Test that more unfinished jobs of one chat than its quota all resume"""
+        docs = [dict(self.JOB, object_id=f"death_note-s1-e{episode_id}", episode_id=episode_id)
+                for episode_id in range(1, 6)]
+        application = MagicMock()
+
+        with patch('bot.bot.getUnfinishedJobsAsync', new_callable=AsyncMock, return_value=docs), \
+             patch('bot.bot.getDataAsync', new_callable=AsyncMock, return_value=None), \
+             patch('bot.bot.updateJobStateAsync', new_callable=AsyncMock) as mock_state, \
+             patch('bot.bot.get_download_path', return_value=(tmp_path, tmp_path / "episode.mp4")), \
+             patch('bot.bot.run_resumed_job', new=MagicMock()) as mock_run:
+            import bot.bot as bot_module
+            assert bot_module.pipeline.chat_quota < len(docs)
+
+            await bot_module.resume_jobs(application)
+
+            resumed = [call.args[1] for call in mock_run.call_args_list]
+            for job in resumed:
+                bot_module.pipeline.release(job)
+            assert len(resumed) == 5
+            mock_state.assert_not_called()
+            application.bot.send_message.assert_not_called()
+
+    def test_partial_ts_is_downloaded_again(self, tmp_path, temp_config_dir):
+        """Test that a .ts the downloader did not finish is not remuxed"""
+        from bot.bot import resume_stage
+
+        (tmp_path / "Death Note").mkdir()
+        (tmp_path / "Death Note" / "ep3.ts").write_bytes(b"truncated ts")
+
+        assert resume_stage(tmp_path) == "download"
+
+    @pytest.mark.asyncio
+    async def test_resumes_from_downloaded_artifacts(self, tmp_path, temp_config_dir):
+        """Test that an interrupted job is re-run without downloading again"""
+        (tmp_path / "episode.mp4").write_bytes(b"mp4")
+        application = MagicMock()
+
+        with patch('bot.bot.getUnfinishedJobsAsync', new_callable=AsyncMock,
+                   return_value=[self.JOB]), \
+             patch('bot.bot.getDataAsync', new_callable=AsyncMock, return_value=None), \
+             patch('bot.bot.get_download_path', return_value=(tmp_path, tmp_path / "episode.mp4")), \
+             patch('bot.bot.run_resumed_job', new=MagicMock()) as mock_run:
+            import bot.bot as bot_module
+
+            await bot_module.resume_jobs(application)
+
+            application.create_task.assert_called_once()
+            _, job, start_stage = mock_run.call_args[0]
+            bot_module.pipeline.release(job)
+            assert start_stage == "remux"
+            assert job.chat_id == 987654321
+            assert bot_module.inflight.chat_ids("death_note-s1-e3") == [987654321, 555]
+
+    @pytest.mark.asyncio
+    async def test_already_uploaded_job_is_delivered(self, temp_config_dir):
+        """Test that a job whose upload finished before the restart is just sent"""
+        application = MagicMock()
+        application.bot.send_video = AsyncMock()
+
+        with patch('bot.bot.getUnfinishedJobsAsync', new_callable=AsyncMock,
+                   return_value=[self.JOB]), \
+             patch('bot.bot.getDataAsync', new_callable=AsyncMock,
+                   return_value={"file_id": "FILE_ID"}), \
+             patch('bot.bot.updateJobStateAsync', new_callable=AsyncMock) as mock_state:
+            import bot.bot as bot_module
+
+            await bot_module.resume_jobs(application)
+
+            sent_to = [call.kwargs["chat_id"] for call in application.bot.send_video.call_args_list]
+            assert sent_to == [987654321, 555]
+            mock_state.assert_called_once_with("death_note-s1-e3", "delivered")
+            application.create_task.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_stages_are_recorded(self, temp_config_dir):
+        from bot.pipeline import EpisodeJob
+
+        with patch('bot.bot.updateJobStateAsync', new_callable=AsyncMock) as mock_state:
+            import bot.bot as bot_module
+            job = EpisodeJob("Death Note", "death_note", 1, 3, 42, Path("/tmp"))
+
+            await bot_module.record_stage(job, "remux")
+
+            mock_state.assert_called_once_with("death_note-s1-e3", "remuxing")
+
+
+class TestArtifactCache:
+    """Tests for keeping episode files on disk between uploads"""
+
+    @pytest.mark.asyncio
+    async def test_cached_file_skips_download(self, mock_update, mock_context, tmp_path,
+                                              temp_config_dir):
+        """Test that a miss whose file is still on disk is only uploaded again"""
+        mock_update.message.text = "/getanime Death Note, 1, 3"
+        mp4_file = tmp_path / "episode.mp4"
+        mp4_file.write_bytes(b"mp4")
+
+        with patch('bot.bot.getDataAndCountAsync', new_callable=AsyncMock, return_value=None), \
+             patch('bot.bot.get_download_path', return_value=(tmp_path, mp4_file)), \
+             patch('bot.bot.getalltsfiles', return_value=str(mp4_file)), \
+             patch('bot.bot.run_command', new_callable=AsyncMock) as mock_run, \
+             patch('bot.bot.upload_episode', new_callable=AsyncMock) as mock_upload:
+            import bot.bot as bot_module
+            bot_module.artifact_cache.add(mp4_file)
+
+            await bot_module.getanime(mock_update, mock_context)
+
+            mock_run.assert_not_called()
+            mock_upload.assert_called_once_with(str(mp4_file), mock_update.effective_chat.id,
+                                                "death_note-s1-e3")
+            # kept for the next re-upload, and no longer pinned
+            assert mp4_file.exists()
+            assert mp4_file in bot_module.artifact_cache
+            assert bot_module.artifact_cache.stats()["pinned"] == 0
+
+
+class TestMetrics:
+    """Tests for the bot's metrics"""
+
+    @pytest.mark.asyncio
+    async def test_lookups_are_counted(self, temp_config_dir):
+        with patch('bot.bot.getDataAsync', new_callable=AsyncMock, return_value=None):
+            import bot.bot as bot_module
+            lookups = bot_module.episode_lookups
+            before = {result: lookups.value(result=result) for result in ('memory', 'miss')}
+
+            await bot_module.lookup_episode("death_note", 1, 3)
+            bot_module.episode_cache.put(("death_note", 1, 3), "FILE_ID")
+            await bot_module.lookup_episode("death_note", 1, 3)
+
+            assert lookups.value(result='miss') == before['miss'] + 1
+            assert lookups.value(result='memory') == before['memory'] + 1
+
+    @pytest.mark.asyncio
+    async def test_stage_time_and_failures(self, temp_config_dir):
+        import bot.bot as bot_module
+
+        async def failing_stage(job):
+            raise FileNotFoundError('no episode')
+
+        timed = bot_module.timed_stage('remux', failing_stage)
+        seconds_before = bot_module.stage_seconds.count(stage='remux')
+        failures_before = bot_module.stage_failures.value(stage='remux')
+        with pytest.raises(FileNotFoundError):
+            await timed(MagicMock())
+
+        assert bot_module.stage_seconds.count(stage='remux') == seconds_before + 1
+        assert bot_module.stage_failures.value(stage='remux') == failures_before + 1
+        assert 'meido_pipeline_queue_depth' in bot_module.metrics.render()
+
+
+class TestTelegramRateLimiter:
+    """Tests for the python-telegram-bot hook in bot.py"""
+
+    @pytest.mark.asyncio
+    async def test_chat_requests_are_limited(self, temp_config_dir):
+        from bot.bot import TelegramRateLimiter
+        limiter = SimpleNamespace(run=AsyncMock(return_value="sent"))
+        callback = AsyncMock()
+
+        result = await TelegramRateLimiter(limiter).process_request(
+            callback, (), {}, "sendVideo", {"chat_id": 42}, None
+        )
+
+        assert result == "sent"
+        limiter.run.assert_called_once_with(42, callback)
+
+    @pytest.mark.asyncio
+    async def test_other_requests_pass_through(self, temp_config_dir):
+        from bot.bot import TelegramRateLimiter
+        limiter = SimpleNamespace(run=AsyncMock())
+        callback = AsyncMock(return_value=[])
+
+        await TelegramRateLimiter(limiter).process_request(
+            callback, (), {}, "getUpdates", {"timeout": 10}, None
+        )
+
+        callback.assert_called_once_with()
+        limiter.run.assert_not_called()
@@ -13,7 +13,7 @@ sys.path.insert(0, str(PROJECT_ROOT))
 
 # Import after pymongo is mocked in conftest
 # The conftest.py should have mocked pymongo before this import
-from bot.database import postData, getData, updateData, col
+from bot.database import postData, getData, updateData, col, QueryCounter
 
 
 class TestPostData:
@@ -138,3 +138,99 @@ class TestUpdateData:
             result = updateData(test_data)
             
             assert result is None
+
+
+class TestQueryCounter:
+    """Tests for the write-behind times_queried counter"""
+
+    def test_increments_are_merged(self):
+        """Test that repeated hits on one episode become one $inc"""
+        counter = QueryCounter(flush_threshold=100)
+        doc = {"series_key": "death_note", "season_id": 1, "episode_id": 3, "file_id": "x"}
+        counter.increment(doc)
+        counter.increment(doc)
+        counter.increment({"series_key": "death_note", "season_id": 1, "episode_id": 4})
+
+        with patch.object(col, 'bulk_write') as mock_bulk, \
+             patch('bot.database.UpdateOne') as mock_update_one:
+            counter.flush()
+
+        mock_bulk.assert_called_once()
+        assert len(mock_bulk.call_args[0][0]) == 2
+        updates = {
+            call.args[0]["episode_id"]: call.args[1]["$inc"]["times_queried"]
+            for call in mock_update_one.call_args_list
+        }
+        assert updates == {3: 2, 4: 1}
+        assert len(counter) == 0
+
+    def test_threshold_reached(self):
+        counter = QueryCounter(flush_threshold=2)
+        doc = {"series_key": "death_note", "season_id": 1, "episode_id": 3}
+
+        assert counter.increment(doc) is False
+        assert counter.increment(doc) is True
+
+    def test_flush_nothing_pending(self):
+        counter = QueryCounter()
+        with patch.object(col, 'bulk_write') as mock_bulk:
+            assert counter.flush() == 0
+        mock_bulk.assert_not_called()
+
+    def test_failed_flush_keeps_counts(self):
+        """Test that counts survive a failed bulk_write"""
+        counter = QueryCounter()
+        counter.increment({"series_key": "death_note", "season_id": 1, "episode_id": 3})
+
+        with patch.object(col, 'bulk_write', side_effect=Exception("Database error")):
+            assert counter.flush() == 0
+
+        assert len(counter) == 1
+
+
+class TestConnection:
+    """Tests for the lazy, per-process MongoDB client"""
+
+    def test_collection_handle_does_not_connect(self):
+        """Test that holding the col handle creates no client until it is used"""
+        import bot.database as database
+        with patch.object(database, '_client', None), \
+             patch.object(database, 'MongoClient') as mock_client_cls:
+            handle = database.col
+            mock_client_cls.assert_not_called()
+
+            handle.find_one
+            mock_client_cls.assert_called_once()
+
+    def test_client_is_reused(self):
+        import bot.database as database
+        with patch.object(database, '_client', None), \
+             patch.object(database, 'MongoClient') as mock_client_cls:
+            first = database.get_client()
+            second = database.get_client()
+
+        assert first is second
+        mock_client_cls.assert_called_once()
+        assert mock_client_cls.call_args.kwargs["connect"] is False
+
+    def test_new_client_after_fork(self):
+        """Test that a different process id gets its own client"""
+        import bot.database as database
+        with patch.object(database, '_client', None), \
+             patch.object(database, 'MongoClient', side_effect=[MagicMock(), MagicMock()]), \
+             patch('bot.database.os.getpid', return_value=1000):
+            parent = database.get_client()
+            with patch('bot.database.os.getpid', return_value=1001):
+                child = database.get_client()
+
+        assert parent is not child
+
+    def test_init_database_pings_and_indexes(self):
+        import bot.database as database
+        mock_client = MagicMock()
+        with patch.object(database, 'get_client', return_value=mock_client), \
+             patch.object(database, 'create_indexes') as mock_indexes:
+            database.init_database()
+
+        mock_client.admin.command.assert_called_once_with('ping')
+        mock_indexes.assert_called_once()
@@ -0,0 +1,352 @@
+"""
+Tests for the downloader service
+"""
+import pytest
+import sys
+import json
+import struct
+import subprocess
+from pathlib import Path
+from unittest.mock import MagicMock, patch
+
+# Add project root to path
+PROJECT_ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+# main.py imports its helper modules the way it is run, as a script
+sys.path.insert(0, str(PROJECT_ROOT / 'downloaderService'))
+
+import downloaderService.main as downloader
+from downloaderService.main import (
+    grabStreams, pickStream, streamRemuxCommand, streamVideo, NotStreamable
+)
+
+
+def mp4_bytes(*atoms):
+    """Top-level MP4 boxes of the given types, each with a 4 byte body"""
+    return b"".join(struct.pack('>I4s', 12, kind.encode()) + b"\0" * 4 for kind in atoms)
+
+
+def grab_output(*episodes):
+    return "\n".join(json.dumps(episode) for episode in episodes)
+
+
+class TestGrabStreams:
+    """Tests for grabStreams"""
+
+    def test_parses_first_episode_streams(self):
+        """Test that stream dicts are read from animdl's JSON lines"""
+        stdout = "Searching...\n" + grab_output(
+            {"episode": 3, "streams": [{"stream_url": "https://a/ep3.m3u8", "quality": "720"}]},
+        )
+        with patch('downloaderService.main.subprocess.run',
+                   return_value=MagicMock(stdout=stdout)) as mock_run:
+            streams = grabStreams("Death Note", 3)
+
+        assert streams == [{"stream_url": "https://a/ep3.m3u8", "quality": "720"}]
+        assert mock_run.call_args[0][0][:2] == ['animdl', 'grab']
+
+    def test_no_streams(self):
+        """Test output without any usable stream"""
+        stdout = grab_output({"episode": 3, "streams": [{"quality": "720"}]})
+        with patch('downloaderService.main.subprocess.run',
+                   return_value=MagicMock(stdout=stdout)):
+            assert grabStreams("Death Note", 3) == []
+
+
+class TestPickStream:
+    """Tests for pickStream"""
+
+    def test_prefers_highest_quality(self):
+        streams = [
+            {"stream_url": "low", "quality": "480"},
+            {"stream_url": "high", "quality": "1080p"},
+            {"stream_url": "unknown"},
+        ]
+        assert pickStream(streams)["stream_url"] == "high"
+
+    def test_empty(self):
+        assert pickStream([]) is None
+
+
+class TestStreamRemuxCommand:
+    """Tests for streamRemuxCommand"""
+
+    def test_copies_streams_from_url(self):
+        cmd = streamRemuxCommand({"stream_url": "https://a/ep3.m3u8"}, "/tmp/episode.mp4.part")
+        assert cmd[0] == 'ffmpeg'
+        assert cmd[cmd.index('-i') + 1] == "https://a/ep3.m3u8"
+        assert cmd[cmd.index('-f') + 1] == 'mp4'
+        # fragmented as the segments arrive, no faststart rewrite at the end
+        assert cmd[cmd.index('-movflags') + 1] == 'frag_keyframe+empty_moov+default_base_moof'
+        assert '-headers' not in cmd
+
+    def test_passes_headers(self):
+        cmd = streamRemuxCommand(
+            {"stream_url": "https://a/ep3.m3u8", "headers": {"Referer": "https://a/"}},
+            "/tmp/episode.mp4.part"
+        )
+        assert cmd[cmd.index('-headers') + 1] == "Referer: https://a/\r\n"
+        assert cmd.index('-headers') < cmd.index('-i')
+
+
+class TestStreamVideo:
+    """Tests for streamVideo"""
+
+    def test_writes_episode_mp4(self, tmp_path):
+        """Test that the finished part file is renamed to episode.mp4"""
+        data = mp4_bytes("ftyp", "moov", "moof", "mdat", "moof", "mdat")
+
+        def fake_ffmpeg(cmd, **kwargs):
+            Path(cmd[-1]).write_bytes(data)
+
+        with patch('downloaderService.main.grabStreams',
+                   return_value=[{"stream_url": "https://a/ep3.m3u8"}]), \
+             patch('downloaderService.main.subprocess.run', side_effect=fake_ffmpeg), \
+             patch('downloaderService.main.probeMedia', return_value=None):
+            outfile = streamVideo("Death Note", 3, tmp_path)
+
+        assert outfile == tmp_path / "episode.mp4"
+        assert outfile.read_bytes() == data
+        assert not (tmp_path / "episode.mp4.part").exists()
+        assert json.loads((tmp_path / "result.json").read_text())["path"] == "episode.mp4"
+
+    def test_unstreamable_mp4_fails(self, tmp_path):
+        """Test that an mp4 with its moov at the end fails instead of being kept"""
+        def fake_ffmpeg(cmd, **kwargs):
+            Path(cmd[-1]).write_bytes(mp4_bytes("ftyp", "mdat", "moov"))
+
+        with patch('downloaderService.main.grabStreams',
+                   return_value=[{"stream_url": "https://a/ep3.m3u8"}]), \
+             patch('downloaderService.main.subprocess.run', side_effect=fake_ffmpeg):
+            with pytest.raises(NotStreamable):
+                streamVideo("Death Note", 3, tmp_path)
+
+        assert not (tmp_path / "episode.mp4.part").exists()
+        assert not (tmp_path / "episode.mp4").exists()
+
+    def test_no_stream_returns_none(self, tmp_path):
+        with patch('downloaderService.main.grabStreams', return_value=[]):
+            assert streamVideo("Death Note", 3, tmp_path) is None
+
+
+class TestMain:
+    """Tests for the downloader entry point"""
+
+    @pytest.fixture(autouse=True)
+    def no_resumable_stream(self):
+        # these tests cover the animdl download path
+        with patch('downloaderService.main.resumableDownload', return_value=None):
+            yield
+
+    def test_stream_mode_falls_back_to_download(self, tmp_path):
+        """Test that a failed stream falls back to animdl download"""
+        with patch('downloaderService.main.streamVideo',
+                   side_effect=subprocess.CalledProcessError(1, 'ffmpeg')), \
+             patch('downloaderService.main.downloadVideo') as mock_download, \
+             patch('downloaderService.main.getalltsfiles', return_value=(None, None)):
+            downloader.main(['main.py', 'Death Note', '1', '3', str(tmp_path), '--stream'])
+
+        mock_download.assert_called_once_with('Death Note', '3', tmp_path)
+
+    def test_unstreamable_stream_fails_the_job(self, tmp_path):
+        """Test that a stream producing an unstreamable mp4 exits with an error"""
+        with patch('downloaderService.main.streamVideo', side_effect=NotStreamable("moov last")), \
+             patch('downloaderService.main.downloadVideo') as mock_download:
+            with pytest.raises(SystemExit):
+                downloader.main(['main.py', 'Death Note', '1', '3', str(tmp_path), '--stream'])
+
+        mock_download.assert_not_called()
+
+    def test_stream_mode_skips_download(self, tmp_path):
+        """Test that a successful stream does not run animdl download"""
+        with patch('downloaderService.main.streamVideo', return_value=tmp_path / "episode.mp4"), \
+             patch('downloaderService.main.downloadVideo') as mock_download:
+            downloader.main(['main.py', 'Death Note', '1', '3', str(tmp_path), '--stream'])
+
+        mock_download.assert_not_called()
+
+    def test_missing_arguments_exit(self):
+        with pytest.raises(SystemExit):
+            downloader.main(['main.py', 'Death Note'])
+
+    def test_skip_remux_leaves_ts(self, tmp_path):
+        """Test that --skip-remux only downloads"""
+        with patch('downloaderService.main.downloadVideo') as mock_download, \
+             patch('downloaderService.main.remux') as mock_remux:
+            downloader.main(['main.py', 'Death Note', '1', '3', str(tmp_path), '--skip-remux'])
+
+        mock_download.assert_called_once()
+        mock_remux.assert_not_called()
+        assert (tmp_path / "download.done").exists()
+
+    def test_failed_download_is_not_marked_done(self, tmp_path):
+        """Test that an interrupted download leaves no completion marker"""
+        (tmp_path / "download.done").touch()
+        with patch('downloaderService.main.downloadVideo',
+                   side_effect=subprocess.CalledProcessError(1, 'animdl')), \
+             pytest.raises(SystemExit):
+            downloader.main(['main.py', 'Death Note', '1', '3', str(tmp_path), '--skip-remux'])
+
+        assert not (tmp_path / "download.done").exists()
+
+    def test_remux_only(self, tmp_path):
+        """Test that --remux-only converts without downloading"""
+        with patch('downloaderService.main.downloadVideo') as mock_download, \
+             patch('downloaderService.main.remux', return_value=tmp_path / "episode.mp4") as mock_remux:
+            downloader.main(['main.py', '--remux-only', str(tmp_path)])
+
+        mock_download.assert_not_called()
+        mock_remux.assert_called_once_with(tmp_path)
+
+
+def fake_convert(infile, outfile):
+    Path(outfile).write_bytes(b"mp4 data")
+
+
+class TestRemux:
+    """Tests for remux"""
+
+    @pytest.fixture(autouse=True)
+    def no_ffprobe(self):
+        with patch('downloaderService.main.probeMedia', return_value=None):
+            yield
+
+    def test_remux_writes_episode_mp4(self, tmp_path):
+        """Test that the .ts is converted to episode.mp4 and removed"""
+        ts_file = tmp_path / "Death Note" / "E03.ts"
+        ts_file.parent.mkdir()
+        ts_file.write_bytes(b"ts data")
+        (tmp_path / "download.done").touch()
+
+        with patch('downloaderService.main.convert2mp4', side_effect=fake_convert) as mock_convert:
+            outfile = downloader.remux(tmp_path)
+
+        assert outfile == tmp_path / "episode.mp4"
+        mock_convert.assert_called_once_with(str(ts_file), str(tmp_path / "episode.mp4"))
+        assert not ts_file.exists()
+        assert not (tmp_path / "download.done").exists()
+
+    def test_remux_writes_result_manifest(self, tmp_path):
+        """Test that the bot is told where the episode is and what it contains"""
+        (tmp_path / "E03.ts").write_bytes(b"ts data")
+        media = {"container": "mov,mp4,m4a,3gp,3g2,mj2", "duration": 1420.05,
+                 "video": "h264", "audio": "aac"}
+
+        with patch('downloaderService.main.convert2mp4', side_effect=fake_convert), \
+             patch('downloaderService.main.probeMedia', return_value=media):
+            downloader.remux(tmp_path)
+
+        result = json.loads((tmp_path / "result.json").read_text())
+        assert result == {"path": "episode.mp4", "size": 8, "duration": 1420.05,
+                          "container": "mov,mp4,m4a,3gp,3g2,mj2", "video": "h264", "audio": "aac"}
+
+    def test_getalltsfiles_only_looks_two_levels_deep(self, tmp_path):
+        """Test that the .ts lookup lists the episode directory, not the whole tree"""
+        deep = tmp_path / "a" / "b"
+        deep.mkdir(parents=True)
+        (deep / "E03.ts").write_bytes(b"ts")
+        assert downloader.getalltsfiles(tmp_path) == (None, None)
+
+        (tmp_path / "a" / "E03.TS").write_bytes(b"ts")
+        assert downloader.getalltsfiles(tmp_path)[0] == str(tmp_path / "a" / "E03.TS")
+
+    def test_remux_nothing_to_convert(self, tmp_path):
+        assert downloader.remux(tmp_path) is None
+
+    def test_remux_picks_up_downloaded_mp4(self, tmp_path):
+        """Test that an .mp4 animdl downloaded directly is used when there is no .ts"""
+        mp4_file = tmp_path / "Death Note" / "E03.mp4"
+        mp4_file.parent.mkdir()
+        mp4_file.write_bytes(b"mp4 data")
+
+        with patch('downloaderService.main.convert2mp4', side_effect=fake_convert) as mock_convert:
+            downloader.remux(tmp_path)
+
+        mock_convert.assert_called_once_with(str(mp4_file), str(tmp_path / "episode.mp4"))
+
+
+class TestConvert2mp4:
+    """Tests for convert2mp4"""
+
+    def test_streamable_mp4_is_renamed(self, tmp_path):
+        """Test that ffmpeg is skipped for a faststart mp4 Telegram can already stream"""
+        infile = tmp_path / "E03.mp4"
+        infile.write_bytes(b"mp4 data")
+        media = {"container": "mov,mp4,m4a,3gp,3g2,mj2", "video": "h264", "audio": "aac"}
+
+        with patch('downloaderService.main.probeMedia', return_value=media), \
+             patch('downloaderService.main.isFaststart', return_value=True), \
+             patch('downloaderService.main.subprocess.run') as mock_run:
+            plan = downloader.convert2mp4(str(infile), str(tmp_path / "episode.mp4"))
+
+        assert plan == "rename"
+        mock_run.assert_not_called()
+        assert (tmp_path / "episode.mp4").read_bytes() == b"mp4 data"
+
+    def test_mp4_with_trailing_moov_is_remuxed(self, tmp_path):
+        infile = tmp_path / "E03.mp4"
+        infile.write_bytes(b"mp4 data")
+        media = {"container": "mov,mp4,m4a,3gp,3g2,mj2", "video": "h264", "audio": "aac"}
+
+        with patch('downloaderService.main.probeMedia', return_value=media), \
+             patch('downloaderService.main.isFaststart', return_value=False), \
+             patch('downloaderService.main.subprocess.run') as mock_run:
+            plan = downloader.convert2mp4(str(infile), str(tmp_path / "episode.mp4"))
+
+        assert plan == "remux"
+        mock_run.assert_called_once()
+
+    def test_ts_is_remuxed(self, tmp_path):
+        infile = tmp_path / "E03.ts"
+        infile.write_bytes(b"ts data")
+        media = {"container": "mpegts", "video": "h264", "audio": "aac"}
+
+        with patch('downloaderService.main.probeMedia', return_value=media), \
+             patch('downloaderService.main.subprocess.run') as mock_run:
+            plan = downloader.convert2mp4(str(infile), str(tmp_path / "episode.mp4"))
+
+        assert plan == "remux"
+        cmd = mock_run.call_args[0][0]
+        assert cmd[0] == 'ffmpeg' and '+faststart' in cmd
+
+    def test_missing_input(self, tmp_path):
+        with pytest.raises(FileNotFoundError):
+            downloader.convert2mp4(str(tmp_path / "E03.ts"), str(tmp_path / "episode.mp4"))
+
+
+class TestBatch:
+    """Tests for batched range downloads"""
+
+    def test_episode_number(self):
+        assert downloader.episodeNumber("E04.ts") == 4
+        assert downloader.episodeNumber("Death Note E12.ts") == 12
+        assert downloader.episodeNumber("episode_7.ts") == 7
+        assert downloader.episodeNumber("video.ts") is None
+
+    def test_episode_dir_matches_bot_layout(self, tmp_path):
+        from bot.botUtils import get_download_path
+        with patch('bot.botUtils.PROJECT_ROOT', tmp_path):
+            expected, _ = get_download_path("death_note", 1, 3)
+        series_dir = tmp_path / "downloads" / "death_note"
+        assert downloader.episodeDir(series_dir, 1, 3) == expected
+
+    def test_download_batch_splits_episodes(self, tmp_path):
+        """Test that one animdl run is split into per-episode mp4s"""
+        def fake_animdl(search_query, search_query_range, download_dir):
+            (Path(download_dir) / "Death Note").mkdir()
+            for episode_id in (3, 4, 6):
+                (Path(download_dir) / "Death Note" / f"E{episode_id:02d}.ts").write_bytes(b"ts")
+
+        def fake_convert(infile, outfile):
+            Path(outfile).write_bytes(b"mp4")
+
+        with patch('downloaderService.main.downloadVideo', side_effect=fake_animdl) as mock_download, \
+             patch('downloaderService.main.convert2mp4', side_effect=fake_convert):
+            produced = downloader.downloadBatch("Death Note", "1", "3-4,6", tmp_path)
+
+        mock_download.assert_called_once()
+        assert produced == [3, 4, 6]
+        for episode_id in (3, 4, 6):
+            assert (tmp_path / f"S01E{episode_id:02d}" / "episode.mp4").exists()
+        # staging directory is cleaned up
+        assert [p.name for p in tmp_path.iterdir() if p.name.startswith('.batch')] == []
@@ -0,0 +1,84 @@
+"""
+Tests for the in-process episode cache
+"""
+import sys
+from pathlib import Path
+
+# Add project root to path
+PROJECT_ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+
+from bot.episodeCache import EpisodeCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+KEY = ("death_note", 1, 3)
+
+
+class TestEpisodeCache:
+    """Tests for EpisodeCache"""
+
+    def test_put_and_get(self):
+        cache = EpisodeCache()
+        cache.put(KEY, "FILE_ID")
+
+        assert cache.get(KEY) == "FILE_ID"
+        assert cache.stats()["hits"] == 1
+
+    def test_miss(self):
+        cache = EpisodeCache()
+
+        assert cache.get(KEY) is None
+        assert cache.stats()["misses"] == 1
+
+    def test_ttl_expiry(self):
+        clock = FakeClock()
+        cache = EpisodeCache(ttl=10, clock=clock)
+        cache.put(KEY, "FILE_ID")
+
+        clock.now = 9
+        assert cache.get(KEY) == "FILE_ID"
+        clock.now = 10
+        assert cache.get(KEY) is None
+        assert len(cache) == 0
+
+    def test_lru_eviction(self):
+        cache = EpisodeCache(maxsize=2)
+        cache.put(("a", 1, 1), "A")
+        cache.put(("b", 1, 1), "B")
+        # touch a so b becomes least recently used
+        cache.get(("a", 1, 1))
+        cache.put(("c", 1, 1), "C")
+
+        assert cache.get(("b", 1, 1)) is None
+        assert cache.get(("a", 1, 1)) == "A"
+        assert cache.get(("c", 1, 1)) == "C"
+        assert cache.stats()["evictions"] == 1
+
+    def test_invalidate(self):
+        cache = EpisodeCache()
+        cache.put(KEY, "FILE_ID")
+        cache.invalidate(KEY)
+
+        assert cache.get(KEY) is None
+
+    def test_empty_file_id_not_cached(self):
+        cache = EpisodeCache()
+        cache.put(KEY, None)
+
+        assert len(cache) == 0
+
+    def test_hit_rate(self):
+        cache = EpisodeCache()
+        cache.put(KEY, "FILE_ID")
+        cache.get(KEY)
+        cache.get(("other", 1, 1))
+
+        assert cache.stats()["hit_rate"] == 0.5
@@ -0,0 +1,84 @@
+"""
+Tests for the single-flight registry
+"""
+import pytest
+import sys
+from pathlib import Path
+
+# Add project root to path
+PROJECT_ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+
+from bot.inflight import InflightRegistry
+
+
+class TestInflightRegistry:
+    """Tests for InflightRegistry"""
+
+    @pytest.mark.asyncio
+    async def test_first_join_is_leader(self):
+        """Test that only the first request for an episode leads"""
+        registry = InflightRegistry()
+
+        assert registry.join("death_note-s1-e3", 1) is True
+        assert registry.join("death_note-s1-e3", 2) is False
+        assert registry.join("death_note-s1-e4", 3) is True
+        assert registry.chat_ids("death_note-s1-e3") == [1, 2]
+
+    @pytest.mark.asyncio
+    async def test_duplicate_chat_is_not_added_twice(self):
+        """Test that a chat asking twice is only notified once"""
+        registry = InflightRegistry()
+        registry.join("death_note-s1-e3", 1)
+        registry.join("death_note-s1-e3", 1)
+
+        assert registry.chat_ids("death_note-s1-e3") == [1]
+
+    @pytest.mark.asyncio
+    async def test_resolve_returns_waiters(self):
+        """Test that resolving ends the fetch and returns the chats waiting for it"""
+        registry = InflightRegistry()
+        registry.join("death_note-s1-e3", 1)
+        registry.join("death_note-s1-e3", 2)
+
+        chat_ids = registry.resolve("death_note-s1-e3", "FILE_ID")
+
+        assert chat_ids == [1, 2]
+        assert "death_note-s1-e3" not in registry
+
+    @pytest.mark.asyncio
+    async def test_fail_releases_entry(self):
+        """Test that a failed fetch lets the next request lead again"""
+        registry = InflightRegistry()
+        registry.join("death_note-s1-e3", 1)
+        registry.join("death_note-s1-e3", 2)
+
+        assert registry.fail("death_note-s1-e3") == [1, 2]
+        assert registry.join("death_note-s1-e3", 2) is True
+
+    @pytest.mark.asyncio
+    async def test_stale_entry_is_replaced(self):
+        """Test that an entry older than the timeout is taken over"""
+        registry = InflightRegistry(timeout=0)
+        registry.join("death_note-s1-e3", 1)
+
+        assert registry.join("death_note-s1-e3", 2) is True
+        assert registry.chat_ids("death_note-s1-e3") == [2]
+
+    @pytest.mark.asyncio
+    async def test_resolve_unknown_object_id(self):
+        """Test resolving an episode nobody is waiting for"""
+        registry = InflightRegistry()
+        assert registry.resolve("unknown-s1-e1", "FILE_ID") == []
+
+    @pytest.mark.asyncio
+    async def test_attached_job_lives_with_entry(self):
+        """Test that the leader's job can be looked up until the fetch ends"""
+        registry = InflightRegistry()
+        job = object()
+        registry.join("death_note-s1-e3", 1)
+        registry.attach_job("death_note-s1-e3", job)
+
+        assert registry.job("death_note-s1-e3") is job
+        registry.resolve("death_note-s1-e3", "FILE_ID")
+        assert registry.job("death_note-s1-e3") is None
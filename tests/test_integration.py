@@ -29,6 +29,7 @@ if 'telegram' not in sys.modules:
     telegram_mock.Update = MagicMock
     telegram_mock.ext = MagicMock()
     telegram_mock.ext.Application = MagicMock
+    telegram_mock.ext.BaseRateLimiter = type('BaseRateLimiter', (), {})
     telegram_mock.ext.CommandHandler = MagicMock
     telegram_mock.ext.MessageHandler = MagicMock
     telegram_mock.ext.ContextTypes = MagicMock()
@@ -50,9 +51,9 @@ class TestDownloadWorkflow:
         mock_update.message.text = "/getanime Test Anime, 1, 1"
         
         # Mock that anime is not in database
-        with patch('bot.bot.getData', return_value=None), \
+        with patch('bot.bot.getDataAndCountAsync', new_callable=AsyncMock, return_value=None), \
              patch('bot.bot.getalltsfiles', return_value="/tmp/test.mp4"), \
-             patch('subprocess.check_call') as mock_subprocess:
+             patch('bot.bot.run_command', new_callable=AsyncMock) as mock_subprocess:
             
             from bot.bot import getanime
             
@@ -65,6 +66,23 @@ class TestDownloadWorkflow:
             assert "downloaderService" in call_args or "main.py" in call_args
 
 
+    @pytest.mark.asyncio
+    async def test_stream_download_mode(self, mock_update, mock_context, temp_config_dir):
+        """Test that download_mode=stream is passed on to the downloader"""
+        mock_update.message.text = "/getanime Test Anime, 1, 1"
+
+        import bot.bot as bot_module
+        with patch.dict(bot_module.configdata, {"download_mode": "stream"}), \
+             patch('bot.bot.getDataAndCountAsync', new_callable=AsyncMock, return_value=None), \
+             patch('bot.bot.getalltsfiles', return_value=None), \
+             patch('bot.bot.run_command', new_callable=AsyncMock) as mock_subprocess:
+
+            await bot_module.getanime(mock_update, mock_context)
+
+            download_cmd = mock_subprocess.call_args_list[0][0][0]
+            assert download_cmd[-1] == '--stream'
+
+
 class TestUploadWorkflow:
     """Integration tests for upload workflow"""
     
@@ -79,9 +97,9 @@ class TestUploadWorkflow:
             tmp_file_path = tmp_file.name
         
         try:
-            with patch('bot.bot.getData', return_value=None), \
+            with patch('bot.bot.getDataAndCountAsync', new_callable=AsyncMock, return_value=None), \
                  patch('bot.bot.getalltsfiles', return_value=tmp_file_path), \
-                 patch('subprocess.check_call') as mock_subprocess:
+                 patch('bot.bot.run_command', new_callable=AsyncMock) as mock_subprocess:
                     
                     from bot.bot import getanime
                     
@@ -95,6 +113,51 @@ class TestUploadWorkflow:
                 os.unlink(tmp_file_path)
 
 
+    @pytest.mark.asyncio
+    async def test_upload_falls_back_when_daemon_unreachable(self, mock_update, mock_context,
+                                                            temp_config_dir):
+        """Test that the one-shot uploader is spawned when the daemon is down"""
+        mock_update.message.text = "/getanime Test Anime, 1, 1"
+
+        with tempfile.NamedTemporaryFile(suffix='.mp4', delete=False) as tmp_file:
+            tmp_file.write(b"fake video data")
+            tmp_file_path = tmp_file.name
+
+        try:
+            import bot.bot as bot_module
+            with patch.dict(bot_module.configdata, {"uploader_daemon": "127.0.0.1:1"}), \
+                 patch('bot.bot.getDataAndCountAsync', new_callable=AsyncMock, return_value=None), \
+                 patch('bot.bot.getalltsfiles', return_value=tmp_file_path), \
+                 patch('bot.bot.upload_via_daemon', new_callable=AsyncMock,
+                       side_effect=ConnectionRefusedError()) as mock_daemon, \
+                 patch('bot.bot.run_command', new_callable=AsyncMock) as mock_subprocess:
+
+                await bot_module.getanime(mock_update, mock_context)
+
+                mock_daemon.assert_called_once()
+                assert mock_subprocess.call_count == 2
+                assert "uploaderService" in str(mock_subprocess.call_args)
+        finally:
+            if os.path.exists(tmp_file_path):
+                os.unlink(tmp_file_path)
+
+
+    @pytest.mark.asyncio
+    async def test_upload_not_repeated_after_handover(self, mock_update, mock_context,
+                                                      temp_config_dir):
+        """Test that a daemon lost mid-upload does not get the file uploaded twice"""
+        import bot.bot as bot_module
+        with patch.dict(bot_module.configdata, {"uploader_daemon": "127.0.0.1:1"}), \
+             patch('bot.bot.upload_via_daemon', new_callable=AsyncMock,
+                   side_effect=bot_module.UploadError("connection reset")), \
+             patch('bot.bot.run_command', new_callable=AsyncMock) as mock_subprocess:
+
+            with pytest.raises(bot_module.UploadError):
+                await bot_module.upload_episode("/tmp/episode.mp4", 1, "test_anime-s1-e1")
+
+            mock_subprocess.assert_not_called()
+
+
 class TestCachedWorkflow:
     """Integration tests for cached content workflow"""
     
@@ -104,9 +167,8 @@ class TestCachedWorkflow:
         """Test that cached content is delivered instantly"""
         mock_update.message.text = "/getanime Death Note, 1, 3"
         
-        with patch('bot.bot.getData', return_value=sample_anime_data), \
-             patch('bot.bot.updateData') as mock_update_data, \
-             patch('subprocess.check_call') as mock_subprocess:
+        with patch('bot.bot.getDataAndCountAsync', new_callable=AsyncMock, return_value=sample_anime_data) as mock_update_data, \
+             patch('bot.bot.run_command', new_callable=AsyncMock) as mock_subprocess:
             
             from bot.bot import getanime
             
@@ -128,8 +190,8 @@ class TestErrorHandling:
         """Test error handling when download fails"""
         mock_update.message.text = "/getanime Test Anime, 1, 1"
         
-        with patch('bot.bot.getData', return_value=None), \
-             patch('subprocess.check_call', side_effect=Exception("Download failed")):
+        with patch('bot.bot.getDataAndCountAsync', new_callable=AsyncMock, return_value=None), \
+             patch('bot.bot.run_command', new_callable=AsyncMock, side_effect=Exception("Download failed")):
             
             from bot.bot import getanime
             
@@ -151,9 +213,9 @@ class TestErrorHandling:
         """Test error handling when upload fails"""
         mock_update.message.text = "/getanime Test Anime, 1, 1"
         
-        with patch('bot.bot.getData', return_value=None), \
+        with patch('bot.bot.getDataAndCountAsync', new_callable=AsyncMock, return_value=None), \
              patch('bot.bot.getalltsfiles', return_value="/tmp/test.mp4"), \
-             patch('subprocess.check_call', side_effect=[
+             patch('bot.bot.run_command', new_callable=AsyncMock, side_effect=[
                  None,  # Download succeeds
                  Exception("Upload failed")  # Upload fails
              ]):
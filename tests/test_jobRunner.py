@@ -0,0 +1,62 @@
+"""
+Tests for the async job runner
+"""
+import pytest
+import sys
+import asyncio
+import subprocess
+import time
+from pathlib import Path
+
+# Add project root to path
+PROJECT_ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+
+from bot.jobRunner import run_command
+
+
+class TestRunCommand:
+    """Tests for run_command"""
+
+    @pytest.mark.asyncio
+    async def test_run_command_success(self):
+        """Test a command that exits cleanly"""
+        result = await run_command([sys.executable, '-c', 'pass'])
+        assert result == 0
+
+    @pytest.mark.asyncio
+    async def test_run_command_failure_raises(self):
+        """Test that a non-zero exit raises CalledProcessError"""
+        with pytest.raises(subprocess.CalledProcessError) as exc_info:
+            await run_command([sys.executable, '-c', 'import sys; sys.exit(3)'])
+        assert exc_info.value.returncode == 3
+
+    @pytest.mark.asyncio
+    async def test_run_command_does_not_block_loop(self):
+        """Test that other tasks keep running while the command is running"""
+        ticks = []
+
+        async def ticker():
+            for _ in range(5):
+                ticks.append(time.monotonic())
+                await asyncio.sleep(0.01)
+
+        started = time.monotonic()
+        await asyncio.gather(
+            run_command([sys.executable, '-c', 'import time; time.sleep(0.5)']),
+            ticker()
+        )
+        # The ticker finished long before the subprocess did
+        assert len(ticks) == 5
+        assert ticks[-1] - started < 0.4
+
+    @pytest.mark.asyncio
+    async def test_run_command_cancel_kills_process(self):
+        """Test that cancelling the awaiting task kills the subprocess"""
+        task = asyncio.create_task(
+            run_command([sys.executable, '-c', 'import time; time.sleep(30)'])
+        )
+        await asyncio.sleep(0.2)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await asyncio.wait_for(task, timeout=5)
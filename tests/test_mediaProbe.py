@@ -0,0 +1,126 @@
+"""
+Tests for choosing the remux path from ffprobe output
+"""
+import pytest
+import sys
+import json
+import struct
+import subprocess
+from pathlib import Path
+from unittest.mock import MagicMock, patch
+
+# Add project root to path
+PROJECT_ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+sys.path.insert(0, str(PROJECT_ROOT / 'downloaderService'))
+
+from downloaderService.mediaProbe import (
+    probeMedia, chooseRemux, ffmpegCommand, topLevelAtoms, isFaststart, RENAME, REMUX, TRANSCODE
+)
+
+MP4 = "mov,mp4,m4a,3gp,3g2,mj2"
+
+
+def mp4_bytes(*atoms):
+    """A file made of top-level boxes with a few payload bytes each"""
+    return b"".join(struct.pack('>I4s', 12, kind.encode()) + b"\0" * 4 for kind in atoms)
+
+
+def ffprobe_output(container, *codecs):
+    return json.dumps({
+        "streams": [{"codec_type": kind, "codec_name": name} for kind, name in codecs],
+        "format": {"format_name": container, "duration": "1420.053000"},
+    })
+
+
+class TestProbeMedia:
+    """Tests for probeMedia"""
+
+    def test_reads_container_and_codecs(self):
+        stdout = ffprobe_output("mpegts", ("video", "h264"), ("audio", "aac"), ("audio", "mp3"))
+        with patch('downloaderService.mediaProbe.subprocess.run',
+                   return_value=MagicMock(stdout=stdout)) as mock_run:
+            media = probeMedia("E03.ts")
+
+        assert media == {"container": "mpegts", "duration": 1420.05, "video": "h264", "audio": "aac"}
+        assert mock_run.call_args[0][0][0] == 'ffprobe'
+
+    def test_probe_failure(self):
+        """Test that a missing or failing ffprobe gives None"""
+        with patch('downloaderService.mediaProbe.subprocess.run',
+                   side_effect=subprocess.CalledProcessError(1, 'ffprobe')):
+            assert probeMedia("E03.ts") is None
+        with patch('downloaderService.mediaProbe.subprocess.run', side_effect=FileNotFoundError):
+            assert probeMedia("E03.ts") is None
+
+
+class TestChooseRemux:
+    """Tests for chooseRemux"""
+
+    @pytest.mark.parametrize("media,faststart,plan", [
+        ({"container": MP4, "video": "h264", "audio": "aac"}, True, RENAME),
+        # moov at the end: copy again so the index moves to the front
+        ({"container": MP4, "video": "h264", "audio": "aac"}, False, REMUX),
+        ({"container": "mpegts", "video": "h264", "audio": "aac"}, False, REMUX),
+        ({"container": "matroska,webm", "video": "h264", "audio": None}, False, REMUX),
+        ({"container": MP4, "video": "hevc", "audio": "aac"}, True, TRANSCODE),
+        ({"container": "mpegts", "video": "h264", "audio": "opus"}, False, TRANSCODE),
+        (None, True, REMUX),
+    ])
+    def test_plan(self, media, faststart, plan):
+        assert chooseRemux(media, faststart) == plan
+
+
+class TestFaststart:
+    """Tests for the moov-before-mdat check"""
+
+    def test_top_level_atoms(self, tmp_path):
+        path = tmp_path / "episode.mp4"
+        # a 64-bit sized box followed by one that runs to the end of the file
+        path.write_bytes(
+            mp4_bytes("ftyp")
+            + struct.pack('>I4sQ', 1, b"moov", 20) + b"\0" * 4
+            + struct.pack('>I4s', 0, b"mdat") + b"\0" * 100
+        )
+        assert topLevelAtoms(path) == ["ftyp", "moov", "mdat"]
+
+    def test_moov_first(self, tmp_path):
+        path = tmp_path / "episode.mp4"
+        path.write_bytes(mp4_bytes("ftyp", "moov", "mdat"))
+        assert isFaststart(path)
+
+    def test_moov_last(self, tmp_path):
+        path = tmp_path / "episode.mp4"
+        path.write_bytes(mp4_bytes("ftyp", "mdat", "moov"))
+        assert not isFaststart(path)
+
+    def test_fragmented(self, tmp_path):
+        path = tmp_path / "episode.mp4"
+        path.write_bytes(mp4_bytes("ftyp", "moov", "moof", "mdat", "moof", "mdat"))
+        assert isFaststart(path)
+
+    def test_not_an_mp4(self, tmp_path):
+        path = tmp_path / "E03.ts"
+        path.write_bytes(b"\x47" * 188)
+        assert not isFaststart(path)
+        assert not isFaststart(tmp_path / "missing.mp4")
+
+
+class TestFfmpegCommand:
+    """Tests for ffmpegCommand"""
+
+    def test_remux_copies_with_faststart(self):
+        cmd = ffmpegCommand("E03.ts", "episode.mp4", REMUX)
+
+        assert cmd[cmd.index('-c:v') + 1] == 'copy'
+        assert cmd[cmd.index('-c:a') + 1] == 'copy'
+        assert cmd[cmd.index('-movflags') + 1] == '+faststart'
+        assert '-preset:v' not in cmd and '-segment_list_flags' not in cmd
+        assert cmd[-1] == "episode.mp4"
+
+    def test_transcode_only_reencodes_unstreamable_stream(self):
+        media = {"container": "mpegts", "video": "h264", "audio": "opus"}
+        cmd = ffmpegCommand("E03.ts", "episode.mp4", TRANSCODE, media)
+
+        assert cmd[cmd.index('-c:v') + 1] == 'copy'
+        assert cmd[cmd.index('-c:a') + 1] == 'aac'
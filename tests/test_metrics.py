@@ -0,0 +1,104 @@
+"""
+Tests for the metrics registry and the /metrics endpoint
+"""
+import pytest
+import asyncio
+import sys
+from pathlib import Path
+
+# Add project root to path
+PROJECT_ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+
+from bot.metrics import Registry, MetricsServer
+
+
+class TestRegistry:
+    """Tests for counters, gauges and histograms"""
+
+    def test_counter(self):
+        registry = Registry()
+        lookups = registry.counter('lookups_total', 'Lookups', ('result',))
+        lookups.inc(result='hit')
+        lookups.inc(2, result='hit')
+        lookups.inc(result='miss')
+
+        assert lookups.value(result='hit') == 3
+        assert registry.render().splitlines() == [
+            '# HELP lookups_total Lookups',
+            '# TYPE lookups_total counter',
+            'lookups_total{result="hit"} 3',
+            'lookups_total{result="miss"} 1',
+        ]
+
+    def test_wrong_labels(self):
+        lookups = Registry().counter('lookups_total', 'Lookups', ('result',))
+        with pytest.raises(ValueError):
+            lookups.inc(stage='download')
+
+    def test_duplicate_name(self):
+        registry = Registry()
+        registry.counter('lookups_total', 'Lookups')
+        with pytest.raises(ValueError):
+            registry.counter('lookups_total', 'Lookups')
+
+    def test_histogram_buckets_are_cumulative(self):
+        registry = Registry()
+        seconds = registry.histogram('stage_seconds', 'Stage time', ('stage',), buckets=(1, 10))
+        for value in (0.5, 5, 50):
+            seconds.observe(value, stage='download')
+
+        lines = registry.render().splitlines()
+        assert 'stage_seconds_bucket{stage="download",le="1"} 1' in lines
+        assert 'stage_seconds_bucket{stage="download",le="10"} 2' in lines
+        assert 'stage_seconds_bucket{stage="download",le="+Inf"} 3' in lines
+        assert 'stage_seconds_sum{stage="download"} 55.5' in lines
+        assert 'stage_seconds_count{stage="download"} 3' in lines
+
+    def test_histogram_times_failures_too(self):
+        seconds = Registry().histogram('stage_seconds', 'Stage time', ('stage',))
+        with pytest.raises(RuntimeError):
+            with seconds.time(stage='upload'):
+                raise RuntimeError('upload failed')
+        assert seconds.count(stage='upload') == 1
+
+    def test_gauge_functions(self):
+        registry = Registry()
+        registry.gauge('queue_depth', 'Queue depth', ('stage',),
+                       func=lambda: {('download',): 2, ('upload',): 0})
+        registry.stats_gauge('cache', 'Cache stats', lambda: {'hits': 4, 'name': 'lru'})
+
+        lines = registry.render().splitlines()
+        assert 'queue_depth{stage="download"} 2' in lines
+        assert 'cache{stat="hits"} 4' in lines
+        # only numbers are exported
+        assert not any('name' in line for line in lines if line.startswith('cache{'))
+
+
+class TestMetricsServer:
+    """Tests for MetricsServer"""
+
+    async def get(self, port, path):
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(f'GET {path} HTTP/1.1\r\nHost: localhost\r\n\r\n'.encode())
+        await writer.drain()
+        response = await reader.read()
+        writer.close()
+        return response.decode()
+
+    @pytest.mark.asyncio
+    async def test_serves_metrics(self):
+        registry = Registry()
+        registry.counter('lookups_total', 'Lookups').inc()
+        server = MetricsServer(registry, port=0)
+        await server.start()
+        try:
+            response = await self.get(server.port, '/metrics')
+            missing = await self.get(server.port, '/')
+        finally:
+            await server.close()
+
+        assert response.startswith('HTTP/1.1 200 OK')
+        assert 'text/plain; version=0.0.4' in response
+        assert response.endswith('lookups_total 1\n')
+        assert missing.startswith('HTTP/1.1 404')
@@ -0,0 +1,171 @@
+"""
+Tests for parallel chunked uploads
+"""
+import pytest
+import sys
+import asyncio
+from pathlib import Path
+
+# Add project root to path
+PROJECT_ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+
+import uploaderService.parallelUpload as parallelUpload
+from telethon.errors import FloodWaitError
+from uploaderService.parallelUpload import parallel_upload, part_size_for, valid_part_size_kb
+
+
+class FakeClient:
+    """Records part uploads and tracks how many were in flight at once"""
+
+    def __init__(self, fail_first=0, error=None):
+        self.parts = {}
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.fail_first = fail_first
+        self.error = error or ConnectionError("flaky")
+        self.calls = 0
+
+    async def __call__(self, request):
+        self.in_flight += 1
+        self.calls += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(0.01)
+            if self.fail_first:
+                self.fail_first -= 1
+                raise self.error
+            self.parts[request.file_part] = request.bytes
+            return True
+        finally:
+            self.in_flight -= 1
+
+
+class TestValidPartSize:
+    """Tests for valid_part_size_kb"""
+
+    def test_valid_sizes(self):
+        assert valid_part_size_kb(512) == 512
+        assert valid_part_size_kb(128) == 128
+
+    def test_invalid_size_falls_back(self):
+        assert valid_part_size_kb(300) == 512
+        assert valid_part_size_kb(0) == 512
+
+    def test_part_size_grows_to_fit_part_limit(self):
+        """Test that a small part size is raised for a big file"""
+        mb = 1024 * 1024
+        assert part_size_for(100 * mb, 128) == 128
+        # 1500MB is 12000 parts of 128KB, 3000 of 512KB
+        assert part_size_for(1500 * mb, 128) == 512
+        assert part_size_for(1500 * mb, 512) == 512
+
+    def test_too_big_for_part_limit(self):
+        with pytest.raises(ValueError):
+            part_size_for(2001 * 1024 * 1024, 512)
+
+
+class TestParallelUpload:
+    """Tests for parallel_upload"""
+
+    @pytest.mark.asyncio
+    async def test_small_file_parts_reassemble(self, tmp_path):
+        """Test that every part is sent once and reassembles to the file"""
+        data = bytes(range(256)) * 40  # 10 KB
+        file_path = tmp_path / "episode.mp4"
+        file_path.write_bytes(data)
+        client = FakeClient()
+
+        input_file, stats = await parallel_upload(client, str(file_path), part_size_kb=1, workers=4)
+
+        assert sorted(client.parts) == list(range(10))
+        assert b''.join(client.parts[i] for i in range(10)) == data
+        assert input_file.parts == 10
+        assert input_file.md5_checksum
+        assert client.max_in_flight == 4
+        assert stats.as_dict()["bytes"] == len(data)
+
+    @pytest.mark.asyncio
+    async def test_big_file_uses_big_parts(self, tmp_path, monkeypatch):
+        """Test that files over the threshold are uploaded as big files"""
+        monkeypatch.setattr(parallelUpload, 'BIG_FILE_THRESHOLD', 1024)
+        file_path = tmp_path / "episode.mp4"
+        file_path.write_bytes(b"x" * 4096)
+        client = FakeClient()
+
+        input_file, _ = await parallel_upload(client, str(file_path), part_size_kb=1, workers=2)
+
+        assert type(input_file).__name__ == "InputFileBig"
+        assert input_file.parts == 4
+
+    @pytest.mark.asyncio
+    async def test_part_limit_is_respected(self, tmp_path, monkeypatch):
+        """Test that the parts are made larger instead of exceeding MAX_PARTS"""
+        monkeypatch.setattr(parallelUpload, "MAX_PARTS", 4)
+        data = bytes(range(256)) * 40  # 10KB
+        file_path = tmp_path / "episode.mp4"
+        file_path.write_bytes(data)
+        client = FakeClient()
+
+        input_file, _ = await parallel_upload(client, str(file_path), part_size_kb=1)
+
+        assert input_file.parts == 3
+        assert b"".join(client.parts[i] for i in range(3)) == data
+
+    @pytest.mark.asyncio
+    async def test_progress_callback(self, tmp_path):
+        """Test that progress reaches the full file size"""
+        file_path = tmp_path / "episode.mp4"
+        file_path.write_bytes(b"x" * 3000)
+        progress = []
+
+        await parallel_upload(FakeClient(), str(file_path), part_size_kb=1, workers=2,
+                              progress_callback=lambda current, total: progress.append((current, total)))
+
+        assert progress[-1] == (3000, 3000)
+
+    @pytest.mark.asyncio
+    async def test_failed_part_is_retried(self, tmp_path, monkeypatch):
+        """Test that a transient part failure is retried"""
+        monkeypatch.setattr(parallelUpload.asyncio, 'sleep', _fast_sleep)
+        file_path = tmp_path / "episode.mp4"
+        file_path.write_bytes(b"x" * 2048)
+        client = FakeClient(fail_first=1)
+
+        await parallel_upload(client, str(file_path), part_size_kb=1, workers=1)
+
+        assert sorted(client.parts) == [0, 1]
+
+    @pytest.mark.asyncio
+    async def test_flood_wait_is_not_retried(self, tmp_path, monkeypatch):
+        """Test that a FloodWait goes straight to the caller"""
+        monkeypatch.setattr(parallelUpload.asyncio, 'sleep', _fast_sleep)
+        file_path = tmp_path / "episode.mp4"
+        file_path.write_bytes(b"x" * 1024)
+        client = FakeClient(fail_first=1, error=FloodWaitError(30))
+
+        with pytest.raises(FloodWaitError) as raised:
+            await parallel_upload(client, str(file_path), part_size_kb=1, workers=1)
+
+        assert raised.value.seconds == 30
+        assert client.calls == 1
+
+    @pytest.mark.asyncio
+    async def test_permanent_error_is_not_retried(self, tmp_path, monkeypatch):
+        """Test that only transient errors are retried"""
+        monkeypatch.setattr(parallelUpload.asyncio, 'sleep', _fast_sleep)
+        file_path = tmp_path / "episode.mp4"
+        file_path.write_bytes(b"x" * 1024)
+        client = FakeClient(fail_first=1, error=ValueError("FILE_PARTS_INVALID"))
+
+        with pytest.raises(ValueError):
+            await parallel_upload(client, str(file_path), part_size_kb=1, workers=1)
+
+        assert client.calls == 1
+
+
+_real_sleep = asyncio.sleep
+
+
+async def _fast_sleep(delay):
+    await _real_sleep(min(delay, 0.01))
@@ -0,0 +1,229 @@
+"""
+Tests for the staged download/remux/upload pipeline
+"""
+import pytest
+import sys
+import asyncio
+from pathlib import Path
+
+# Add project root to path
+PROJECT_ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+
+from bot.pipeline import Pipeline, EpisodeJob, QueueFull, QuotaExceeded
+
+
+def make_job(episode_id, chat_id=987654321):
+    return EpisodeJob("Death Note", "death_note", 1, episode_id, chat_id, Path("/tmp"))
+
+
+def recording_handlers(log, delay=0.0, fail_stage=None):
+    def handler(stage):
+        async def run(job):
+            log.append(("start", stage, job.episode_id))
+            await asyncio.sleep(delay)
+            if stage == fail_stage:
+                raise RuntimeError(f"{stage} failed")
+            log.append(("end", stage, job.episode_id))
+        return run
+    return {stage: handler(stage) for stage in ("download", "remux", "upload")}
+
+
+class TestEpisodeJob:
+    """Tests for EpisodeJob"""
+
+    def test_object_id(self):
+        assert make_job(3).object_id == "death_note-s1-e3"
+
+
+class TestPipelineInline:
+    """Tests for running stages inline when the pipeline is not started"""
+
+    @pytest.mark.asyncio
+    async def test_runs_all_stages_in_order(self):
+        log = []
+        pipeline = Pipeline(recording_handlers(log))
+
+        job = await pipeline.submit(make_job(1))
+
+        assert [entry[1] for entry in log if entry[0] == "end"] == ["download", "remux", "upload"]
+        assert set(job.stage_seconds) == {"download", "remux", "upload"}
+
+    @pytest.mark.asyncio
+    async def test_start_stage(self):
+        log = []
+        pipeline = Pipeline(recording_handlers(log))
+
+        await pipeline.submit(make_job(1), start_stage="upload")
+
+        assert [entry[1] for entry in log] == ["upload", "upload"]
+
+
+class TestPipelineWorkers:
+    """Tests for the started worker pool"""
+
+    @pytest.mark.asyncio
+    async def test_stages_overlap(self):
+        """Test that one episode downloads while another one uploads"""
+        log = []
+        pipeline = Pipeline(recording_handlers(log, delay=0.05),
+                            concurrency={"download": 1, "remux": 1, "upload": 1})
+        pipeline.start()
+        try:
+            await asyncio.gather(*(pipeline.submit(make_job(i, chat_id=i)) for i in range(1, 4)))
+        finally:
+            await pipeline.stop()
+
+        # episode 3 started downloading before episode 1 finished uploading
+        assert log.index(("start", "download", 3)) < log.index(("end", "upload", 1))
+        assert len([entry for entry in log if entry[0] == "end"]) == 9
+
+    @pytest.mark.asyncio
+    async def test_stage_concurrency_limit(self):
+        """Test that a stage never runs more jobs than its worker count"""
+        running = []
+        peak = []
+
+        async def download(job):
+            running.append(job)
+            peak.append(len(running))
+            await asyncio.sleep(0.02)
+            running.remove(job)
+
+        async def noop(job):
+            pass
+
+        pipeline = Pipeline({"download": download, "remux": noop, "upload": noop},
+                            concurrency={"download": 2})
+        pipeline.start()
+        try:
+            await asyncio.gather(*(pipeline.submit(make_job(i, chat_id=i)) for i in range(6)))
+        finally:
+            await pipeline.stop()
+
+        assert max(peak) == 2
+
+    @pytest.mark.asyncio
+    async def test_batch_takes_a_download_worker(self):
+        """Test that a batch download waits for a free download worker"""
+        log = []
+        stages = []
+
+        async def on_stage(job, stage):
+            stages.append((job.episode_id, stage))
+
+        async def batch():
+            log.append(("start", "batch"))
+
+        pipeline = Pipeline(recording_handlers(log, delay=0.05),
+                            concurrency={"download": 1}, on_stage=on_stage)
+        pipeline.start()
+        try:
+            submitted = asyncio.ensure_future(pipeline.submit(make_job(1)))
+            await asyncio.sleep(0.01)
+            await pipeline.run_batch("download", [make_job(2), make_job(3)], batch)
+            await submitted
+        finally:
+            await pipeline.stop()
+
+        assert log.index(("end", "download", 1)) < log.index(("start", "batch"))
+        assert (2, "download") in stages and (3, "download") in stages
+
+    @pytest.mark.asyncio
+    async def test_failure_propagates_to_submitter(self):
+        log = []
+        pipeline = Pipeline(recording_handlers(log, fail_stage="remux"))
+        pipeline.start()
+        try:
+            with pytest.raises(RuntimeError, match="remux failed"):
+                await pipeline.submit(make_job(1))
+        finally:
+            await pipeline.stop()
+
+        assert ("start", "upload", 1) not in log
+
+    @pytest.mark.asyncio
+    async def test_depth(self):
+        pipeline = Pipeline(recording_handlers([]))
+        pipeline.start()
+        try:
+            assert pipeline.depth() == {"download": 0, "remux": 0, "upload": 0}
+        finally:
+            await pipeline.stop()
+        assert not pipeline.running
+
+
+class TestAdmission:
+    """Tests for admission control"""
+
+    def test_position_and_eta(self):
+        pipeline = Pipeline(recording_handlers([]), concurrency={"download": 2})
+
+        assert pipeline.admit(make_job(1, chat_id=1)) == (1, 120)
+        assert pipeline.admit(make_job(2, chat_id=2)) == (2, 120)
+        assert pipeline.admit(make_job(3, chat_id=3)) == (3, 240)
+        assert pipeline.pending() == 3
+
+    def test_queue_full(self):
+        pipeline = Pipeline(recording_handlers([]), max_pending=2)
+        pipeline.admit(make_job(1, chat_id=1))
+
+        with pytest.raises(QueueFull):
+            pipeline.admit(make_job(2, chat_id=2), make_job(3, chat_id=2))
+        assert pipeline.pending() == 1
+
+    def test_chat_quota(self):
+        """Test that a range counts as one request against the quota"""
+        pipeline = Pipeline(recording_handlers([]), chat_quota=2)
+        pipeline.admit(make_job(1), make_job(2), make_job(3))
+        pipeline.admit(make_job(4))
+
+        with pytest.raises(QuotaExceeded):
+            pipeline.admit(make_job(5))
+        # other chats are not affected
+        pipeline.admit(make_job(5, chat_id=42))
+
+    def test_admit_without_quota(self):
+        """Test that quota=False admits past the chat quota, but not past max_pending"""
+        pipeline = Pipeline(recording_handlers([]), max_pending=3, chat_quota=1)
+        pipeline.admit(make_job(1))
+
+        pipeline.admit(make_job(2), quota=False)
+        pipeline.admit(make_job(3), quota=False)
+        with pytest.raises(QueueFull):
+            pipeline.admit(make_job(4), quota=False)
+
+    def test_release_frees_quota(self):
+        pipeline = Pipeline(recording_handlers([]), chat_quota=1)
+        first, second = make_job(1), make_job(2)
+        pipeline.admit(first, second)
+
+        pipeline.release(first)
+        with pytest.raises(QuotaExceeded):
+            pipeline.admit(make_job(3))
+        pipeline.release(second)
+        pipeline.release(second)
+
+        pipeline.admit(make_job(3))
+        assert pipeline.pending() == 1
+
+    @pytest.mark.asyncio
+    async def test_submit_releases_and_learns_eta(self):
+        pipeline = Pipeline(recording_handlers([]), chat_quota=1)
+
+        await pipeline.submit(make_job(1))
+
+        assert pipeline.pending() == 0
+        # the finished job's duration replaces the default estimate
+        assert pipeline.eta(1) < 120
+        await pipeline.submit(make_job(2))
+
+    @pytest.mark.asyncio
+    async def test_failed_submit_releases(self):
+        pipeline = Pipeline(recording_handlers([], fail_stage="download"), chat_quota=1)
+
+        with pytest.raises(RuntimeError):
+            await pipeline.submit(make_job(1))
+
+        assert pipeline.pending() == 0
+        assert pipeline.eta(1) == 120
@@ -0,0 +1,122 @@
+"""
+Tests for the popularity driven pre-fetcher
+"""
+import pytest
+import sys
+from datetime import datetime, timedelta
+from pathlib import Path
+
+# Add project root to path
+PROJECT_ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+
+from bot.prefetcher import Prefetcher, query_rate, DEFAULT_WINDOW_HOURS, NEXT_SEASON_WEIGHT
+
+
+NOW = datetime(2024, 1, 10, 12, 0, 0)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def day(hours_ago):
+    return (NOW - timedelta(hours=hours_ago)).date().isoformat()
+
+
+def make_doc(series_key, season_id, episode_id, times_queried, hours_ago=10):
+    return {
+        "series_name": series_key.replace("_", " ").title(),
+        "series_key": series_key,
+        "season_id": season_id,
+        "episode_id": episode_id,
+        "times_queried": times_queried,
+        "daily_queries": {day(hours_ago): times_queried},
+        "date_added": NOW - timedelta(hours=hours_ago),
+    }
+
+
+class TestQueryRate:
+    """Tests for query_rate"""
+
+    def test_rate_per_hour(self):
+        assert query_rate(make_doc("death_note", 1, 3, 144), NOW, window_hours=72) == 2
+
+    def test_old_queries_are_left_out(self):
+        """Test that only queries within the window count, whatever the lifetime total"""
+        doc = make_doc("death_note", 1, 3, 24, hours_ago=2)
+        doc["daily_queries"][day(24 * 30)] = 5000
+        doc["times_queried"] = 5024
+
+        assert query_rate(doc, NOW, window_hours=24) == 1
+
+    def test_missing_counts(self):
+        assert query_rate({"times_queried": 4}, NOW) == 0
+
+
+class TestPrefetcher:
+    """Tests for Prefetcher"""
+
+    def test_predicts_next_episode(self):
+        candidates = Prefetcher().candidates([make_doc("death_note", 1, 3, 20)], now=NOW)
+
+        assert candidates[0].object_id == "death_note-s1-e4"
+        assert candidates[0].series_name == "Death Note"
+
+    def test_predicts_next_season(self):
+        candidates = Prefetcher().candidates([make_doc("death_note", 1, 3, 20)], now=NOW)
+
+        next_season = [c for c in candidates if c.season_id == 2]
+        assert next_season[0].object_id == "death_note-s2-e1"
+        assert next_season[0].score == pytest.approx(20 / DEFAULT_WINDOW_HOURS * NEXT_SEASON_WEIGHT)
+
+    def test_ranked_by_query_rate(self):
+        documents = [
+            make_doc("death_note", 1, 3, 5),
+            make_doc("one_piece", 1, 100, 50),
+        ]
+        candidates = Prefetcher().candidates(documents, now=NOW)
+
+        assert candidates[0].object_id == "one_piece-s1-e101"
+
+    def test_known_episodes_are_skipped(self):
+        documents = [
+            make_doc("death_note", 1, 3, 20),
+            make_doc("death_note", 1, 4, 1),
+        ]
+        object_ids = [c.object_id for c in Prefetcher().candidates(documents, now=NOW)]
+
+        assert "death_note-s1-e4" not in object_ids
+        assert "death_note-s1-e5" in object_ids
+
+    def test_next_season_only_after_latest_season(self):
+        documents = [
+            make_doc("death_note", 1, 3, 20),
+            make_doc("death_note", 2, 1, 20),
+        ]
+        object_ids = [c.object_id for c in Prefetcher().candidates(documents, now=NOW)]
+
+        assert "death_note-s2-e1" not in object_ids
+        assert "death_note-s3-e1" in object_ids
+
+    def test_unqueried_and_movies_are_ignored(self):
+        documents = [
+            make_doc("death_note", 1, 3, 0),
+            make_doc("your_name", 0, -1, 20),
+        ]
+        assert Prefetcher().candidates(documents, now=NOW) == []
+
+    def test_cooldown(self):
+        clock = FakeClock()
+        prefetcher = Prefetcher(cooldown=60, clock=clock)
+
+        assert prefetcher.should_try("death_note-s1-e4")
+        prefetcher.mark_attempt("death_note-s1-e4")
+        assert not prefetcher.should_try("death_note-s1-e4")
+
+        clock.now = 61
+        assert prefetcher.should_try("death_note-s1-e4")
@@ -0,0 +1,164 @@
+"""
+Tests for the FloodWait aware token bucket rate limiter
+"""
+import pytest
+import sys
+from datetime import timedelta
+from pathlib import Path
+from unittest.mock import AsyncMock
+
+# Add project root to path
+PROJECT_ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+
+from bot.rateLimiter import TokenBucket, RateLimiter, retry_after_seconds
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    async def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class RetryAfter(Exception):
+    def __init__(self, retry_after):
+        super().__init__(f"Flood control exceeded. Retry in {retry_after} seconds")
+        self.retry_after = retry_after
+
+
+def make_limiter(clock, **kwargs):
+    return RateLimiter(clock=clock, sleep=clock.sleep, **kwargs)
+
+
+class TestRetryAfterSeconds:
+    """Tests for retry_after_seconds"""
+
+    def test_telegram_retry_after(self):
+        assert retry_after_seconds(RetryAfter(12)) == 12.0
+
+    def test_timedelta_retry_after(self):
+        assert retry_after_seconds(RetryAfter(timedelta(seconds=5))) == 5.0
+
+    def test_telethon_flood_wait(self):
+        error = Exception("A wait of 30 seconds is required")
+        error.seconds = 30
+        assert retry_after_seconds(error) == 30.0
+
+    def test_other_errors(self):
+        assert retry_after_seconds(ValueError("boom")) is None
+
+
+class TestTokenBucket:
+    """Tests for TokenBucket"""
+
+    def test_burst_then_rate(self):
+        clock = FakeClock()
+        bucket = TokenBucket(rate=2, capacity=2, clock=clock)
+
+        assert [bucket.reserve() for _ in range(4)] == [0, 0, 0.5, 1.0]
+
+    def test_refills(self):
+        clock = FakeClock()
+        bucket = TokenBucket(rate=1, capacity=1, clock=clock)
+        bucket.reserve()
+
+        clock.now = 5
+        assert bucket.reserve() == 0
+        assert bucket.idle() is False
+
+    def test_pause(self):
+        clock = FakeClock()
+        bucket = TokenBucket(rate=1, capacity=5, clock=clock)
+
+        bucket.pause(10)
+
+        assert bucket.reserve() == 11
+        clock.now = 20
+        assert bucket.reserve() == 0
+
+
+class TestRateLimiter:
+    """Tests for RateLimiter"""
+
+    @pytest.mark.asyncio
+    async def test_per_chat_limit(self):
+        """Test that a burst to one chat is spread out, other chats are not held up"""
+        clock = FakeClock()
+        limiter = make_limiter(clock, chat_rate=1, chat_burst=1)
+
+        assert await limiter.acquire(1) == 0
+        assert await limiter.acquire(1) == 1
+        assert await limiter.acquire(2) == 0
+        assert limiter.stats()["delayed"] == 1
+
+    @pytest.mark.asyncio
+    async def test_global_limit(self):
+        clock = FakeClock()
+        limiter = make_limiter(clock, global_rate=2, chat_burst=10)
+
+        waits = [await limiter.acquire(chat_id) for chat_id in range(3)]
+
+        assert waits == [0, 0, 0.5]
+
+    @pytest.mark.asyncio
+    async def test_flood_wait_is_waited_out_and_retried(self):
+        clock = FakeClock()
+        limiter = make_limiter(clock)
+        send = AsyncMock(side_effect=[RetryAfter(7), "sent"])
+
+        result = await limiter.run(42, send, chat_id=42, text="hi")
+
+        assert result == "sent"
+        assert send.call_count == 2
+        assert clock.now >= 7
+        assert limiter.stats()["flood_waits"] == 1
+
+    @pytest.mark.asyncio
+    async def test_flood_wait_only_holds_its_chat(self):
+        clock = FakeClock()
+        limiter = make_limiter(clock)
+
+        limiter.flood_wait(60, chat_id=42)
+
+        assert await limiter.acquire(7) == 0
+
+    @pytest.mark.asyncio
+    async def test_gives_up_after_max_retries(self):
+        clock = FakeClock()
+        limiter = make_limiter(clock, max_retries=2)
+        send = AsyncMock(side_effect=RetryAfter(1))
+
+        with pytest.raises(RetryAfter):
+            await limiter.run(42, send)
+
+        assert send.call_count == 3
+
+    @pytest.mark.asyncio
+    async def test_long_flood_wait_raised(self):
+        """Test that FloodWaits over max_flood_wait are left to the caller"""
+        clock = FakeClock()
+        limiter = make_limiter(clock, max_flood_wait=30)
+        send = AsyncMock(side_effect=RetryAfter(300))
+
+        with pytest.raises(RetryAfter):
+            await limiter.run(42, send)
+
+        assert send.call_count == 1
+
+    @pytest.mark.asyncio
+    async def test_other_errors_are_not_retried(self):
+        limiter = make_limiter(FakeClock())
+        send = AsyncMock(side_effect=ValueError("bad request"))
+
+        with pytest.raises(ValueError):
+            await limiter.run(42, send)
+
+        assert send.call_count == 1
+
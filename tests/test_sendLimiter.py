@@ -0,0 +1,94 @@
+"""
+Tests for pacing the uploader agents' messages to the bot
+"""
+import pytest
+import sys
+from pathlib import Path
+from unittest.mock import AsyncMock
+
+# Add project root to path
+PROJECT_ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+
+from telethon.errors import FloodWaitError
+from uploaderService.sendLimiter import SendLimiter
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    async def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+def make_limiter(clock, **kwargs):
+    return SendLimiter(clock=clock, sleep=clock.sleep, **kwargs)
+
+
+class TestSendLimiter:
+    """Tests for SendLimiter"""
+
+    @pytest.mark.asyncio
+    async def test_spaces_an_agents_sends(self):
+        """Test that one agent's sends go out 1 / rate seconds apart"""
+        clock = FakeClock()
+        limiter = make_limiter(clock, rate=2.0)
+
+        for _ in range(3):
+            await limiter.acquire("agent0")
+
+        assert clock.sleeps == [0.5, 0.5]
+        assert limiter.stats()["delayed"] == 2
+
+    @pytest.mark.asyncio
+    async def test_agents_are_paced_separately(self):
+        clock = FakeClock()
+        limiter = make_limiter(clock, rate=1.0)
+
+        await limiter.acquire("agent0")
+        await limiter.acquire("agent1")
+
+        assert clock.sleeps == []
+
+    @pytest.mark.asyncio
+    async def test_flood_wait_is_waited_out(self):
+        """Test that a short FloodWait holds the agent back and retries"""
+        clock = FakeClock()
+        limiter = make_limiter(clock, max_flood_wait=60)
+        send = AsyncMock(side_effect=[FloodWaitError(30), "sent"])
+
+        assert await limiter.run("agent0", send, "bot") == "sent"
+
+        assert clock.sleeps == [30]
+        assert send.await_count == 2
+        assert limiter.stats()["flood_waits"] == 1
+
+    @pytest.mark.asyncio
+    async def test_long_flood_wait_is_raised(self):
+        """Test that a FloodWait over max_flood_wait is left to the caller"""
+        clock = FakeClock()
+        limiter = make_limiter(clock, max_flood_wait=60)
+        send = AsyncMock(side_effect=FloodWaitError(600))
+
+        with pytest.raises(FloodWaitError):
+            await limiter.run("agent0", send, "bot")
+
+        assert send.await_count == 1
+        assert clock.sleeps == []
+
+    @pytest.mark.asyncio
+    async def test_other_errors_are_not_retried(self):
+        clock = FakeClock()
+        limiter = make_limiter(clock)
+        send = AsyncMock(side_effect=ValueError("boom"))
+
+        with pytest.raises(ValueError):
+            await limiter.run("agent0", send, "bot")
+
+        assert send.await_count == 1
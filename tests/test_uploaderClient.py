@@ -0,0 +1,114 @@
+"""
+Tests for the uploader daemon client
+"""
+import pytest
+import sys
+import asyncio
+import json
+import socket
+import struct
+from pathlib import Path
+
+# Add project root to path
+PROJECT_ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+
+from bot.uploaderClient import upload_via_daemon, parse_address, UploadError
+
+
+async def start_fake_daemon(events):
+    """Start a local server that answers every request with the given events"""
+    requests = []
+
+    async def handle(reader, writer):
+        requests.append(json.loads(await reader.readline()))
+        for event in events:
+            writer.write((json.dumps(event) + '\n').encode())
+        await writer.drain()
+        writer.close()
+
+    server = await asyncio.start_server(handle, '127.0.0.1', 0)
+    port = server.sockets[0].getsockname()[1]
+    return server, f'127.0.0.1:{port}', requests
+
+
+class TestParseAddress:
+    """Tests for parse_address"""
+
+    def test_parse_host_and_port(self):
+        assert parse_address("127.0.0.1:8765") == ("127.0.0.1", 8765)
+
+    def test_parse_port_only(self):
+        assert parse_address(":9000") == ("127.0.0.1", 9000)
+
+
+class TestUploadViaDaemon:
+    """Tests for upload_via_daemon"""
+
+    @pytest.mark.asyncio
+    async def test_upload_done(self):
+        """Test a successful upload with progress events"""
+        server, address, requests = await start_fake_daemon([
+            {"event": "progress", "object_id": "death_note-s1-e3", "current": 50, "total": 100},
+            {"event": "done", "object_id": "death_note-s1-e3", "bytes": 100, "seconds": 0.5},
+        ])
+        progress = []
+        async with server:
+            result = await upload_via_daemon(
+                address, "/tmp/episode.mp4", 987654321, "death_note-s1-e3",
+                on_progress=lambda current, total: progress.append((current, total))
+            )
+
+        assert result["event"] == "done"
+        assert progress == [(50, 100)]
+        assert requests == [{
+            "op": "upload",
+            "file_path": "/tmp/episode.mp4",
+            "chat_id": 987654321,
+            "object_id": "death_note-s1-e3"
+        }]
+
+    @pytest.mark.asyncio
+    async def test_upload_error_event(self):
+        """Test that an error event raises UploadError"""
+        server, address, _ = await start_fake_daemon([
+            {"event": "error", "object_id": "death_note-s1-e3", "error": "FloodWait"},
+        ])
+        async with server:
+            with pytest.raises(UploadError, match="FloodWait"):
+                await upload_via_daemon(address, "/tmp/episode.mp4", 1, "death_note-s1-e3")
+
+    @pytest.mark.asyncio
+    async def test_connection_closed_midway(self):
+        """Test that a dropped connection raises UploadError"""
+        server, address, _ = await start_fake_daemon([])
+        async with server:
+            with pytest.raises(UploadError):
+                await upload_via_daemon(address, "/tmp/episode.mp4", 1, "death_note-s1-e3")
+
+    @pytest.mark.asyncio
+    async def test_connection_reset_after_handover(self):
+        """Test that a reset once the job was sent is an UploadError, not OSError"""
+        async def handle(reader, writer):
+            await reader.readline()
+            # close with a RST instead of a FIN
+            writer.get_extra_info('socket').setsockopt(
+                socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0)
+            )
+            writer.transport.abort()
+
+        server = await asyncio.start_server(handle, '127.0.0.1', 0)
+        address = f'127.0.0.1:{server.sockets[0].getsockname()[1]}'
+        async with server:
+            with pytest.raises(UploadError, match="Lost the uploader daemon"):
+                await upload_via_daemon(address, "/tmp/episode.mp4", 1, "death_note-s1-e3")
+
+    @pytest.mark.asyncio
+    async def test_daemon_not_running(self):
+        """Test that an unreachable daemon raises OSError"""
+        server, address, _ = await start_fake_daemon([])
+        server.close()
+        await server.wait_closed()
+
+        with pytest.raises(OSError):
+            await upload_via_daemon(address, "/tmp/episode.mp4", 1, "death_note-s1-e3")
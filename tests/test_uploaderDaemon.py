@@ -0,0 +1,193 @@
+"""
+Tests for the long running uploader daemon
+"""
+import pytest
+import sys
+import json
+import asyncio
+import importlib
+from pathlib import Path
+from types import ModuleType
+from unittest.mock import AsyncMock, MagicMock, patch
+
+# Add project root to path
+PROJECT_ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+# The daemon imports its siblings the way it is run, as flat modules
+sys.path.insert(0, str(PROJECT_ROOT / "uploaderService"))
+
+from telethon.errors import FloodWaitError
+
+# uploaderService/main.py reads the agent accounts from config at import,
+# so the daemon gets a stand in with no accounts configured
+main_mock = ModuleType('main')
+main_mock.configdata = {}
+main_mock.bot_name = 'test_bot'
+main_mock.agents = []
+main_mock.connect_client = AsyncMock()
+main_mock.sendVideo = AsyncMock()
+main_mock.resolve_file_path = lambda file_path: Path(file_path)
+main_mock.send_limiter = MagicMock()
+main_mock.send_limiter.stats.return_value = {}
+with patch.dict(sys.modules, {'main': main_mock}):
+    daemon = importlib.import_module('uploaderService.daemon')
+
+UploadDaemon = daemon.UploadDaemon
+
+
+class FakeClient:
+    """A connected agent client"""
+
+    def __init__(self):
+        self.connect = AsyncMock()
+
+    def is_connected(self):
+        return True
+
+
+class FakeWriter:
+    """Collects the events the daemon sends back"""
+
+    def __init__(self):
+        self.events = []
+
+    def write(self, data):
+        self.events.append(json.loads(data))
+
+    def is_closing(self):
+        return False
+
+
+def make_daemon(count=2):
+    upload_daemon = UploadDaemon(agent_configs=[{'entity': f'agent{i}'} for i in range(count)])
+    for agent in upload_daemon.pool.agents:
+        agent.client = FakeClient()
+    return upload_daemon
+
+
+def upload_request(file_path):
+    return {'op': 'upload', 'file_path': str(file_path), 'chat_id': 42,
+            'object_id': 'death_note-s1-e1'}
+
+
+UPLOADED = {'bytes': 4096, 'mb_per_s': 1.0}
+
+
+class TestUpload:
+    """Tests for UploadDaemon.upload"""
+
+    @pytest.mark.asyncio
+    async def test_upload_counts_bytes(self, tmp_path):
+        """Test that an upload is counted for the daemon and its agent"""
+        upload_daemon = make_daemon(count=1)
+        writer = FakeWriter()
+
+        with patch.object(daemon, 'sendVideo', new_callable=AsyncMock, return_value=UPLOADED):
+            await upload_daemon.upload(upload_request(tmp_path / "episode.mp4"), writer)
+
+        agent = upload_daemon.pool.agents[0]
+        assert writer.events[-1]['event'] == 'done'
+        assert writer.events[-1]['bytes'] == 4096
+        assert upload_daemon.uploads == 1
+        assert upload_daemon.bytes_uploaded == 4096
+        assert agent.uploads == 1 and agent.bytes_uploaded == 4096
+        stats = upload_daemon.stats()
+        assert stats['uploads'] == 1 and stats['failed'] == 0 and stats['bytes'] == 4096
+
+    @pytest.mark.asyncio
+    async def test_flood_wait_moves_upload_to_another_agent(self, tmp_path):
+        """Test that an agent in a FloodWait is parked and the next one uploads"""
+        upload_daemon = make_daemon()
+        first, second = upload_daemon.pool.agents
+        writer = FakeWriter()
+
+        async def send_video(client, *args, **kwargs):
+            if client is first.client:
+                raise FloodWaitError(30)
+            return UPLOADED
+
+        with patch.object(daemon, 'sendVideo', side_effect=send_video):
+            await upload_daemon.upload(upload_request(tmp_path / "episode.mp4"), writer)
+
+        assert writer.events[-1]['event'] == 'done'
+        assert first.flood_until > 0 and first.failed == 0
+        assert second.uploads == 1
+        assert upload_daemon.failed == 0
+
+    @pytest.mark.asyncio
+    async def test_every_agent_in_flood_wait_fails_upload(self, tmp_path):
+        """Test that the upload fails once every agent had its try"""
+        upload_daemon = make_daemon()
+        writer = FakeWriter()
+
+        with patch.object(daemon, 'sendVideo', new_callable=AsyncMock,
+                          side_effect=FloodWaitError(30)) as mock_send:
+            await upload_daemon.upload(upload_request(tmp_path / "episode.mp4"), writer)
+
+        assert mock_send.await_count == 2
+        assert writer.events[-1]['event'] == 'error'
+        assert upload_daemon.failed == 1
+        assert all(agent.flood_until > 0 for agent in upload_daemon.pool.agents)
+
+    @pytest.mark.asyncio
+    async def test_bad_path_is_not_blamed_on_an_agent(self, tmp_path):
+        """Test that a missing file fails the upload before an agent is picked"""
+        upload_daemon = make_daemon()
+        writer = FakeWriter()
+
+        def missing(file_path):
+            raise FileNotFoundError(f'File not found: {file_path}')
+
+        with patch.object(daemon, 'resolve_file_path', side_effect=missing), \
+             patch.object(daemon, 'sendVideo', new_callable=AsyncMock) as mock_send:
+            await upload_daemon.upload(upload_request(tmp_path / "missing.mp4"), writer)
+
+        mock_send.assert_not_called()
+        assert writer.events[-1]['event'] == 'error'
+        assert 'File not found' in writer.events[-1]['error']
+        assert upload_daemon.failed == 1
+        assert all(agent.failed == 0 for agent in upload_daemon.pool.agents)
+
+
+class TestHandleConnection:
+    """Tests for the daemon's socket protocol"""
+
+    @pytest.mark.asyncio
+    async def test_upload_and_stats_over_socket(self, tmp_path):
+        """Test that a client gets progress and done events, then the stats"""
+        upload_daemon = make_daemon(count=1)
+
+        async def send_video(client, bot_name, file_path, chat_id, object_id,
+                             progress_callback=None):
+            await progress_callback(4096, 4096)
+            return UPLOADED
+
+        server = await asyncio.start_server(upload_daemon.handle_connection, '127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+        worker = asyncio.create_task(upload_daemon.worker())
+        try:
+            with patch.object(daemon, 'sendVideo', side_effect=send_video):
+                reader, writer = await asyncio.open_connection('127.0.0.1', port)
+                writer.write(daemon.encode_event(upload_request(tmp_path / "episode.mp4")))
+                await writer.drain()
+                progress = json.loads(await reader.readline())
+                done = json.loads(await reader.readline())
+
+                writer.write(daemon.encode_event({'op': 'stats'}))
+                await writer.drain()
+                stats = json.loads(await reader.readline())
+
+                writer.write(daemon.encode_event({'op': 'bogus'}))
+                await writer.drain()
+                unknown = json.loads(await reader.readline())
+                writer.close()
+        finally:
+            worker.cancel()
+            server.close()
+            await server.wait_closed()
+
+        assert progress['event'] == 'progress' and progress['current'] == 4096
+        assert done['event'] == 'done' and done['object_id'] == 'death_note-s1-e1'
+        assert stats['event'] == 'stats' and stats['uploads'] == 1
+        assert stats['agents'][0]['uploads'] == 1
+        assert unknown == {'event': 'error', 'error': 'unknown op: bogus'}
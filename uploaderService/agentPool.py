@@ -0,0 +1,93 @@
+'''
+Spreads uploads over several agent accounts.
+
+Each agent runs at most max_active uploads at a time. acquire() hands out
+the least loaded agent that is not sitting out a FloodWait, and waits when
+every agent is busy or flood-waited.
+'''
+import asyncio
+import time
+
+
+class Agent:
+    def __init__(self, name, config=None):
+        self.name = name
+        self.config = config
+        self.client = None
+        self.active = 0
+        self.flood_until = 0.0
+        self.uploads = 0
+        self.failed = 0
+        self.bytes_uploaded = 0
+
+    def __repr__(self):
+        return f'<Agent {self.name} active={self.active}>'
+
+
+class AgentPool:
+    def __init__(self, agents, max_active=1, clock=time.monotonic):
+        if not agents:
+            raise ValueError('AgentPool needs at least one agent')
+        self.agents = list(agents)
+        self.max_active = max_active
+        self.clock = clock
+        self._condition = asyncio.Condition()
+
+    @property
+    def capacity(self):
+        return len(self.agents) * self.max_active
+
+    def pick(self):
+        """The least loaded agent that can take an upload now, or None"""
+        now = self.clock()
+        ready = [
+            agent for agent in self.agents
+            if agent.active < self.max_active and agent.flood_until <= now
+        ]
+        if not ready:
+            return None
+        return min(ready, key=lambda agent: (agent.active, agent.uploads))
+
+    def _next_flood_end(self):
+        """Seconds until the next idle, flood-waited agent is usable again"""
+        now = self.clock()
+        waits = [
+            agent.flood_until - now for agent in self.agents
+            if agent.active < self.max_active and agent.flood_until > now
+        ]
+        return min(waits) if waits else None
+
+    async def acquire(self):
+        async with self._condition:
+            while True:
+                agent = self.pick()
+                if agent:
+                    agent.active += 1
+                    return agent
+                try:
+                    await asyncio.wait_for(self._condition.wait(), self._next_flood_end())
+                except asyncio.TimeoutError:
+                    pass
+
+    async def release(self, agent):
+        async with self._condition:
+            agent.active -= 1
+            self._condition.notify_all()
+
+    def flood_wait(self, agent, seconds):
+        """Keep agent out of rotation for seconds (a Telegram FloodWait)"""
+        agent.flood_until = max(agent.flood_until, self.clock() + seconds)
+
+    def stats(self):
+        now = self.clock()
+        return [
+            {
+                'agent': agent.name,
+                'active': agent.active,
+                'uploads': agent.uploads,
+                'failed': agent.failed,
+                'bytes': agent.bytes_uploaded,
+                'flood_wait': round(max(agent.flood_until - now, 0.0), 1),
+            }
+            for agent in self.agents
+        ]
@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+
+'''
+Long running uploader agent.
+
+Instead of spawning uploaderService/main.py per episode (a fresh process,
+config read and MTProto handshake every time), the daemon keeps an
+authorized TelegramClient connected for every configured agent account and
+accepts upload jobs over a local TCP socket. Each upload goes to the least
+loaded agent that is not in a FloodWait.
+
+The protocol is newline delimited JSON. A request is one of
+
+    {"op": "upload", "file_path": "...", "chat_id": 123, "object_id": "..."}
+    {"op": "stats"}
+
+and the daemon answers an upload with any number of progress events
+followed by exactly one done or error event:
+
+    {"event": "progress", "object_id": "...", "current": 1024, "total": 4096}
+    {"event": "done", "object_id": "...", "bytes": 4096, "seconds": 1.5}
+    {"event": "error", "object_id": "...", "error": "..."}
+'''
+import asyncio
+import json
+import logging
+import sys
+import time
+
+from telethon.errors import FloodWaitError
+
+from agentPool import Agent, AgentPool
+from main import (
+    configdata, bot_name, agents, connect_client, sendVideo, resolve_file_path,
+    send_limiter
+)
+
+logger = logging.getLogger(__name__)
+
+DAEMON_HOST = configdata.get('daemon_host', '127.0.0.1')
+DAEMON_PORT = int(configdata.get('daemon_port', 8765))
+# Uploads each agent account runs at the same time
+AGENT_CONCURRENCY = int(configdata.get('agent_concurrency', 1))
+
+# Only report progress every PROGRESS_STEP of the file to keep the socket quiet
+PROGRESS_STEP = 0.05
+
+
+def encode_event(event):
+    return (json.dumps(event) + '\n').encode()
+
+
+class UploadDaemon:
+    def __init__(self, host=DAEMON_HOST, port=DAEMON_PORT, agent_configs=None,
+                 agent_concurrency=AGENT_CONCURRENCY):
+        self.host = host
+        self.port = port
+        self.pool = AgentPool(
+            [Agent(agent['entity'], agent) for agent in (agent_configs or agents)],
+            max_active=agent_concurrency
+        )
+        self.queue = asyncio.Queue()
+        self.started = time.monotonic()
+        self.uploads = 0
+        self.failed = 0
+        self.bytes_uploaded = 0
+        self.upload_seconds = 0.0
+
+    async def serve_forever(self):
+        for agent in self.pool.agents:
+            agent.client = await connect_client(agent.config)
+            logger.info(f'Agent {agent.name} connected')
+        workers = [asyncio.create_task(self.worker()) for _ in range(self.pool.capacity)]
+        server = await asyncio.start_server(self.handle_connection, self.host, self.port)
+        logger.info(f'Uploader daemon listening on {self.host}:{self.port} '
+                    f'with {len(self.pool.agents)} agents')
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            for worker in workers:
+                worker.cancel()
+            for agent in self.pool.agents:
+                await agent.client.disconnect()
+
+    def stats(self):
+        uptime = time.monotonic() - self.started
+        return {
+            'event': 'stats',
+            'uptime': round(uptime, 1),
+            'queued': self.queue.qsize(),
+            'uploads': self.uploads,
+            'failed': self.failed,
+            'bytes': self.bytes_uploaded,
+            'upload_seconds': round(self.upload_seconds, 1),
+            'mb_per_s': round(self.bytes_uploaded / (1024 * 1024) / self.upload_seconds, 2)
+            if self.upload_seconds else 0.0,
+            'uploads_per_hour': round(self.uploads / uptime * 3600, 2) if uptime else 0.0,
+            'agents': self.pool.stats(),
+            'rate_limiter': send_limiter.stats(),
+        }
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                except json.JSONDecodeError:
+                    writer.write(encode_event({'event': 'error', 'error': 'invalid json'}))
+                    continue
+
+                op = request.get('op')
+                if op == 'upload':
+                    done = asyncio.get_running_loop().create_future()
+                    await self.queue.put((request, writer, done))
+                    await done
+                elif op == 'stats':
+                    writer.write(encode_event(self.stats()))
+                else:
+                    writer.write(encode_event({'event': 'error', 'error': f'unknown op: {op}'}))
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def worker(self):
+        while True:
+            request, writer, done = await self.queue.get()
+            try:
+                await self.upload(request, writer)
+            finally:
+                if not done.done():
+                    done.set_result(None)
+                self.queue.task_done()
+
+    async def upload(self, request, writer):
+        object_id = request.get('object_id')
+        reported = [0.0]
+
+        def send_event(event):
+            if writer.is_closing():
+                return
+            writer.write(encode_event(event))
+
+        async def progress(current, total):
+            if total > 0 and (current / total - reported[0] >= PROGRESS_STEP or current == total):
+                reported[0] = current / total
+                logger.info(f'Uploaded {object_id}: {current / total:.2%}')
+                send_event({'event': 'progress', 'object_id': object_id,
+                            'current': current, 'total': total})
+
+        # a bad job is not the agent's fault, so it is turned away before one is picked
+        try:
+            file_path = resolve_file_path(request['file_path'])
+        except (KeyError, TypeError, OSError) as e:
+            self.failed += 1
+            logger.error(f'Not uploading {object_id}: {e}')
+            send_event({'event': 'error', 'object_id': object_id, 'error': str(e)})
+            return
+
+        started = time.monotonic()
+        upload_stats = None
+        error = None
+        # a FloodWait moves the upload to another agent, each agent gets one try
+        for _ in range(len(self.pool.agents)):
+            agent = await self.pool.acquire()
+            try:
+                if not agent.client.is_connected():
+                    logger.info(f'Agent {agent.name} disconnected, reconnecting')
+                    await agent.client.connect()
+                upload_stats = await sendVideo(agent.client, bot_name, file_path,
+                                               request['chat_id'], object_id,
+                                               progress_callback=progress)
+            except FloodWaitError as e:
+                logger.warning(f'Agent {agent.name} must wait {e.seconds}s, retrying {object_id}')
+                self.pool.flood_wait(agent, e.seconds)
+                error = e
+                continue
+            except Exception as e:
+                agent.failed += 1
+                error = e
+            finally:
+                await self.pool.release(agent)
+            break
+
+        if upload_stats is None:
+            self.failed += 1
+            logger.error(f'Upload of {object_id} failed: {error}')
+            send_event({'event': 'error', 'object_id': object_id, 'error': str(error)})
+            return
+
+        elapsed = time.monotonic() - started
+        self.uploads += 1
+        self.bytes_uploaded += upload_stats['bytes']
+        self.upload_seconds += elapsed
+        agent.uploads += 1
+        agent.bytes_uploaded += upload_stats['bytes']
+        logger.info(
+            f"Uploaded {object_id} via {agent.name}: {upload_stats['bytes']} bytes in "
+            f"{elapsed:.1f}s ({upload_stats['mb_per_s']} MB/s)"
+        )
+        send_event({'event': 'done', 'object_id': object_id,
+                    'bytes': upload_stats['bytes'], 'seconds': round(elapsed, 3),
+                    'mb_per_s': upload_stats['mb_per_s']})
+
+
+async def print_stats(host=DAEMON_HOST, port=DAEMON_PORT):
+    reader, writer = await asyncio.open_connection(host, port)
+    writer.write(encode_event({'op': 'stats'}))
+    await writer.drain()
+    print(json.dumps(json.loads(await reader.readline()), indent=2))
+    writer.close()
+
+
+if __name__ == '__main__':
+    try:
+        if len(sys.argv) > 1 and sys.argv[1] == 'stats':
+            asyncio.run(print_stats())
+        else:
+            asyncio.run(UploadDaemon().serve_forever())
+    except KeyboardInterrupt:
+        logger.info('Interrupted by user')
+
+# python uploaderService/daemon.py          -> serve
+# python uploaderService/daemon.py stats    -> print sustained upload stats
@@ -20,7 +20,11 @@ from telethon.tl.types import DocumentAttributeVideo
 import asyncio
 import json
 import logging
+import sys
+import time
 from pathlib import Path
+from parallelUpload import parallel_upload, valid_part_size_kb
+from sendLimiter import SendLimiter
 
 # Get the project root directory
 PROJECT_ROOT = Path(__file__).parent.parent
@@ -45,28 +49,55 @@ except json.JSONDecodeError as e:
     logger.error(f'Invalid JSON in config file: {e}')
     raise Exception('INVALID CONFIG FILE!')
 
-entity = configdata.get('entity')  # session name - it doesn't matter what
-api_id_raw = configdata.get('api_id')
-api_hash = configdata.get('api_hash')
-phone = configdata.get('phone')
 bot_name = configdata.get('bot_name')
+if not bot_name:
+    raise Exception('Missing required config fields: bot_name')
 
-# Coerce api_id to int (Telethon expects an integer)
-try:
-    api_id = int(api_id_raw) if api_id_raw is not None else None
-except (TypeError, ValueError):
-    api_id = None
-
-# Validate required fields
-if not all([entity, api_id, api_hash, phone, bot_name]):
-    missing = [k for k, v in {
-        'entity': entity,
-        'api_id': api_id,
-        'api_hash': api_hash,
-        'phone': phone,
-        'bot_name': bot_name
-    }.items() if not v]
-    raise Exception(f'Missing required config fields: {", ".join(missing)}')
+
+def load_agent(agent_config):
+    """
+    Validate one agent account (entity, api_id, api_hash, phone) and
+    return it with api_id coerced to int (Telethon expects an integer).
+    """
+    agent = {key: agent_config.get(key) for key in ('entity', 'api_id', 'api_hash', 'phone')}
+    try:
+        agent['api_id'] = int(agent['api_id']) if agent['api_id'] is not None else None
+    except (TypeError, ValueError):
+        agent['api_id'] = None
+
+    missing = [k for k, v in agent.items() if not v]
+    if missing:
+        raise Exception(f'Missing required config fields: {", ".join(missing)}')
+    return agent
+
+
+# The agent accounts uploads can go through: the top level account plus
+# any listed under "agents", each with its own session file
+agents = []
+if configdata.get('entity'):
+    agents.append(load_agent(configdata))
+agents += [load_agent(agent_config) for agent_config in configdata.get('agents', [])]
+if not agents:
+    raise Exception('Missing required config fields: entity, api_id, api_hash, phone')
+
+# the first agent is the one the one-shot uploader uses
+entity = agents[0]['entity']  # session name - it doesn't matter what
+api_id = agents[0]['api_id']
+api_hash = agents[0]['api_hash']
+phone = agents[0]['phone']
+
+# Upload tuning: part size in KB (must divide 512) and number of parts kept
+# in flight at once. upload_workers = 1 uses Telethon's sequential upload.
+upload_part_size_kb = valid_part_size_kb(configdata.get('upload_part_size_kb', 512))
+upload_workers = int(configdata.get('upload_workers', 4))
+
+# Paces each agent's messages to the bot. FloodWaits up to max_flood_wait
+# seconds are waited out, longer ones fail the upload (the daemon then moves
+# it to another agent).
+send_limiter = SendLimiter(
+    rate=float(configdata.get('send_rate', 1.0)),
+    max_flood_wait=int(configdata.get('max_flood_wait', 60))
+)
 
 
 async def callback(current, total):
@@ -78,44 +109,100 @@ async def callback(current, total):
 '''
 bot_name = the actual bot name
 file_path = where the file is downloaded
-chat_id = this is the end user chat_id, sent over caption to bot,
-            so it can parse and send it to the correct user
+chat_id = the end user chat_id that asked for the episode (only logged;
+            the bot keeps the chats waiting for each job itself)
 object_id = an internal id used for mapping of file_id
             and filename stored in the server(for optimization).
+            It is sent as the caption "job:<object_id>", so the bot can
+            look up the job the video belongs to.
 '''
 
 
-async def uploadVideo(bot_name, file_path, chat_id, object_id):
-    logger.info('video uploading initiated')
-    
-    # Resolve file path
+def resolve_file_path(file_path):
     file_path = Path(file_path)
     if not file_path.is_absolute():
         file_path = PROJECT_ROOT / file_path
     
     if not file_path.exists():
         raise FileNotFoundError(f'File not found: {file_path}')
-    
+    return file_path
+
+
+async def connect_client(agent=None):
+    """
+    Create a TelegramClient for an agent account (the first one by
+    default), connected and authorized
+    """
+    agent = agent or agents[0]
     # Session file path
-    session_path = PROJECT_ROOT / f'{entity}.session'
-    
-    async with TelegramClient(str(session_path), api_id, api_hash) as client:
-        if not await client.is_user_authorized():
-            # await client.send_code_request(phone)
-            # at the first start - uncomment, after authorization to avoid
-            # FloodWait I advise you to comment
-            code = input('Enter code: ')
-            await client.sign_in(phone, code)
-        
-        await client.send_file(
-            str(bot_name),
-            str(file_path),
-            caption=str(chat_id) + ':' + str(object_id),
-            attributes=[DocumentAttributeVideo(0, 0, 0)],
-            progress_callback=callback,
-            part_size_kb=512,
-            supports_streaming=True,
+    session_path = PROJECT_ROOT / f"{agent['entity']}.session"
+
+    client = TelegramClient(str(session_path), agent['api_id'], agent['api_hash'])
+    await client.connect()
+    if not await client.is_user_authorized():
+        # await client.send_code_request(phone)
+        # at the first start - uncomment, after authorization to avoid
+        # FloodWait I advise you to comment
+        code = input(f"Enter code for {agent['phone']}: ")
+        await client.sign_in(agent['phone'], code)
+    return client
+
+
+async def sendVideo(client, bot_name, file_path, chat_id, object_id,
+                    progress_callback=callback):
+    """
+    Send an episode to the bot over an already connected client.
+    Returns a dict with the bytes sent, wall time and achieved MB/s.
+    """
+    file_path = resolve_file_path(file_path)
+    logger.info(f'Sending {object_id} to {bot_name} for chat {chat_id}')
+    started = time.monotonic()
+    if upload_workers > 1:
+        upload_file, stats = await parallel_upload(
+            client, str(file_path),
+            part_size_kb=upload_part_size_kb,
+            workers=upload_workers,
+            progress_callback=progress_callback,
         )
+    else:
+        upload_file, stats = str(file_path), None
+
+    # paced per agent client, as Telegram limits each account
+    await send_limiter.run(
+        id(client),
+        client.send_file,
+        str(bot_name),
+        upload_file,
+        caption=f'job:{object_id}',
+        # our own attributes replace Telethon's, so streaming is flagged here
+        attributes=[DocumentAttributeVideo(0, 0, 0, supports_streaming=True)],
+        progress_callback=progress_callback,
+        part_size_kb=upload_part_size_kb,
+        supports_streaming=True,
+    )
+
+    if stats:
+        return stats.as_dict()
+    size = file_path.stat().st_size
+    seconds = time.monotonic() - started
+    return {
+        'bytes': size,
+        'seconds': round(seconds, 3),
+        'mb_per_s': round(size / (1024 * 1024) / seconds, 2) if seconds else 0.0,
+    }
+
+
+async def uploadVideo(bot_name, file_path, chat_id, object_id):
+    logger.info('video uploading initiated')
+    
+    # Resolve file path before paying for the connection
+    file_path = resolve_file_path(file_path)
+
+    client = await connect_client()
+    try:
+        stats = await sendVideo(client, bot_name, file_path, chat_id, object_id)
+        logger.info(f"Upload finished at {stats['mb_per_s']} MB/s")
+    finally:
         await client.disconnect()
     return 0
 
@@ -132,7 +219,6 @@ async def main(argv):
 
 
 if __name__ == '__main__':
-    import sys
     try:
         asyncio.run(main(sys.argv))
     except KeyboardInterrupt:
@@ -0,0 +1,164 @@
+'''
+Parallel chunked uploads for large episodes.
+
+client.send_file uploads a file one part at a time, so every part waits for
+the previous round trip. Here the file is split into parts up front and a
+pool of workers keeps several SaveBigFilePartRequest calls in flight at
+once; the assembled InputFileBig is then passed to send_file, which only has
+to send the message.
+'''
+import asyncio
+import hashlib
+import logging
+import math
+import os
+import time
+
+from telethon import helpers
+from telethon.errors import ServerError
+from telethon.tl.functions.upload import SaveBigFilePartRequest, SaveFilePartRequest
+from telethon.tl.types import InputFile, InputFileBig
+
+logger = logging.getLogger(__name__)
+
+# Telegram only accepts part sizes that divide 512 KB evenly
+MAX_PART_SIZE_KB = 512
+# and at most this many parts per file
+MAX_PARTS = 4000
+# Files up to this size must be uploaded as "small" files with an md5
+BIG_FILE_THRESHOLD = 10 * 1024 * 1024
+PART_RETRIES = 3
+
+
+class PartRejected(Exception):
+    """Telegram answered a part upload with False"""
+
+
+# worth another try of the same part. A FloodWaitError is not: it is raised
+# at once, so the caller can honour e.seconds or move on to another agent
+TRANSIENT_ERRORS = (PartRejected, OSError, asyncio.TimeoutError, ServerError)
+
+
+def valid_part_size_kb(part_size_kb):
+    part_size_kb = int(part_size_kb)
+    if part_size_kb <= 0 or MAX_PART_SIZE_KB % part_size_kb:
+        logger.warning(
+            f'Invalid part size {part_size_kb}KB (must divide {MAX_PART_SIZE_KB}KB), '
+            f'using {MAX_PART_SIZE_KB}KB'
+        )
+        return MAX_PART_SIZE_KB
+    return part_size_kb
+
+
+def part_size_for(size, part_size_kb):
+    """
+    The part size in KB to upload size bytes with: part_size_kb, doubled
+    (like Telethon does) until the file fits in MAX_PARTS parts
+    """
+    part_size_kb = valid_part_size_kb(part_size_kb)
+    while math.ceil(size / (part_size_kb * 1024)) > MAX_PARTS:
+        if part_size_kb == MAX_PART_SIZE_KB:
+            raise ValueError(
+                f'{size} bytes do not fit in {MAX_PARTS} parts of {MAX_PART_SIZE_KB}KB'
+            )
+        part_size_kb *= 2
+    return part_size_kb
+
+
+class UploadStats:
+    def __init__(self, size):
+        self.size = size
+        self.uploaded = 0
+        self.started = time.monotonic()
+        self.finished = None
+
+    @property
+    def seconds(self):
+        return (self.finished or time.monotonic()) - self.started
+
+    @property
+    def mb_per_s(self):
+        return self.size / (1024 * 1024) / self.seconds if self.seconds else 0.0
+
+    def as_dict(self):
+        return {
+            'bytes': self.size,
+            'seconds': round(self.seconds, 3),
+            'mb_per_s': round(self.mb_per_s, 2),
+        }
+
+
+async def parallel_upload(client, file_path, part_size_kb=MAX_PART_SIZE_KB, workers=4,
+                          progress_callback=None):
+    """
+    Upload file_path to Telegram using `workers` concurrent part uploads.
+    Returns (input_file, stats) where input_file can be passed to send_file.
+    """
+    size = os.path.getsize(file_path)
+    part_size = part_size_for(size, part_size_kb) * 1024
+    total_parts = max(1, math.ceil(size / part_size))
+    is_big = size > BIG_FILE_THRESHOLD
+    file_id = helpers.generate_random_long()
+    stats = UploadStats(size)
+
+    parts = asyncio.Queue()
+    for index in range(total_parts):
+        parts.put_nowait(index)
+
+    async def save_part(index, data):
+        if is_big:
+            request = SaveBigFilePartRequest(file_id, index, total_parts, data)
+        else:
+            request = SaveFilePartRequest(file_id, index, data)
+        for attempt in range(1, PART_RETRIES + 1):
+            try:
+                if not await client(request):
+                    raise PartRejected(f'Telegram rejected part {index}')
+                return
+            except TRANSIENT_ERRORS as e:
+                if attempt == PART_RETRIES:
+                    raise
+                logger.warning(f'Part {index} failed ({e}), retry {attempt}/{PART_RETRIES}')
+                await asyncio.sleep(attempt)
+
+    async def worker():
+        # each worker has its own handle so seeks do not interfere
+        with open(file_path, 'rb') as stream:
+            while True:
+                try:
+                    index = parts.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                stream.seek(index * part_size)
+                data = stream.read(part_size)
+                await save_part(index, data)
+                stats.uploaded += len(data)
+                if progress_callback:
+                    result = progress_callback(stats.uploaded, size)
+                    if asyncio.iscoroutine(result):
+                        await result
+
+    tasks = [asyncio.create_task(worker()) for _ in range(max(1, min(workers, total_parts)))]
+    try:
+        await asyncio.gather(*tasks)
+    except Exception:
+        for task in tasks:
+            task.cancel()
+        raise
+    stats.finished = time.monotonic()
+
+    name = os.path.basename(file_path)
+    if is_big:
+        input_file = InputFileBig(file_id, total_parts, name)
+    else:
+        md5 = hashlib.md5()
+        with open(file_path, 'rb') as stream:
+            for chunk in iter(lambda: stream.read(1024 * 1024), b''):
+                md5.update(chunk)
+        input_file = InputFile(file_id, total_parts, name, md5.hexdigest())
+
+    logger.info(
+        f'Uploaded {name}: {size} bytes in {total_parts} parts of {part_size // 1024}KB '
+        f'with {len(tasks)} workers, {stats.seconds:.1f}s ({stats.mb_per_s:.2f} MB/s)'
+    )
+    return input_file, stats
@@ -0,0 +1,88 @@
+'''
+Pacing of the agents' messages to the bot.
+
+Each agent account may send about one message a second before Telegram
+answers with a FloodWait. The limiter spaces every agent's sends 1 / rate
+seconds apart and waits out FloodWaits of up to max_flood_wait seconds,
+holding that agent back meanwhile. Longer FloodWaits are raised so the
+daemon can move the upload to another agent.
+'''
+import asyncio
+import logging
+import time
+
+from telethon.errors import FloodWaitError
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RATE = 1.0
+DEFAULT_MAX_RETRIES = 3
+
+
+class SendLimiter:
+    def __init__(self, rate=DEFAULT_RATE, max_flood_wait=None, max_retries=DEFAULT_MAX_RETRIES,
+                 clock=time.monotonic, sleep=asyncio.sleep):
+        '''
+        max_flood_wait: FloodWaits longer than this are raised to the caller
+        instead of being waited out (None waits out any FloodWait).
+        '''
+        self.interval = 1 / rate
+        self.max_flood_wait = max_flood_wait
+        self.max_retries = max_retries
+        self.clock = clock
+        self.sleep = sleep
+        # agent -> when its next send may go out
+        self._next_send = {}
+        self.calls = 0
+        self.delayed = 0
+        self.wait_seconds = 0.0
+        self.flood_waits = 0
+        self.flood_wait_seconds = 0.0
+
+    async def acquire(self, agent):
+        """Wait until agent may send again; returns the seconds waited"""
+        now = self.clock()
+        send_at = max(now, self._next_send.get(agent, now))
+        self._next_send[agent] = send_at + self.interval
+        self.calls += 1
+        wait = send_at - now
+        if wait > 0:
+            self.delayed += 1
+            self.wait_seconds += wait
+            await self.sleep(wait)
+        return wait
+
+    def flood_wait(self, agent, seconds):
+        """Telegram asked agent to pause: hold its sends back for seconds"""
+        self.flood_waits += 1
+        self.flood_wait_seconds += seconds
+        self._next_send[agent] = max(self._next_send.get(agent, 0.0), self.clock() + seconds)
+
+    async def run(self, agent, func, /, *args, **kwargs):
+        """
+        Await func(*args, **kwargs) once agent may send, waiting out and
+        retrying FloodWaits up to max_retries times.
+        """
+        attempt = 0
+        while True:
+            await self.acquire(agent)
+            try:
+                return await func(*args, **kwargs)
+            except FloodWaitError as e:
+                if attempt >= self.max_retries or (
+                    self.max_flood_wait is not None and e.seconds > self.max_flood_wait
+                ):
+                    raise
+                attempt += 1
+                logger.warning(f'FloodWait of {e.seconds}s for agent {agent}, retrying')
+                self.flood_wait(agent, e.seconds)
+
+    def stats(self):
+        return {
+            'calls': self.calls,
+            'delayed': self.delayed,
+            'wait_seconds': round(self.wait_seconds, 2),
+            'flood_waits': self.flood_waits,
+            'flood_wait_seconds': round(self.flood_wait_seconds, 1),
+            'agents': len(self._next_send),
+        }